@@ -4,6 +4,7 @@ Flask application factory
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy import event
 from config import config
 import os
 
@@ -11,6 +12,11 @@ db = SQLAlchemy()
 login_manager = LoginManager()
 
 
+def _enable_incremental_vacuum(dbapi_connection, connection_record):
+    """Let new SQLite databases return space freed by purged uploads incrementally"""
+    dbapi_connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+
 def create_app(config_name='default'):
     """Create and configure the Flask application"""
     # Set instance path explicitly
@@ -21,6 +27,8 @@ def create_app(config_name='default'):
     
     # Ensure required directories exist
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['SNAPSHOT_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['MATRIX_FOLDER'], exist_ok=True)
     os.makedirs(app.instance_path, exist_ok=True)
     
     # Initialize extensions
@@ -28,6 +36,16 @@ def create_app(config_name='default'):
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     
+    # Configure the logged-in user cache
+    from app.models import user_cache
+    user_cache.configure(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+    
+    # Configure the computed analytics cache
+    from app.utils.cache import analytics_cache, shared_backend
+    analytics_cache.configure(max_bytes=app.config['ANALYTICS_CACHE_BYTES'],
+                              backend=shared_backend(app.config['ANALYTICS_CACHE_URL']),
+                              ttl=app.config['ANALYTICS_CACHE_TTL'])
+    
     # Register blueprints
     from app.auth import auth_bp
     from app.main import main_bp
@@ -37,8 +55,21 @@ def create_app(config_name='default'):
     app.register_blueprint(main_bp)
     app.register_blueprint(analysis_bp, url_prefix='/analysis')
     
-    # Create database tables
+    # Register CLI commands
+    from app.cli import register_cli
+    register_cli(app)
+    
     with app.app_context():
-        db.create_all()
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _enable_incremental_vacuum)
+        
+        # Create or upgrade database tables (production runs `flask init-db` at deploy instead)
+        if app.config['AUTO_CREATE_DB']:
+            from app.utils.schema import upgrade_schema
+            upgrade_schema()
+    
+    # Purge uploads left deleted by an earlier process (PURGE_IN_BACKGROUND)
+    from app.utils.purge import start_purge_worker
+    start_purge_worker(app)
     
     return app
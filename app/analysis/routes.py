@@ -1,20 +1,39 @@
 """
 Data analysis routes
 """
-from flask import render_template, request, redirect, url_for, flash, current_app, jsonify
+from flask import (render_template, request, redirect, url_for, flash, current_app, jsonify,
+                   abort, Response, send_file, stream_with_context)
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from app.analysis import analysis_bp
-from app.models import DataUpload, SubjectChoice, StudentChoice
+from app.models import DataUpload, SubjectChoice, StudentChoice, SubjectMapping
 from app import db
 from app.utils.data_processor import (process_data_file, allowed_file, 
-                                     read_subject_choices_file, 
-                                     calculate_subject_totals,
-                                     extract_academic_year_from_filename)
-from app.utils.subject_mappings import normalize_subject_name
+                                     choice_categories, extract_academic_year_from_filename)
+from app.utils.parse_pool import parse_upload
+from app.utils.renormalize import renormalize_uploads
+from app.utils.ingest import import_upload
+from app.utils.reupload import update_upload
+from app.utils.user_stats import adjust_user_stats
+from app.utils.coincidence import load_coincidence_counts
+from app.utils.forecast import forecast_demand, forecast_uploads
+from app.utils.inclusion import VersionConflict, apply_inclusion_changes, recalculate_upload
+from app.utils.purge import mark_upload_deleted, request_purge
+from app.utils.statistics import refresh_statistics
+from app.utils.cache import analytics_cache
+from app.utils.snapshots import (load_year_group_snapshots, rebuild_year_group,
+                                 refresh_snapshots, snapshot_path, year_summary_from_snapshots)
+from app.utils.upload_files import file_extension, save_upload
+from app.utils.exporters import (EXPORT_MIMETYPES, STUDENT_HEADER, SUBJECT_TOTAL_HEADER,
+                                 iter_csv, write_xlsx, student_rows, subject_total_rows,
+                                 coincidence_export)
+import gzip
+import json
 import os
 from datetime import datetime
 
+YEAR_GROUPS = ['S3', 'S4', 'S5-6']
+
 
 @analysis_bp.route('/upload', methods=['GET', 'POST'])
 @login_required
@@ -29,6 +48,19 @@ def upload():
         file = request.files['file']
         year_group = request.form.get('year_group')
         
+        # Optionally apply the file as a new export of an existing upload
+        target = None
+        update_upload_id = request.form.get('update_upload_id', type=int)
+        if update_upload_id:
+            target = DataUpload.get_active_or_404(update_upload_id)
+            if target.user_id != current_user.id:
+                flash('Unauthorized access', 'error')
+                return redirect(url_for('main.dashboard'))
+            if not target.processed:
+                flash('Only processed uploads can be updated', 'error')
+                return redirect(request.url)
+            year_group = target.year_group
+        
         if file.filename == '':
             flash('No file selected', 'error')
             return redirect(request.url)
@@ -46,34 +78,90 @@ def upload():
             unique_filename = f"{timestamp}_{filename}"
             
             filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(filepath)
+            try:
+                content_hash, _ = save_upload(file.stream, filepath,
+                                              current_app.config['MAX_DECOMPRESSED_LENGTH'])
+            except ValueError as e:
+                flash(f'Could not accept {filename}: {str(e)}', 'error')
+                return redirect(request.url)
+            
+            if target is not None:
+                return _update_from_file(target, unique_filename, content_hash)
+            
+            # Identical files are accepted again (e.g. under another year group), with a note
+            existing = DataUpload.query.filter_by(user_id=current_user.id, content_hash=content_hash,
+                                                  deleted_at=None).first()
+            if existing:
+                flash(f'Note: this file was already uploaded as {existing.original_filename} '
+                      f'({existing.year_group}); it has been added again as a separate upload', 'info')
             
             # Create database record
-            file_ext = filename.rsplit('.', 1)[1].lower()
+            file_ext = file_extension(filename)
             upload = DataUpload(
                 filename=unique_filename,
                 original_filename=filename,
                 file_type=file_ext,
                 year_group=year_group,
+                academic_year=extract_academic_year_from_filename(filename),
+                content_hash=content_hash,
                 user_id=current_user.id
             )
             db.session.add(upload)
+            adjust_user_stats(current_user.id, uploads=1)
             db.session.commit()
             
             flash('File uploaded successfully! Processing...', 'success')
             return redirect(url_for('analysis.process', upload_id=upload.id))
         else:
-            flash('Invalid file type. Please upload CSV or Excel files.', 'error')
+            flash('Invalid file type. Please upload CSV, Excel, .csv.gz or zipped CSV files.', 'error')
             return redirect(request.url)
     
-    return render_template('upload.html')
+    uploads = DataUpload.query.filter_by(user_id=current_user.id, processed=True, deleted_at=None)\
+        .order_by(DataUpload.upload_date.desc()).all()
+    return render_template('upload.html', uploads=uploads,
+                           update_upload_id=request.args.get('update', type=int))
+
+
+def _update_from_file(upload, stored_filename, content_hash):
+    """Apply a stored file to an existing upload as a row-level diff and replace its file"""
+    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_filename)
+    if content_hash == upload.content_hash:
+        os.remove(filepath)
+        flash('This file is identical to the one already uploaded; nothing changed', 'info')
+        return redirect(url_for('analysis.view_data', upload_id=upload.id))
+    
+    previous_file = os.path.join(current_app.config['UPLOAD_FOLDER'], upload.filename)
+    try:
+        df = parse_upload(filepath, upload.year_group, current_app.config)
+        counts = update_upload(upload, df)
+        upload.filename = stored_filename
+        upload.file_type = file_extension(stored_filename)
+        upload.content_hash = content_hash
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        os.remove(filepath)
+        current_app.logger.error(f'Error updating upload {upload.id}: {str(e)}')
+        flash(f'Error updating upload: {str(e)}', 'error')
+        return redirect(url_for('analysis.view_data', upload_id=upload.id))
+    
+    try:
+        os.remove(previous_file)
+    except FileNotFoundError:
+        pass
+    _refresh_snapshots(upload)
+    _store_choice_matrix(upload)
+    
+    flash(f"Upload updated: {counts['inserted']} students added, {counts['updated']} changed, "
+          f"{counts['deleted']} removed, {counts['unchanged']} unchanged", 'success')
+    return redirect(url_for('analysis.view_data', upload_id=upload.id))
 
 
 @analysis_bp.route('/process/<int:upload_id>')
 @login_required
 def process(upload_id):
     """Process uploaded data file"""
-    upload = DataUpload.query.get_or_404(upload_id)    
+    upload = DataUpload.get_active_or_404(upload_id)    
     # Check if we need to review mappings first
     if not upload.processed and not request.args.get('skip_review'):
         # Redirect to review mappings page
@@ -90,54 +178,15 @@ def process(upload_id):
     try:
         # Process the file
         filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], upload.filename)
-        df = read_subject_choices_file(filepath, upload.year_group)
-        
-        # Extract academic year from filename if not set
-        academic_year = extract_academic_year_from_filename(upload.original_filename)
-        
-        # Import into StudentChoice staging table
-        for _, row in df.iterrows():
-            student = StudentChoice(
-                upload_id=upload.id,
-                forename=row.get('forename', ''),
-                surname=row.get('surname', ''),
-                reg_class=row.get('reg_class', ''),
-                year_group=upload.year_group,
-                academic_year=academic_year,
-                choice_a=normalize_subject_name(row.get('choice_a', ''), upload.year_group),
-                choice_b=normalize_subject_name(row.get('choice_b', ''), upload.year_group),
-                choice_c=normalize_subject_name(row.get('choice_c', ''), upload.year_group),
-                choice_d=normalize_subject_name(row.get('choice_d', ''), upload.year_group),
-                choice_e=normalize_subject_name(row.get('choice_e', ''), upload.year_group),
-                choice_f=normalize_subject_name(row.get('choice_f', ''), upload.year_group),
-                choice_g=normalize_subject_name(row.get('choice_g', ''), upload.year_group),
-                choice_h=normalize_subject_name(row.get('choice_h', ''), upload.year_group),
-                included_in_analysis=True
-            )
-            db.session.add(student)
-        
-        # Calculate subject totals
-        db.session.flush()  # Get IDs for student records
-        students = StudentChoice.query.filter_by(upload_id=upload.id).all()
-        subject_counts = calculate_subject_totals(students, year_group=upload.year_group)
+        df = parse_upload(filepath, upload.year_group, current_app.config)
         
-        # Store aggregated results
-        for subject, count in subject_counts.items():
-            subject_choice = SubjectChoice(
-                year_group=upload.year_group,
-                subject_name=subject,
-                choice_count=count,
-                academic_year=academic_year,
-                upload_id=upload.id
-            )
-            db.session.add(subject_choice)
-        
-        # Update upload record
-        upload.processed = True
-        upload.record_count = len(students)
+        # Import the student rows, totals and pair counts
+        student_count = import_upload(upload, df)
         db.session.commit()
+        _refresh_snapshots(upload)
+        _store_choice_matrix(upload)
         
-        flash(f'Successfully imported {len(students)} student records!', 'success')
+        flash(f'Successfully imported {student_count} student records!', 'success')
         return redirect(url_for('analysis.view_data', upload_id=upload_id))
         
     except Exception as e:
@@ -151,7 +200,7 @@ def process(upload_id):
 @login_required
 def results(upload_id):
     """Display analysis results"""
-    upload = DataUpload.query.get_or_404(upload_id)
+    upload = DataUpload.get_active_or_404(upload_id)
     
     # Verify ownership
     if upload.user_id != current_user.id:
@@ -162,9 +211,16 @@ def results(upload_id):
     subject_choices = SubjectChoice.query.filter_by(upload_id=upload_id)\
         .order_by(SubjectChoice.choice_count.desc()).all()
     
+    # Uploads processed before profiles were stored get one on first view
+    statistics = upload.statistics
+    if statistics is None and upload.processed:
+        statistics = refresh_statistics(upload)
+        db.session.commit()
+    
     return render_template('results.html',
                          upload=upload,
-                         subject_choices=subject_choices)
+                         subject_choices=subject_choices,
+                         statistics=statistics)
 
 
 @analysis_bp.route('/compare')
@@ -178,7 +234,9 @@ def compare():
         SubjectChoice.year_group,
         SubjectChoice.subject_name,
         func.sum(SubjectChoice.choice_count).label('total_count')
-    ).group_by(SubjectChoice.year_group, SubjectChoice.subject_name)\
+    ).join(DataUpload, DataUpload.id == SubjectChoice.upload_id)\
+     .filter(DataUpload.deleted_at.is_(None))\
+     .group_by(SubjectChoice.year_group, SubjectChoice.subject_name)\
      .order_by(SubjectChoice.subject_name, SubjectChoice.year_group).all()
     
     # Organize data for display
@@ -195,7 +253,7 @@ def compare():
 @login_required
 def view_data(upload_id):
     """View student data from upload with ability to include/exclude"""
-    upload = DataUpload.query.get_or_404(upload_id)
+    upload = DataUpload.get_active_or_404(upload_id)
     
     # Verify ownership
     if upload.user_id != current_user.id:
@@ -232,104 +290,116 @@ def toggle_student(student_id):
     
     # Verify ownership through upload
     upload = DataUpload.query.get(student.upload_id)
-    if not upload or upload.user_id != current_user.id:
+    if not upload or upload.deleted_at is not None or upload.user_id != current_user.id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    # Toggle inclusion
-    student.included_in_analysis = not student.included_in_analysis
-    db.session.commit()
+    # Toggle inclusion and apply the change to the stored pair counts
+    version, states = apply_inclusion_changes(upload, {student.id: not student.included_in_analysis})
     
     # Recalculate totals
-    recalculate_totals(student.upload_id)
+    if recalculate_upload(upload.id):
+        _refresh_snapshots(upload)
+        _store_choice_matrix(upload, inclusion_only=True)
     
     return jsonify({
         'success': True,
-        'included': student.included_in_analysis
+        'included': states[student.id],
+        'version': version
     })
 
 
-@analysis_bp.route('/summary/<year_group>')
+@analysis_bp.route('/toggle_students/<int:upload_id>', methods=['POST'])
 @login_required
-def year_summary(year_group):
-    """View summary and year-on-year comparison for a year group"""
-    from sqlalchemy import func
+def toggle_students(upload_id):
+    """
+    Set the inclusion of several students in one write
     
-    # Get all uploads for this year group
-    uploads = DataUpload.query.filter_by(
-        user_id=current_user.id,
-        year_group=year_group, 
-        processed=True
-    ).order_by(DataUpload.upload_date.desc()).all()
-    
-    # Build detailed comparison data
-    upload_data = []
-    for upload in uploads:
-        # Get total included students for this upload
-        total_included = StudentChoice.query.filter_by(
-            upload_id=upload.id,
-            included_in_analysis=True
-        ).count()
-        
-        # Get subject choices with counts and percentages
-        subjects = SubjectChoice.query.filter_by(upload_id=upload.id)\
-            .order_by(SubjectChoice.choice_count.desc()).all()
-        
-        subject_list = []
-        for subject in subjects:
-            subject_list.append({
-                'name': subject.subject_name,
-                'count': subject.choice_count,
-                'percentage': round((subject.choice_count / total_included * 100) if total_included > 0 else 0, 1)
-            })
-        
-        upload_data.append({
-            'id': upload.id,
-            'filename': upload.original_filename,
-            'upload_date': upload.upload_date,
-            'academic_year': upload.original_filename,  # Extract from filename
-            'total_students': upload.record_count,
-            'included_students': total_included,
-            'subjects': subject_list
-        })
-    
-    # Build comparison matrix (all unique subjects across all uploads)
-    all_subjects = set()
-    for data in upload_data:
-        for subject in data['subjects']:
-            all_subjects.add(subject['name'])
+    Expects a JSON body {"version": <data_version seen>, "changes": {"<student id>": true|false}}.
+    Responds 409 with the current version and states if the upload changed meanwhile.
+    """
+    upload = DataUpload.get_active_or_404(upload_id)
     
-    # Create comparison table
-    comparison_data = []
-    for subject_name in sorted(all_subjects):
-        row = {'subject': subject_name, 'uploads': []}
-        
-        for data in upload_data:
-            # Find this subject in this upload
-            subject_info = next((s for s in data['subjects'] if s['name'] == subject_name), None)
-            if subject_info:
-                row['uploads'].append({
-                    'count': subject_info['count'],
-                    'percentage': subject_info['percentage']
-                })
-            else:
-                row['uploads'].append({
-                    'count': 0,
-                    'percentage': 0.0
-                })
-        
-        comparison_data.append(row)
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
     
-    # Calculate trends (if we have 2+ uploads)
-    if len(upload_data) >= 2:
-        for row in comparison_data:
-            if len(row['uploads']) >= 2:
-                # Calculate change from most recent to previous
-                latest = row['uploads'][0]['count']
-                previous = row['uploads'][1]['count']
-                if previous > 0:
-                    row['change'] = round(((latest - previous) / previous) * 100, 1)
-                else:
-                    row['change'] = 100.0 if latest > 0 else 0.0
+    payload = request.get_json(silent=True) or {}
+    try:
+        changes = {int(student_id): bool(included)
+                   for student_id, included in (payload.get('changes') or {}).items()}
+        version = payload.get('version')
+        version = int(version) if version is not None else None
+    except (AttributeError, TypeError, ValueError):
+        return jsonify({'error': 'Invalid changes'}), 400
+    if not changes:
+        return jsonify({'error': 'No changes'}), 400
+    
+    try:
+        version, states = apply_inclusion_changes(upload, changes, expected_version=version)
+    except VersionConflict as e:
+        return jsonify({
+            'error': 'conflict',
+            'message': str(e),
+            'version': e.version,
+            'students': e.students
+        }), 409
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 400
+    
+    # Recalculation is serialized per upload; concurrent requests share one
+    if recalculate_upload(upload_id):
+        _refresh_snapshots(upload)
+        _store_choice_matrix(upload, inclusion_only=True)
+    
+    included = StudentChoice.query.filter_by(upload_id=upload_id, included_in_analysis=True).count()
+    return jsonify({
+        'success': True,
+        'version': version,
+        'students': states,
+        'included_students': included
+    })
+
+
+def _year_summary_data(year_group):
+    """Build per-upload totals and the subject comparison table for a year group"""
+    # Read from the precomputed snapshots (rebuilt here if missing or outdated)
+    snapshots = load_year_group_snapshots(current_app.config['SNAPSHOT_FOLDER'],
+                                          current_user.id, year_group)
+    return year_summary_from_snapshots(snapshots)
+
+
+def _cached(kind, upload, compute, *params):
+    """Compute analytics for an upload through the analytics cache, keyed by its data version"""
+    return analytics_cache.get_or_set(
+        (kind, upload.user_id, upload.id, upload.data_version) + params, compute)
+
+
+def _refresh_snapshots(*uploads):
+    """Rewrite the analytics snapshots covering uploads; failures are only logged"""
+    try:
+        refresh_snapshots(current_app.config['SNAPSHOT_FOLDER'], uploads)
+    except Exception as e:
+        current_app.logger.error(f'Error writing analytics snapshot: {str(e)}')
+
+
+def _store_choice_matrix(upload, inclusion_only=False):
+    """Write the memory-mapped choice matrix of an upload's current version; failures are only logged"""
+    from app.utils.choice_matrix import write_choice_artifact, write_inclusion_artifact
+    
+    try:
+        # Other requests may have changed the upload since this one loaded it
+        db.session.refresh(upload)
+        write = write_inclusion_artifact if inclusion_only else write_choice_artifact
+        write(current_app.config['MATRIX_FOLDER'], upload)
+    except Exception as e:
+        current_app.logger.error(f'Error writing choice matrix for upload {upload.id}: {str(e)}')
+
+
+@analysis_bp.route('/summary/<year_group>')
+@login_required
+def year_summary(year_group):
+    """View summary and year-on-year comparison for a year group"""
+    upload_data, comparison_data = _year_summary_data(year_group)
     
     return render_template('year_summary.html',
                          year_group=year_group,
@@ -337,94 +407,621 @@ def year_summary(year_group):
                          comparison_data=comparison_data)
 
 
+def _forecast_data(year_group):
+    """Demand forecast for a year group, cached until any of its uploads changes"""
+    uploads = forecast_uploads(current_user.id, year_group)
+    versions = tuple((upload.id, upload.data_version) for upload in uploads)
+    return analytics_cache.get_or_set(('forecast', current_user.id, year_group, versions),
+                                      lambda: forecast_demand(uploads, year_group))
+
+
+@analysis_bp.route('/forecast/<year_group>')
+@login_required
+def forecast(year_group):
+    """Project next year's subject demand for a year group from its history"""
+    return render_template('forecast.html',
+                         year_group=year_group,
+                         forecast=_forecast_data(year_group))
+
+
+@analysis_bp.route('/forecast/<year_group>/data')
+@login_required
+def forecast_data(year_group):
+    """Subject demand forecast for a year group as JSON"""
+    return jsonify(_forecast_data(year_group))
+
+
+@analysis_bp.route('/summary/<year_group>/<academic_year>/data')
+@login_required
+def year_summary_snapshot(year_group, academic_year):
+    """Serve the stored analytics snapshot of one academic year as gzip-compressed JSON"""
+    root = current_app.config['SNAPSHOT_FOLDER']
+    path = snapshot_path(root, current_user.id, year_group, academic_year)
+    # Brings the year group's snapshots up to date (rebuilding them if needed)
+    load_year_group_snapshots(root, current_user.id, year_group)
+    if not os.path.exists(path):
+        return jsonify({'error': 'No processed uploads for this academic year'}), 404
+    
+    if 'gzip' not in request.accept_encodings:
+        with gzip.open(path, 'rb') as f:
+            return current_app.response_class(f.read(), mimetype='application/json')
+    response = send_file(path, mimetype='application/json', max_age=0)
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
 @analysis_bp.route('/subject-coincidence/<int:upload_id>')
 @login_required
 def subject_coincidence(upload_id):
     """Show subject combination/coincidence matrix for an upload"""
-    upload = DataUpload.query.get_or_404(upload_id)
+    upload = DataUpload.get_active_or_404(upload_id)
     
     # Verify ownership
     if upload.user_id != current_user.id:
         flash('Unauthorized access', 'error')
         return redirect(url_for('main.dashboard'))
     
-    # Get all included students
-    students = StudentChoice.query.filter_by(
+    total_students = StudentChoice.query.filter_by(
         upload_id=upload_id,
         included_in_analysis=True
-    ).all()
-    
-    # Get all unique subjects from this upload
-    all_subjects = set()
-    for student in students:
-        for choice in student.get_choices():
-            if choice and choice.strip():
-                all_subjects.add(choice.strip())
-    
-    all_subjects = sorted(list(all_subjects))
-    
-    # Build coincidence matrix
-    # For each pair of subjects, count how many students take both
-    coincidence_matrix = {}
-    
-    for subject1 in all_subjects:
-        coincidence_matrix[subject1] = {}
-        for subject2 in all_subjects:
-            # Count students taking both subject1 and subject2
-            count = 0
-            for student in students:
-                choices = [c.strip() for c in student.get_choices() if c and c.strip()]
-                if subject1 in choices and subject2 in choices:
-                    count += 1
-            coincidence_matrix[subject1][subject2] = count
-    
-    # Calculate total students per subject (for diagonal and reference)
-    subject_totals = {}
-    for subject in all_subjects:
-        count = 0
-        for student in students:
-            choices = [c.strip() for c in student.get_choices() if c and c.strip()]
-            if subject in choices:
-                count += 1
-        subject_totals[subject] = count
+    ).count()
     
+    # The matrix itself is fetched from subject_coincidence_data and drawn client-side
     return render_template('subject_coincidence.html',
                          upload=upload,
-                         all_subjects=all_subjects,
-                         coincidence_matrix=coincidence_matrix,
-                         subject_totals=subject_totals,
-                         total_students=len(students))
+                         total_students=total_students)
 
 
-def recalculate_totals(upload_id):
-    """Recalculate subject totals based on included students"""
-    # Delete existing totals
-    SubjectChoice.query.filter_by(upload_id=upload_id).delete()
+@analysis_bp.route('/subject-coincidence/<int:upload_id>/data')
+@login_required
+def subject_coincidence_data(upload_id):
+    """Subject coincidence matrix as a flat row-major integer array plus the subject index"""
+    upload = DataUpload.get_active_or_404(upload_id)
     
-    # Get included students
-    students = StudentChoice.query.filter_by(
-        upload_id=upload_id,
-        included_in_analysis=True
-    ).all()
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    all_subjects, counts = _cached('coincidence', upload, lambda: load_coincidence_counts(upload_id))
+    return _compact_json_response({
+        'upload_id': upload_id,
+        'subjects': all_subjects,
+        'counts': counts
+    })
+
+
+def _compact_json_response(payload):
+    """JSON response without whitespace, gzip-compressed when the client accepts it"""
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    response = current_app.response_class(mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    if 'gzip' in request.accept_encodings:
+        body = gzip.compress(body, compresslevel=6)
+        response.headers['Content-Encoding'] = 'gzip'
+    response.set_data(body)
+    return response
+
+
+def _combination_options():
+    """Read combination-mining parameters from the query string"""
+    min_support = max(1, request.args.get('min_support', 5, type=int) or 1)
+    min_size = min(max(2, request.args.get('min_size', 3, type=int) or 3), 8)
+    max_size = min(max(min_size, request.args.get('max_size', 5, type=int) or 5), 8)
+    limit = max(1, request.args.get('limit', 500, type=int) or 500)
+    return min_support, min_size, max_size, limit
+
+
+def _mine_upload_combinations(upload, min_support, min_size, max_size):
+    """Mine frequent subject combinations among the included students of an upload"""
+    from app.utils.choice_matrix import upload_choice_matrix
+    from app.utils.combinations import mine_frequent_combinations
+    
+    def mine():
+        choice_matrix = upload_choice_matrix(current_app.config['MATRIX_FOLDER'], upload)
+        combinations = mine_frequent_combinations(choice_matrix.matrix, choice_matrix.subjects,
+                                                  min_support=min_support,
+                                                  min_size=min_size,
+                                                  max_size=max_size)
+        return choice_matrix.student_count, combinations
+    
+    return _cached('combinations', upload, mine, min_support, min_size, max_size)
+
+
+@analysis_bp.route('/subject-combinations/<int:upload_id>')
+@login_required
+def subject_combinations(upload_id):
+    """Show frequent 3+ subject combinations for an upload"""
+    from app.utils.combinations import TooManyCombinationsError
+    
+    upload = DataUpload.get_active_or_404(upload_id)
+    
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        flash('Unauthorized access', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    min_support, min_size, max_size, limit = _combination_options()
+    
+    try:
+        total_students, combinations = _mine_upload_combinations(upload, min_support,
+                                                                 min_size, max_size)
+    except TooManyCombinationsError as e:
+        flash(str(e), 'error')
+        total_students, combinations = 0, []
+    
+    for combo in combinations:
+        combo['percentage'] = round(combo['count'] / total_students * 100, 1) if total_students else 0
+    
+    return render_template('subject_combinations.html',
+                         upload=upload,
+                         combinations=combinations[:limit],
+                         combination_count=len(combinations),
+                         total_students=total_students,
+                         min_support=min_support,
+                         min_size=min_size,
+                         max_size=max_size)
+
+
+@analysis_bp.route('/subject-combinations/<int:upload_id>/data')
+@login_required
+def subject_combinations_data(upload_id):
+    """Frequent subject combinations for an upload as JSON"""
+    from app.utils.combinations import TooManyCombinationsError
+    
+    upload = DataUpload.get_active_or_404(upload_id)
+    
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    min_support, min_size, max_size, limit = _combination_options()
+    
+    try:
+        total_students, combinations = _mine_upload_combinations(upload, min_support,
+                                                                 min_size, max_size)
+    except TooManyCombinationsError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'upload_id': upload_id,
+        'total_students': total_students,
+        'min_support': min_support,
+        'min_size': min_size,
+        'max_size': max_size,
+        'combination_count': len(combinations),
+        'combinations': combinations[:limit]
+    })
+
+
+def _option_column_analysis(upload, proposed=None, optimize=False):
+    """
+    Score an upload's option-column arrangement and optionally search for a better one
+    
+    Analyses of the current arrangement are cached; proposed arrangements are
+    scored on every request.
+    
+    Args:
+        upload: DataUpload
+        proposed: Optional {subject: column letters} overrides of the current arrangement
+        optimize: Run a time-limited arrangement search in this process
+            (`flask optimize-columns` runs longer searches in parallel)
+    """
+    if proposed:
+        return _score_option_columns(upload, proposed, optimize)
+    return _cached('option_columns', upload,
+                   lambda: _score_option_columns(upload, None, optimize),
+                   optimize, current_app.config['OPTIMIZER_ITERATIONS'],
+                   current_app.config['OPTIMIZER_SECONDS'])
+
+
+def _score_option_columns(upload, proposed, optimize):
+    """Compute the option-column analysis of _option_column_analysis"""
+    from app.utils.choice_matrix import upload_choice_matrix
+    from app.utils.option_columns import (ClashScorer, arrangement_moves, column_count_for,
+                                          columns_from_letters, current_arrangement,
+                                          describe_arrangement, optimize_arrangement)
+    
+    choice_matrix = upload_choice_matrix(current_app.config['MATRIX_FOLDER'], upload)
+    subjects = choice_matrix.subjects
+    column_count = column_count_for(choice_matrix.slots)
+    arrangement = current_arrangement(choice_matrix.matrix, choice_matrix.slots, column_count)
+    
+    if proposed:
+        index = choice_matrix.subject_index()
+        for subject, letters in proposed.items():
+            if subject not in index:
+                raise ValueError(f'Invalid placement: unknown subject {subject}')
+            try:
+                arrangement[index[subject]] = columns_from_letters(letters, column_count)
+            except ValueError as e:
+                raise ValueError(f'Invalid placement of {subject}: {e}')
+    
+    scorer = ClashScorer.from_matrix(choice_matrix.matrix, column_count)
+    analysis = {
+        'total_students': choice_matrix.student_count,
+        'column_count': column_count,
+        'clashes': scorer.score(arrangement),
+        'columns': describe_arrangement(arrangement, subjects, column_count),
+        'suggestion': None
+    }
+    
+    if optimize:
+        # One bounded search in the request; no worker processes
+        result = optimize_arrangement(choice_matrix.matrix, column_count, arrangement,
+                                      iterations=current_app.config['OPTIMIZER_ITERATIONS'],
+                                      workers=1,
+                                      time_limit=current_app.config['OPTIMIZER_SECONDS'])
+        suggested = result['arrangement']
+        analysis['suggestion'] = {
+            'clashes': result['clashes'],
+            'evaluated': result['evaluated'],
+            'seconds': round(result['seconds'], 3),
+            'columns': describe_arrangement(suggested, subjects, column_count),
+            'moves': arrangement_moves(arrangement, suggested, subjects)
+        }
+    
+    return analysis
+
+
+@analysis_bp.route('/option-columns/<int:upload_id>')
+@login_required
+def option_columns(upload_id):
+    """Show option-column clashes for an upload and suggest better arrangements"""
+    upload = DataUpload.get_active_or_404(upload_id)
+    
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        flash('Unauthorized access', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    analysis = _option_column_analysis(upload, optimize=bool(request.args.get('optimize')))
+    
+    return render_template('option_columns.html',
+                         upload=upload,
+                         analysis=analysis)
+
+
+@analysis_bp.route('/option-columns/<int:upload_id>/data', methods=['GET', 'POST'])
+@login_required
+def option_columns_data(upload_id):
+    """
+    Option-column clash analysis as JSON
+    
+    POST a JSON body {"arrangement": {"Subject": "A", "Other": "BD", ...}} to score
+    a proposed arrangement (the columns each listed subject is offered in);
+    add ?optimize=1 to also run the arrangement search.
+    """
+    upload = DataUpload.get_active_or_404(upload_id)
+    
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    proposed = None
+    if request.method == 'POST':
+        proposed = (request.get_json(silent=True) or {}).get('arrangement') or {}
+    
+    try:
+        analysis = _option_column_analysis(upload, proposed=proposed,
+                                           optimize=bool(request.args.get('optimize')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    analysis['upload_id'] = upload_id
+    return jsonify(analysis)
+
+
+def _export_response(fmt, name, header, rows, sheet_title):
+    """Stream rows as a CSV download or return them as a write-only XLSX workbook"""
+    download_name = f'{secure_filename(name) or "export"}.{fmt}'
+    if fmt == 'csv':
+        return Response(stream_with_context(iter_csv(header, rows)),
+                        mimetype=EXPORT_MIMETYPES['csv'],
+                        headers={'Content-Disposition': f'attachment; filename="{download_name}"'})
+    return send_file(write_xlsx(header, rows, sheet_title),
+                     mimetype=EXPORT_MIMETYPES['xlsx'],
+                     as_attachment=True,
+                     download_name=download_name)
+
+
+def _cohort_uploads():
+    """The current user's processed uploads, for the cohort selectors"""
+    return DataUpload.query.filter_by(user_id=current_user.id, processed=True, deleted_at=None)\
+        .order_by(DataUpload.year_group, DataUpload.upload_date.desc()).all()
+
+
+def _cohort_pair(from_upload_id, to_upload_id):
+    """Load two of the user's processed uploads, or None if either is not theirs"""
+    earlier = DataUpload.get_active_or_404(from_upload_id)
+    later = DataUpload.get_active_or_404(to_upload_id)
+    if earlier.user_id != current_user.id or later.user_id != current_user.id:
+        return None
+    return earlier, later
+
+
+def _transitions_json(transitions):
+    return {
+        'linked_students': transitions['linked'],
+        'from_subjects': transitions['from_subjects'],
+        'to_subjects': transitions['to_subjects'],
+        'from_totals': [int(count) for count in transitions['from_totals']],
+        'matrix': transitions['matrix'].tolist()
+    }
+
+
+@analysis_bp.route('/cohort')
+@login_required
+def cohort():
+    """Track subject choices of a cohort across year groups"""
+    from app.utils.cohort import cohort_upload_pairs, year_group_transitions, describe_transitions
+    
+    from_year_group = request.args.get('from_year_group', 'S4')
+    to_year_group = request.args.get('to_year_group', 'S5-6')
+    if from_year_group not in YEAR_GROUPS or to_year_group not in YEAR_GROUPS:
+        abort(404)
+    
+    pairs = cohort_upload_pairs(current_user.id, from_year_group, to_year_group)
+    # Pairs not linked yet are listed for linking (POST /cohort/link), not linked here
+    transitions = year_group_transitions(pairs, current_app.config['MATRIX_FOLDER']) if pairs else None
+    
+    return render_template('cohort.html',
+                         uploads=_cohort_uploads(),
+                         year_groups=YEAR_GROUPS,
+                         from_year_group=from_year_group,
+                         to_year_group=to_year_group,
+                         pairs=pairs,
+                         unlinked_pairs=transitions['unlinked'] if transitions else [],
+                         earlier=None,
+                         later=None,
+                         summary=None,
+                         transitions=describe_transitions(transitions) if transitions else [],
+                         linked_students=transitions['linked'] if transitions else 0)
+
+
+@analysis_bp.route('/cohort/link', methods=['POST'])
+@login_required
+def cohort_link():
+    """(Re)link the students of two uploads, or every unlinked pair of two year groups"""
+    from app.utils.cohort import link_uploads
+    
+    if request.form.get('from_year_group'):
+        return _link_year_groups(request.form.get('from_year_group'), request.form.get('to_year_group'),
+                                 fuzzy=bool(request.form.get('fuzzy')))
+    
+    pair = _cohort_pair(request.form.get('from_upload_id', type=int),
+                        request.form.get('to_upload_id', type=int))
+    if pair is None:
+        flash('Unauthorized access', 'error')
+        return redirect(url_for('main.dashboard'))
+    earlier, later = pair
+    
+    if earlier.id == later.id:
+        flash('Choose two different uploads', 'error')
+        return redirect(url_for('analysis.cohort'))
+    
+    try:
+        result = link_uploads(earlier.id, later.id, fuzzy=bool(request.form.get('fuzzy')))
+        db.session.commit()
+        flash(f"Linked {result['exact'] + result['fuzzy']} of {result['from_students']} students "
+              f"({result['fuzzy']} by close name match)", 'success')
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Error linking uploads: {str(e)}')
+        flash(f'Error linking uploads: {str(e)}', 'error')
+        return redirect(url_for('analysis.cohort'))
+    
+    return redirect(url_for('analysis.cohort_transitions',
+                            from_upload_id=earlier.id, to_upload_id=later.id))
+
+
+def _link_year_groups(from_year_group, to_year_group, fuzzy):
+    """Link each year's pair of uploads of two year groups that has no stored links"""
+    from app.utils.cohort import cohort_upload_pairs, has_links, link_uploads
+    
+    if from_year_group not in YEAR_GROUPS or to_year_group not in YEAR_GROUPS:
+        abort(404)
+    
+    linked = 0
+    try:
+        for earlier, later in cohort_upload_pairs(current_user.id, from_year_group, to_year_group):
+            if not has_links(earlier.id, later.id):
+                link_uploads(earlier.id, later.id, fuzzy=fuzzy)
+                linked += 1
+        db.session.commit()
+        flash(f'Linked {linked} pair(s) of uploads', 'success')
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Error linking cohorts: {str(e)}')
+        flash(f'Error linking cohorts: {str(e)}', 'error')
+    
+    return redirect(url_for('analysis.cohort', from_year_group=from_year_group, to_year_group=to_year_group))
+
+
+@analysis_bp.route('/cohort/<int:from_upload_id>/<int:to_upload_id>')
+@login_required
+def cohort_transitions(from_upload_id, to_upload_id):
+    """Subject transitions between two linked uploads"""
+    from app.utils.cohort import has_links, link_summary, transition_matrix, describe_transitions
+    
+    pair = _cohort_pair(from_upload_id, to_upload_id)
+    if pair is None:
+        flash('Unauthorized access', 'error')
+        return redirect(url_for('main.dashboard'))
+    earlier, later = pair
+    
+    if not has_links(from_upload_id, to_upload_id):
+        flash('These uploads have not been linked yet', 'info')
+        return redirect(url_for('analysis.cohort'))
+    
+    transitions = transition_matrix(from_upload_id, to_upload_id,
+                                    matrix_folder=current_app.config['MATRIX_FOLDER'])
+    
+    return render_template('cohort.html',
+                         uploads=_cohort_uploads(),
+                         year_groups=YEAR_GROUPS,
+                         from_year_group=earlier.year_group,
+                         to_year_group=later.year_group,
+                         pairs=[],
+                         unlinked_pairs=[],
+                         earlier=earlier,
+                         later=later,
+                         summary=link_summary(from_upload_id, to_upload_id),
+                         transitions=describe_transitions(transitions),
+                         linked_students=transitions['linked'])
+
+
+@analysis_bp.route('/cohort/<int:from_upload_id>/<int:to_upload_id>/data')
+@login_required
+def cohort_transitions_data(from_upload_id, to_upload_id):
+    """Subject transition matrix between two linked uploads as JSON"""
+    from app.utils.cohort import has_links, link_summary, transition_matrix
+    
+    pair = _cohort_pair(from_upload_id, to_upload_id)
+    if pair is None:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    if not has_links(from_upload_id, to_upload_id):
+        return jsonify({'error': 'Uploads have not been linked'}), 404
+    
+    data = _transitions_json(transition_matrix(from_upload_id, to_upload_id,
+                                                        matrix_folder=current_app.config['MATRIX_FOLDER']))
+    data.update({
+        'from_upload_id': from_upload_id,
+        'to_upload_id': to_upload_id,
+        'links': link_summary(from_upload_id, to_upload_id)
+    })
+    return jsonify(data)
+
+
+@analysis_bp.route('/cohort/year-groups/<from_year_group>/<to_year_group>/data')
+@login_required
+def cohort_year_groups_data(from_year_group, to_year_group):
+    """Subject transitions summed over every linked year of two year groups as JSON"""
+    from app.utils.cohort import cohort_upload_pairs, year_group_transitions
+    
+    if from_year_group not in YEAR_GROUPS or to_year_group not in YEAR_GROUPS:
+        return jsonify({'error': 'Unknown year group'}), 404
+    
+    pairs = cohort_upload_pairs(current_user.id, from_year_group, to_year_group)
+    transitions = year_group_transitions(pairs, current_app.config['MATRIX_FOLDER'])
+    
+    data = _transitions_json(transitions)
+    data.update({
+        'from_year_group': from_year_group,
+        'to_year_group': to_year_group,
+        'upload_pairs': [[earlier.id, later.id] for earlier, later in pairs],
+        # Left out of the counts until linked with POST /analysis/cohort/link
+        'unlinked_pairs': [[earlier.id, later.id] for earlier, later in transitions['unlinked']]
+    })
+    return jsonify(data)
+
+
+@analysis_bp.route('/export/<int:upload_id>/<dataset>/<fmt>')
+@login_required
+def export_upload(upload_id, dataset, fmt):
+    """Export student data, subject totals or the coincidence matrix of an upload"""
+    if fmt not in EXPORT_MIMETYPES or dataset not in ('students', 'results', 'coincidence'):
+        abort(404)
+    
+    upload = DataUpload.get_active_or_404(upload_id)
+    
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        flash('Unauthorized access', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    name = f"{upload.original_filename.rsplit('.', 1)[0]}_{dataset}"
+    if dataset == 'students':
+        return _export_response(fmt, name, STUDENT_HEADER, student_rows(upload_id), 'Students')
+    if dataset == 'results':
+        return _export_response(fmt, name, SUBJECT_TOTAL_HEADER, subject_total_rows(upload), 'Results')
+    header, rows = coincidence_export(upload_id)
+    return _export_response(fmt, name, header, rows, 'Subject Combinations')
+
+
+@analysis_bp.route('/export/summary/<year_group>/<fmt>')
+@login_required
+def export_year_summary(year_group, fmt):
+    """Export the subject comparison table of a year group"""
+    if fmt not in EXPORT_MIMETYPES:
+        abort(404)
+    
+    upload_data, comparison_data = _year_summary_data(year_group)
+    
+    header = ['Subject']
+    for data in upload_data:
+        header += [f"{data['filename']} Count", f"{data['filename']} %"]
+    if len(upload_data) >= 2:
+        header.append('Change %')
+    
+    def rows():
+        for row in comparison_data:
+            cells = [row['subject']]
+            for upload_info in row['uploads']:
+                cells += [upload_info['count'], upload_info['percentage']]
+            if len(upload_data) >= 2:
+                cells.append(row.get('change', ''))
+            yield cells
+    
+    return _export_response(fmt, f'{year_group}_summary', header, rows(), f'{year_group} Summary')
+
+
+@analysis_bp.route('/renormalize/<int:upload_id>', methods=['POST'])
+@login_required
+def renormalize_upload(upload_id):
+    """Re-apply the current subject mappings to a processed upload"""
+    upload = DataUpload.get_active_or_404(upload_id)
+    
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        flash('Unauthorized access', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    if not upload.processed:
+        flash('This file has not been processed yet', 'info')
+        return redirect(url_for('main.dashboard'))
     
-    # Get upload details
-    upload = DataUpload.query.get(upload_id)
+    try:
+        result = renormalize_uploads([upload])
+        _refresh_snapshots(upload)
+        _store_choice_matrix(upload)
+        flash(f"Re-normalized {result['cells']} choices "
+              f"({result['values']} subject names changed)", 'success')
+    except Exception as e:
+        current_app.logger.error(f'Error re-normalizing upload: {str(e)}')
+        flash(f'Error re-normalizing upload: {str(e)}', 'error')
     
-    # Calculate new totals with year group for normalization
-    subject_counts = calculate_subject_totals(students, year_group=upload.year_group)
+    return redirect(url_for('analysis.view_data', upload_id=upload_id))
+
+
+@analysis_bp.route('/renormalize/year-group/<year_group>', methods=['POST'])
+@login_required
+def renormalize_year_group(year_group):
+    """Re-apply the current subject mappings to every processed upload of a year group"""
+    uploads = DataUpload.query.filter_by(
+        user_id=current_user.id,
+        year_group=year_group,
+        processed=True,
+        deleted_at=None
+    ).all()
     
-    # Store new totals
-    for subject, count in subject_counts.items():
-        subject_choice = SubjectChoice(
-            year_group=upload.year_group,
-            subject_name=subject,
-            choice_count=count,
-            academic_year=StudentChoice.query.filter_by(upload_id=upload_id).first().academic_year,
-            upload_id=upload_id
-        )
-        db.session.add(subject_choice)
+    if not uploads:
+        flash(f'No processed uploads for {year_group}', 'info')
+        return redirect(url_for('analysis.subject_mappings'))
     
-    db.session.commit()
+    try:
+        result = renormalize_uploads(uploads)
+        _refresh_snapshots(*uploads)
+        for upload in uploads:
+            _store_choice_matrix(upload)
+        flash(f"Re-normalized {result['cells']} choices across {result['uploads']} "
+              f"{year_group} uploads ({result['values']} subject names changed)", 'success')
+    except Exception as e:
+        current_app.logger.error(f'Error re-normalizing uploads: {str(e)}')
+        flash(f'Error re-normalizing uploads: {str(e)}', 'error')
+    
+    return redirect(url_for('analysis.subject_mappings'))
 
 
 @analysis_bp.route('/subject-mappings')
@@ -547,11 +1144,48 @@ def add_subject_mapping_OLD():
     return redirect(url_for('analysis.subject_mappings'))
 
 
+@analysis_bp.route('/academic-year/<int:upload_id>', methods=['POST'])
+@login_required
+def set_academic_year(upload_id):
+    """Correct the academic year an upload is filed under"""
+    upload = DataUpload.get_active_or_404(upload_id)
+    
+    # Verify ownership
+    if upload.user_id != current_user.id:
+        flash('Unauthorized access', 'error')
+        return redirect(url_for('main.dashboard'))
+    
+    # A blank value re-detects the year from the file name
+    value = request.form.get('academic_year', '').strip()
+    academic_year = extract_academic_year_from_filename(value or upload.original_filename)
+    if value and academic_year is None:
+        flash('Enter the academic year as e.g. 2024-25', 'error')
+        return redirect(url_for('analysis.view_data', upload_id=upload_id))
+    
+    try:
+        upload.set_academic_year(academic_year)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Error setting academic year: {str(e)}')
+        flash(f'Error setting academic year: {str(e)}', 'error')
+        return redirect(url_for('analysis.view_data', upload_id=upload_id))
+    
+    # The upload moves between academic year snapshots
+    try:
+        rebuild_year_group(current_app.config['SNAPSHOT_FOLDER'], upload.user_id, upload.year_group)
+    except Exception as e:
+        current_app.logger.error(f'Error writing analytics snapshot: {str(e)}')
+    
+    flash(f"Academic year set to {academic_year or 'unknown'}", 'success')
+    return redirect(url_for('analysis.view_data', upload_id=upload_id))
+
+
 @analysis_bp.route('/delete/<int:upload_id>', methods=['POST'])
 @login_required
 def delete_upload(upload_id):
     """Delete an upload and all associated data"""
-    upload = DataUpload.query.get_or_404(upload_id)
+    upload = DataUpload.get_active_or_404(upload_id)
     
     # Verify ownership
     if upload.user_id != current_user.id:
@@ -559,22 +1193,12 @@ def delete_upload(upload_id):
         return redirect(url_for('main.dashboard'))
     
     try:
-        # Delete associated student choices
-        StudentChoice.query.filter_by(upload_id=upload_id).delete()
-        
-        # Delete associated subject choices
-        SubjectChoice.query.filter_by(upload_id=upload_id).delete()
-        
-        # Delete the file if it exists
-        if upload.filename:
-            filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], upload.filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        
-        # Delete the upload record
+        # Hide the upload now; its rows and file are purged in the background
         filename = upload.original_filename
-        db.session.delete(upload)
+        mark_upload_deleted(upload)
         db.session.commit()
+        _refresh_snapshots(upload)
+        request_purge(current_app._get_current_object())
         
         flash(f'Successfully deleted {filename} and all associated data', 'success')
     except Exception as e:
@@ -591,7 +1215,7 @@ def review_mappings(upload_id):
     """Review and set friendly names for subjects before final processing"""
     from app.utils.subject_mappings import get_all_mappings, normalize_subject_name, save_mappings_to_file
     
-    upload = DataUpload.query.get_or_404(upload_id)
+    upload = DataUpload.get_active_or_404(upload_id)
     
     # Verify ownership
     if upload.user_id != current_user.id:
@@ -625,15 +1249,10 @@ def review_mappings(upload_id):
     # Read the file to find all unique subjects
     try:
         filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], upload.filename)
-        df = read_subject_choices_file(filepath, upload.year_group)
+        df = parse_upload(filepath, upload.year_group, current_app.config)
         
         # Collect all unique subject names from the file
-        all_subjects = set()
-        for letter in ['choice_a', 'choice_b', 'choice_c', 'choice_d', 'choice_e', 'choice_f', 'choice_g', 'choice_h']:
-            if letter in df.columns:
-                subjects = df[letter].dropna().astype(str).str.strip()
-                subjects = subjects[subjects != '']
-                all_subjects.update(subjects.unique())
+        all_subjects = choice_categories(df)
         
         # Check which ones need mapping
         current_mappings = get_all_mappings(upload.year_group)
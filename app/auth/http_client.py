@@ -0,0 +1,113 @@
+"""
+Pooled HTTP client for talking to the OAuth identity provider
+
+requests is imported when the first session is built, keeping it off the
+app's startup path.
+"""
+import threading
+import time
+
+_session = None
+_session_lock = threading.Lock()
+
+# discovery URL -> (expires_at, metadata)
+_discovery_cache = {}
+_discovery_lock = threading.Lock()
+
+
+def _build_session(config):
+    """Create a keep-alive session with bounded connection pools and retries"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    retries = config['OAUTH_MAX_RETRIES']
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        # Never replay a request the provider may already have acted on:
+        # an authorization code can only be exchanged once
+        read=0,
+        status=retries,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({'GET'}),
+        backoff_factor=0.2,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=config['OAUTH_POOL_CONNECTIONS'],
+                          pool_maxsize=config['OAUTH_POOL_MAXSIZE'],
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_http_session(config):
+    """Return the process-wide pooled session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session(config)
+    return _session
+
+
+def reset_http_session():
+    """Close and discard the shared session and cached discovery metadata"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+    with _discovery_lock:
+        _discovery_cache.clear()
+
+
+def request_timeout(config):
+    """(connect, read) timeout tuple for provider requests"""
+    return (config['OAUTH_CONNECT_TIMEOUT'], config['OAUTH_READ_TIMEOUT'])
+
+
+def get_discovery_metadata(config):
+    """
+    Fetch the provider's discovery document, cached for OAUTH_DISCOVERY_TTL seconds
+
+    Returns:
+        dict: The metadata, or {} when no OAUTH_DISCOVERY_URL is configured
+    """
+    url = config.get('OAUTH_DISCOVERY_URL')
+    if not url:
+        return {}
+
+    cached = _discovery_cache.get(url)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    with _discovery_lock:
+        cached = _discovery_cache.get(url)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        response = get_http_session(config).get(url, timeout=request_timeout(config))
+        response.raise_for_status()
+        metadata = response.json()
+        _discovery_cache[url] = (time.monotonic() + config['OAUTH_DISCOVERY_TTL'], metadata)
+        return metadata
+
+
+def get_provider_endpoints(config):
+    """
+    Resolve the authorization, token and userinfo endpoints
+
+    Explicitly configured URLs win; discovery metadata fills in the rest.
+    """
+    configured = {
+        'authorization_endpoint': config.get('OAUTH_AUTHORIZATION_URL'),
+        'token_endpoint': config.get('OAUTH_TOKEN_URL'),
+        'userinfo_endpoint': config.get('OAUTH_USERINFO_URL'),
+    }
+    if all(configured.values()):
+        return configured
+
+    metadata = get_discovery_metadata(config)
+    return {key: value or metadata.get(key) for key, value in configured.items()}
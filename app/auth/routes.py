@@ -4,9 +4,9 @@ Authentication routes
 from flask import render_template, redirect, url_for, request, session, flash, current_app
 from flask_login import login_user, logout_user, login_required
 from app.auth import auth_bp
-from app.models import User
+from app.auth.http_client import get_http_session, get_provider_endpoints, request_timeout
+from app.models import User, invalidate_cached_user
 from app import db
-from authlib.integrations.requests_client import OAuth2Session
 from datetime import datetime
 import secrets
 
@@ -14,6 +14,8 @@ import secrets
 @auth_bp.route('/login')
 def login():
     """Initiate OAuth login"""
+    from authlib.integrations.requests_client import OAuth2Session
+    
     # Create OAuth session
     oauth = OAuth2Session(
         current_app.config['OAUTH_CLIENT_ID'],
@@ -22,8 +24,9 @@ def login():
     )
     
     # Get authorization URL (authlib generates the state token)
+    endpoints = get_provider_endpoints(current_app.config)
     authorization_url, state = oauth.create_authorization_url(
-        current_app.config['OAUTH_AUTHORIZATION_URL']
+        endpoints['authorization_endpoint']
     )
     
     # Store the state token that authlib actually uses
@@ -51,19 +54,14 @@ def callback():
         return redirect(url_for('main.index'))
     
     # Exchange code for token
-    oauth = OAuth2Session(
-        current_app.config['OAUTH_CLIENT_ID'],
-        current_app.config['OAUTH_CLIENT_SECRET'],
-        redirect_uri=current_app.config['OAUTH_REDIRECT_URI']
-    )
-    
     try:
         # Get the authorization code from callback
         code = request.args.get('code')
-        current_app.logger.info(f"Authorization code: {code}")
         
         # Manually prepare token request
-        import requests
+        endpoints = get_provider_endpoints(current_app.config)
+        http = get_http_session(current_app.config)
+        timeout = request_timeout(current_app.config)
         token_data = {
             'grant_type': 'authorization_code',
             'code': code,
@@ -72,33 +70,31 @@ def callback():
             'client_secret': current_app.config['OAUTH_CLIENT_SECRET']
         }
         
-        current_app.logger.info(f"Token URL: {current_app.config['OAUTH_TOKEN_URL']}")
-        current_app.logger.info(f"Token data: {token_data}")
+        current_app.logger.info(f"Token URL: {endpoints['token_endpoint']}")
         
         # Make POST request to token endpoint
-        token_response = requests.post(
-            current_app.config['OAUTH_TOKEN_URL'],
-            data=token_data
+        token_response = http.post(
+            endpoints['token_endpoint'],
+            data=token_data,
+            timeout=timeout
         )
         
         current_app.logger.info(f"Token response status: {token_response.status_code}")
-        current_app.logger.info(f"Token response body: {token_response.text[:500]}")  # First 500 chars
         
         if token_response.status_code != 200:
             current_app.logger.error(f"Token request failed: {token_response.text}")
             raise Exception(f"Token request failed: {token_response.text}")
         
         token = token_response.json()
-        current_app.logger.info(f"Token received: {token}")
         
         # Get user info using the access token
-        user_info_response = requests.get(
-            current_app.config['OAUTH_USERINFO_URL'],
-            headers={'Authorization': f"Bearer {token['access_token']}"}
+        user_info_response = http.get(
+            endpoints['userinfo_endpoint'],
+            headers={'Authorization': f"Bearer {token['access_token']}"},
+            timeout=timeout
         )
         
         current_app.logger.info(f"Userinfo response status: {user_info_response.status_code}")
-        current_app.logger.info(f"Userinfo response body: {user_info_response.text[:500]}")
         
         if user_info_response.status_code != 200:
             error_body = user_info_response.text if user_info_response.text else '(empty response)'
@@ -108,8 +104,7 @@ def callback():
             raise Exception("Userinfo endpoint returned empty response")
             
         user_info = user_info_response.json()
-        
-        print(f"DEBUG - User info: {user_info}")
+        current_app.logger.debug('Userinfo received')
         
         # Find or create user
         user = User.query.filter_by(email=user_info.get('email')).first()
@@ -124,6 +119,7 @@ def callback():
         
         user.last_login = datetime.utcnow()
         db.session.commit()
+        invalidate_cached_user(user.id)
         
         # Log user in
         login_user(user)
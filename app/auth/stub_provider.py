@@ -0,0 +1,117 @@
+"""
+Local stub OAuth identity provider for development, benchmarks and load tests
+
+Implements just enough of the authorization-code flow for the app's login
+and callback routes: authorize, token, userinfo and a discovery document.
+Every authorization succeeds; the user can be chosen with ``login_hint``.
+"""
+import secrets
+import threading
+from urllib.parse import urlencode
+from flask import Flask, request, redirect, jsonify
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+
+def create_stub_provider(default_email='stub.user@example.com'):
+    """Create the stub provider WSGI app"""
+    provider = Flask('stub_oauth_provider')
+    codes = {}
+    tokens = {}
+    lock = threading.Lock()
+
+    def user_for(email):
+        local_part = email.split('@', 1)[0]
+        return {'sub': f'stub-{local_part}', 'email': email,
+                'name': local_part.replace('.', ' ').title()}
+
+    @provider.route('/.well-known/openid-configuration')
+    def discovery():
+        base = request.host_url.rstrip('/')
+        return jsonify({
+            'issuer': base,
+            'authorization_endpoint': f'{base}/oauth/authorize',
+            'token_endpoint': f'{base}/oauth/token',
+            'userinfo_endpoint': f'{base}/oauth/userinfo',
+        })
+
+    @provider.route('/oauth/authorize')
+    def authorize():
+        code = secrets.token_urlsafe(16)
+        with lock:
+            codes[code] = user_for(request.args.get('login_hint') or default_email)
+        query = urlencode({'code': code, 'state': request.args.get('state', '')})
+        return redirect(f"{request.args['redirect_uri']}?{query}")
+
+    @provider.route('/oauth/token', methods=['POST'])
+    def token():
+        with lock:
+            user = codes.pop(request.form.get('code'), None)
+        if user is None:
+            return jsonify({'error': 'invalid_grant'}), 400
+        access_token = secrets.token_urlsafe(24)
+        with lock:
+            tokens[access_token] = user
+        return jsonify({'access_token': access_token, 'token_type': 'Bearer', 'expires_in': 3600})
+
+    @provider.route('/oauth/userinfo')
+    def userinfo():
+        header = request.headers.get('Authorization', '')
+        access_token = header[len('Bearer '):] if header.startswith('Bearer ') else None
+        with lock:
+            user = tokens.get(access_token)
+        if user is None:
+            return jsonify({'error': 'invalid_token'}), 401
+        return jsonify(user)
+
+    return provider
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """Request handler that skips per-request access logging"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class StubProviderServer:
+    """Serve a stub provider on a local port from a background thread"""
+
+    def __init__(self, provider=None, host='127.0.0.1', port=0):
+        self.provider = provider or create_stub_provider()
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def config(self):
+        """App config values pointing the OAuth client at this provider"""
+        return {
+            'OAUTH_AUTHORIZATION_URL': f'{self.url}/oauth/authorize',
+            'OAUTH_TOKEN_URL': f'{self.url}/oauth/token',
+            'OAUTH_USERINFO_URL': f'{self.url}/oauth/userinfo',
+            'OAUTH_DISCOVERY_URL': f'{self.url}/.well-known/openid-configuration',
+        }
+
+    def start(self):
+        self._server = make_server(self.host, self.port, self.provider, threaded=True,
+                                   request_handler=_QuietRequestHandler)
+        self.port = self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
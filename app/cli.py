@@ -0,0 +1,495 @@
+"""
+Flask CLI commands
+"""
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, parse_qs
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+bench_cli = AppGroup('bench', help='Performance benchmarks.')
+
+# Modules that should only load when a request needs them
+LAZY_MODULES = ('pandas', 'numpy', 'openpyxl', 'requests', 'authlib')
+
+# Run in a fresh interpreter by `bench startup`
+STARTUP_SCRIPT = """
+import sys, time
+started = time.perf_counter()
+from app import create_app
+create_app({config_name!r})
+print(time.perf_counter() - started)
+print(' '.join(name for name in {modules!r} if name in sys.modules))
+"""
+
+
+def register_cli(app):
+    """Register the app's CLI commands"""
+    app.cli.add_command(bench_cli)
+    app.cli.add_command(purge_uploads)
+    app.cli.add_command(ingest)
+    app.cli.add_command(init_db)
+    app.cli.add_command(optimize_columns)
+
+
+def latency_summary(samples):
+    """
+    Summarize latency samples (seconds)
+
+    Returns:
+        dict: count, mean and p50/p95/p99/max in milliseconds
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+
+    def percentile(fraction):
+        index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+        return ordered[index] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered) * 1000,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': ordered[-1] * 1000,
+    }
+
+
+def format_latency(name, summary):
+    """One report line for a latency summary"""
+    return (f"{name:<34} n={summary['count']:<6} mean={summary['mean']:8.1f}ms "
+            f"p50={summary['p50']:8.1f}ms p95={summary['p95']:8.1f}ms p99={summary['p99']:8.1f}ms")
+
+
+def stub_login(app, provider_session, email=None):
+    """
+    Log a fresh test client in through the OAuth flow against a stub provider
+
+    Returns:
+        tuple: (test client, seconds spent in the callback)
+    """
+    client = app.test_client()
+    response = client.get('/auth/login')
+    authorize_url = response.headers['Location']
+    if email:
+        authorize_url += f'&login_hint={email}'
+    redirect_to = provider_session.get(authorize_url, allow_redirects=False).headers['Location']
+    query = {key: values[0] for key, values in parse_qs(urlsplit(redirect_to).query).items()}
+
+    started = time.perf_counter()
+    response = client.get('/auth/callback', query_string=query)
+    elapsed = time.perf_counter() - started
+    if response.status_code != 302 or '/dashboard' not in response.headers.get('Location', ''):
+        raise click.ClickException('Stub login failed; check oauth_error.log')
+    return client, elapsed
+
+
+@bench_cli.command('login')
+@click.option('--logins', default=200, show_default=True, help='Number of logins to perform.')
+@click.option('--concurrency', default=4, show_default=True, help='Concurrent logins.')
+def bench_login(logins, concurrency):
+    """Measure OAuth login throughput against a local stub identity provider."""
+    import requests
+    from app.auth.http_client import reset_http_session
+    from app.auth.stub_provider import StubProviderServer
+
+    app = current_app._get_current_object()
+    with StubProviderServer() as provider:
+        original = {key: app.config.get(key) for key in provider.config()}
+        app.config.update(provider.config())
+        reset_http_session()
+        provider_session = requests.Session()
+        try:
+            # Warm up connections, discovery metadata and the user row
+            stub_login(app, provider_session)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                latencies = list(executor.map(
+                    lambda _: stub_login(app, provider_session)[1], range(logins)))
+            elapsed = time.perf_counter() - started
+        finally:
+            provider_session.close()
+            app.config.update(original)
+            reset_http_session()
+
+    click.echo(f'{logins} logins, concurrency {concurrency}: '
+               f'{logins / elapsed:.1f} logins/s in {elapsed:.2f}s')
+    click.echo(format_latency('auth.callback', latency_summary(latencies)))
+
+
+@bench_cli.command('load')
+@click.option('--users', default=4, show_default=True, help='Virtual users, each with its own login and uploads.')
+@click.option('--concurrency', default=4, show_default=True, help='Users running journeys at once.')
+@click.option('--iterations', default=10, show_default=True, help='Journeys run by each user.')
+@click.option('--journey', 'journeys', multiple=True, default=('browse', 'edit', 'analyse'),
+              type=click.Choice(['browse', 'edit', 'analyse']), show_default=True,
+              help='Journeys to choose from at random (repeatable).')
+@click.option('--uploads', default=2, show_default=True, help='Generated uploads per user.')
+@click.option('--pupils', default=200, show_default=True, help='Pupils per generated upload.')
+@click.option('--year-group', default='S4', show_default=True, type=click.Choice(['S3', 'S4', 'S5-6']))
+@click.option('--cleanup/--keep', default=True, show_default=True,
+              help='Delete the generated uploads afterwards.')
+def bench_load(users, concurrency, iterations, journeys, uploads, pupils, year_group, cleanup):
+    """Drive scripted user journeys and report latency per route.
+
+    Users log in through a local stub identity provider and get generated
+    uploads; point DATABASE_URL at a scratch database to keep them apart
+    from real data.
+    """
+    import tempfile
+    import requests
+    from app import db
+    from app.auth.http_client import reset_http_session
+    from app.auth.stub_provider import StubProviderServer
+    from app.models import User
+    from app.utils.loadtest import LoadResults, VirtualUser, run_journeys, seed_uploads
+    from app.utils.purge import mark_upload_deleted, purge_deleted_uploads
+    from app.utils.snapshots import refresh_snapshots
+
+    app = current_app._get_current_object()
+    seeded = []
+    with StubProviderServer() as provider, tempfile.TemporaryDirectory() as workdir:
+        original = {key: app.config.get(key) for key in provider.config()}
+        app.config.update(provider.config())
+        reset_http_session()
+        provider_session = requests.Session()
+        try:
+            started = time.perf_counter()
+            virtual_users = []
+            for index in range(users):
+                email = f'loadtest.user{index}@example.com'
+                client, _ = stub_login(app, provider_session, email)
+                user = User.query.filter_by(email=email).one()
+                created = seed_uploads(user.id, year_group, uploads, pupils, workdir,
+                                       app.config['UPLOAD_FOLDER'],
+                                       app.config['MAX_DECOMPRESSED_LENGTH'], seed=index)
+                seeded.extend(created)
+                virtual_users.append(VirtualUser(client, user.id, year_group, created))
+            refresh_snapshots(app.config['SNAPSHOT_FOLDER'], seeded)
+            click.echo(f'Seeded {users} users with {len(seeded)} uploads of {pupils} pupils '
+                       f'in {time.perf_counter() - started:.2f}s')
+
+            results = LoadResults()
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                for future in [executor.submit(run_journeys, user, list(journeys), iterations, results)
+                               for user in virtual_users]:
+                    future.result()
+            elapsed = time.perf_counter() - started
+        finally:
+            provider_session.close()
+            app.config.update(original)
+            reset_http_session()
+            if cleanup and seeded:
+                db.session.rollback()
+                for upload in seeded:
+                    mark_upload_deleted(upload)
+                db.session.commit()
+                refresh_snapshots(app.config['SNAPSHOT_FOLDER'], seeded)
+                purge_deleted_uploads(app.config['UPLOAD_FOLDER'], app.config['PURGE_BATCH_SIZE'],
+                                      app.config['MATRIX_FOLDER'])
+
+    click.echo(f'{results.requests} requests, {users} users, concurrency {concurrency}: '
+               f'{results.requests / elapsed:.1f} requests/s in {elapsed:.2f}s')
+    for endpoint in sorted(results.latencies):
+        summary = latency_summary(results.latencies[endpoint])
+        failures = results.failures.get(endpoint, 0)
+        click.echo(format_latency(endpoint, summary) +
+                   (f' failed={failures}' if failures else '') +
+                   f" {summary['count'] / elapsed:7.1f}/s")
+    if sum(results.failures.values()):
+        raise click.exceptions.Exit(1)
+
+
+@click.command('purge-uploads')
+@click.option('--batch-size', type=int, default=None,
+              help='Rows deleted per transaction (default: PURGE_BATCH_SIZE).')
+@click.option('--vacuum/--no-vacuum', default=True, show_default=True,
+              help='Reclaim freed SQLite pages afterwards.')
+def purge_uploads(batch_size, vacuum):
+    """Purge the rows and files of deleted uploads."""
+    from app.utils.purge import purge_deleted_uploads, reclaim_space
+
+    app = current_app._get_current_object()
+    started = time.perf_counter()
+    result = purge_deleted_uploads(app.config['UPLOAD_FOLDER'],
+                                   batch_size or app.config['PURGE_BATCH_SIZE'],
+                                   app.config['MATRIX_FOLDER'])
+    click.echo(f"Purged {result['uploads']} deleted uploads ({result['rows']} rows) "
+               f"in {time.perf_counter() - started:.2f}s")
+    if vacuum:
+        mode = reclaim_space(app.config['PURGE_VACUUM_FREE_FRACTION'])
+        click.echo(f'Reclaimed free pages ({mode})' if mode else 'No space to reclaim')
+
+
+@bench_cli.command('ingest')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--year-group', required=True, type=click.Choice(['S3', 'S4', 'S5-6']))
+def bench_ingest(path, year_group):
+    """Measure parsing, frame memory and subject normalization for a data file."""
+    from app.utils.data_processor import (CHOICE_FIELDS, read_subject_choices_file,
+                                          normalize_choice_categories)
+    from app.utils.subject_mappings import normalize_subject_name
+
+    started = time.perf_counter()
+    df = read_subject_choices_file(path, year_group, current_app.config['MAX_DECOMPRESSED_LENGTH'])
+    parse_time = time.perf_counter() - started
+
+    # The same frame with plain object columns, as the pipeline used to hold it
+    encoded_columns = ['reg_class'] + CHOICE_FIELDS
+    as_objects = df.astype({field: object for field in encoded_columns})
+    categorical_bytes = df[encoded_columns].memory_usage(deep=True).sum()
+    object_bytes = as_objects[encoded_columns].memory_usage(deep=True).sum()
+
+    started = time.perf_counter()
+    cells = 0
+    for field in CHOICE_FIELDS:
+        for value in as_objects[field]:
+            normalize_subject_name(value if isinstance(value, str) else '', year_group)
+            cells += 1
+    per_cell_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    normalize_choice_categories(df, year_group)
+    per_category_time = time.perf_counter() - started
+    categories = len(df[CHOICE_FIELDS[0]].cat.categories)
+
+    click.echo(f'{len(df)} rows parsed in {parse_time * 1000:.1f}ms')
+    click.echo(f'reg_class + choice columns: {object_bytes / 1024:.1f}KB as objects, '
+               f'{categorical_bytes / 1024:.1f}KB as categoricals '
+               f'({(1 - categorical_bytes / object_bytes) * 100:.0f}% saved)')
+    click.echo(f'normalization: {cells} cells in {per_cell_time * 1000:.1f}ms, '
+               f'{categories} categories in {per_category_time * 1000:.1f}ms')
+
+
+@bench_cli.command('startup')
+@click.option('--runs', default=5, show_default=True, help='Fresh interpreters to time.')
+@click.option('--config', 'config_name', default='production', show_default=True,
+              help='Configuration passed to create_app.')
+@click.option('--top', default=10, show_default=True, help='Slowest imports to list.')
+@click.option('--max-ms', type=float, help='Fail if the median startup time exceeds this.')
+def bench_startup(runs, config_name, top, max_ms):
+    """Time importing the app and create_app() in fresh interpreters.
+
+    Fails (exit status 1) if pandas, numpy, openpyxl, requests or authlib are
+    imported at startup, or if the median exceeds --max-ms.
+    """
+    project_root = os.path.dirname(current_app.root_path)
+    script = STARTUP_SCRIPT.format(config_name=config_name, modules=LAZY_MODULES)
+
+    # Without the background purge, whose first pass would race the measurement
+    env = dict(os.environ, PURGE_IN_BACKGROUND='false')
+
+    def run(*flags):
+        result = subprocess.run([sys.executable, *flags, '-c', script], cwd=project_root,
+                                env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise click.ClickException(f'Startup failed:\n{result.stderr}')
+        return result
+
+    timings = []
+    loaded = set()
+    for _ in range(runs):
+        lines = run().stdout.splitlines()
+        timings.append(float(lines[-2]))
+        loaded.update(lines[-1].split())
+
+    # One more run with -X importtime for the per-module breakdown
+    imports = []
+    for line in run('-X', 'importtime').stderr.splitlines():
+        if line.startswith('import time:') and 'cumulative' not in line:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            imports.append((int(self_us), int(cumulative_us), name.strip()))
+
+    median = latency_summary(timings)['p50']
+    click.echo(f'create_app ({config_name}): median {median:.1f}ms over {runs} runs '
+               f'(min {min(timings) * 1000:.1f}ms, max {max(timings) * 1000:.1f}ms)')
+    click.echo(f'{len(imports)} modules imported; slowest by own import time:')
+    for self_us, cumulative_us, name in sorted(imports, reverse=True)[:top]:
+        click.echo(f'  {self_us / 1000:8.1f}ms self {cumulative_us / 1000:8.1f}ms cumulative  {name}')
+
+    failed = False
+    if loaded:
+        click.echo(f"Imported at startup but should be lazy: {', '.join(sorted(loaded))}")
+        failed = True
+    if max_ms is not None and median > max_ms:
+        click.echo(f'Median startup {median:.1f}ms exceeds --max-ms {max_ms:.1f}ms')
+        failed = True
+    if failed:
+        raise click.exceptions.Exit(1)
+
+
+def _timed_parse(path, year_group, max_decompressed_length):
+    """Parse a data file in a worker process, returning (frame, seconds)"""
+    from app.utils.ingest import parse_upload_file
+
+    started = time.perf_counter()
+    df = parse_upload_file(path, year_group, max_decompressed_length)
+    return df, time.perf_counter() - started
+
+
+@click.command('ingest')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--email', required=True, help='Email of the user who will own the uploads.')
+@click.option('--year-group', type=click.Choice(['S3', 'S4', 'S5-6']),
+              help='Year group of every file (default: from the S3/S4/S5-6 folder or file name).')
+@click.option('--workers', type=int, default=0, help='Parsing processes (default: CPU count).')
+@click.option('--reload', is_flag=True,
+              help='Replace existing uploads of identical files instead of skipping them.')
+def ingest(paths, email, year_group, workers, reload):
+    """Upload and process data files, directories or glob patterns."""
+    from app import db
+    from app.models import DataUpload, User
+    from app.utils.ingest import find_data_files, import_upload, infer_year_group, store_local_file
+    from app.utils.purge import mark_upload_deleted
+    from app.utils.choice_matrix import write_choice_artifact
+    from app.utils.snapshots import refresh_snapshots
+
+    app = current_app._get_current_object()
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f'No user with email {email}; log in through the web app first')
+
+    files = find_data_files(paths, app.config['ALLOWED_EXTENSIONS'])
+    if not files:
+        raise click.ClickException('No data files found')
+    max_length = app.config['MAX_DECOMPRESSED_LENGTH']
+    started = time.perf_counter()
+    failures = 0
+
+    def report(status, upload_year_group, path, rows='', timings=''):
+        click.echo(f'{status:<8} {upload_year_group or "?":<5} {str(rows):>6}  {timings:<30} '
+                   f'{os.path.relpath(path)}')
+
+    # Store the files and create their upload records
+    pending = []
+    changed = []
+    for path in files:
+        file_year_group = year_group or infer_year_group(path)
+        if file_year_group is None:
+            report('SKIPPED', None, path, timings='unknown year group')
+            continue
+        try:
+            upload = store_local_file(path, user.id, file_year_group,
+                                      app.config['UPLOAD_FOLDER'], max_length)
+            existing = DataUpload.query.filter(
+                DataUpload.user_id == user.id, DataUpload.content_hash == upload.content_hash,
+                DataUpload.deleted_at.is_(None), DataUpload.id != upload.id).all()
+            if existing and not reload:
+                db.session.rollback()
+                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], upload.filename))
+                report('SKIPPED', file_year_group, path, timings='already uploaded')
+                continue
+            for previous in existing:
+                mark_upload_deleted(previous)
+            db.session.commit()
+            changed.extend(existing)
+        except Exception as e:
+            db.session.rollback()
+            failures += 1
+            report('FAILED', file_year_group, path, timings=str(e))
+            continue
+        pending.append((upload.id, path, os.path.join(app.config['UPLOAD_FOLDER'], upload.filename),
+                        file_year_group))
+
+    # Parse in worker processes; import each file as its frame arrives
+    def finish(upload_id, path, parsed):
+        nonlocal failures, ingested
+        upload = db.session.get(DataUpload, upload_id)
+        try:
+            df, parse_time = parsed()
+            import_started = time.perf_counter()
+            rows = import_upload(upload, df)
+            db.session.commit()
+            changed.append(upload)
+            ingested += 1
+            report('OK', upload.year_group, path, rows,
+                   f'parse {parse_time * 1000:7.1f}ms '
+                   f'import {(time.perf_counter() - import_started) * 1000:7.1f}ms')
+        except Exception as e:
+            db.session.rollback()
+            mark_upload_deleted(upload)
+            db.session.commit()
+            failures += 1
+            report('FAILED', upload.year_group, path, timings=str(e))
+
+    ingested = 0
+    if workers == 1 or len(pending) <= 1:
+        for upload_id, path, filepath, upload_year_group in pending:
+            finish(upload_id, path, lambda: _timed_parse(filepath, upload_year_group, max_length))
+    else:
+        with ProcessPoolExecutor(max_workers=workers or None) as executor:
+            futures = {executor.submit(_timed_parse, filepath, upload_year_group, max_length):
+                       (upload_id, path)
+                       for upload_id, path, filepath, upload_year_group in pending}
+            for future in as_completed(futures):
+                finish(*futures[future], future.result)
+
+    refresh_snapshots(app.config['SNAPSHOT_FOLDER'], changed)
+    for upload in changed:
+        if upload.deleted_at is None:
+            write_choice_artifact(app.config['MATRIX_FOLDER'], upload)
+    click.echo(f'{ingested} of {len(files)} files ingested in '
+               f'{time.perf_counter() - started:.2f}s')
+    if failures:
+        raise click.exceptions.Exit(1)
+
+
+@click.command('init-db')
+def init_db():
+    """Create missing tables and add columns and indexes new to existing ones."""
+    from app import db
+    from app.utils.schema import upgrade_schema
+
+    result = upgrade_schema()
+    for kind in ('tables', 'columns', 'indexes'):
+        if result[kind]:
+            click.echo(f"Added {kind}: {', '.join(result[kind])}")
+    if result['academic_years']:
+        click.echo(f"Detected the academic year of {result['academic_years']} uploads")
+    click.echo(f'Database ready: {db.engine.url.render_as_string(hide_password=True)}')
+
+
+@click.command('optimize-columns')
+@click.argument('upload_id', type=int)
+@click.option('--iterations', default=50000, show_default=True,
+              help='Candidate arrangements tried per search.')
+@click.option('--searches', type=int, default=0, help='Independent searches (default: one per worker).')
+@click.option('--workers', type=int, default=0, help='Search processes (default: CPU count).')
+@click.option('--seed', type=int, help='Random seed for reproducible results.')
+def optimize_columns(upload_id, iterations, searches, workers, seed):
+    """Search for an option-column arrangement with fewer clashes."""
+    from app import db
+    from app.models import DataUpload
+    from app.utils.choice_matrix import upload_choice_matrix
+    from app.utils.option_columns import (arrangement_moves, column_count_for, current_arrangement,
+                                          describe_arrangement, optimize_arrangement)
+
+    upload = db.session.get(DataUpload, upload_id)
+    if upload is None or upload.deleted_at is not None or not upload.processed:
+        raise click.ClickException(f'No processed upload with id {upload_id}')
+
+    choice_matrix = upload_choice_matrix(current_app.config['MATRIX_FOLDER'], upload)
+    column_count = column_count_for(choice_matrix.slots)
+    start = current_arrangement(choice_matrix.matrix, choice_matrix.slots, column_count)
+    result = optimize_arrangement(choice_matrix.matrix, column_count, start, iterations=iterations,
+                                  searches=searches or None, workers=workers or None, seed=seed)
+
+    click.echo(f"{upload.original_filename} ({upload.year_group}): {result['start_clashes']} of "
+               f"{choice_matrix.student_count} pupils with clashes; best found {result['clashes']} "
+               f"({result['evaluated']} arrangements in {result['seconds']:.2f}s)")
+    moves = arrangement_moves(start, result['arrangement'], choice_matrix.subjects)
+    for move in moves:
+        click.echo(f"  {move['subject']}: {move['from']} -> {move['to']}")
+    if moves:
+        click.echo('Suggested arrangement:')
+        for letter, subjects in describe_arrangement(result['arrangement'], choice_matrix.subjects,
+                                                     column_count).items():
+            click.echo(f"  {letter}: {', '.join(subjects) or '-'}")
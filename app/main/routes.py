@@ -1,12 +1,11 @@
 """
 Main application routes
 """
-from flask import render_template, redirect, url_for
+from flask import render_template, redirect, url_for, current_app, request
 from flask_login import login_required, current_user
 from app.main import main_bp
-from app.models import DataUpload, SubjectChoice
-from app import db
-from sqlalchemy import func
+from app.models import DataUpload
+from app.utils.user_stats import get_user_stats
 
 
 @main_bp.route('/')
@@ -21,23 +20,25 @@ def index():
 @login_required
 def dashboard():
     """User dashboard"""
-    # Get user's uploads
-    uploads = DataUpload.query.filter_by(user_id=current_user.id)\
-        .order_by(DataUpload.upload_date.desc()).all()
+    # Get summary statistics (maintained per user)
+    stats, subject_stats = get_user_stats(current_user.id)
     
-    # Get summary statistics
-    total_uploads = len(uploads)
-    processed_uploads = sum(1 for u in uploads if u.processed)
-    
-    # Get subject choice summary
-    subject_stats = db.session.query(
-        SubjectChoice.year_group,
-        func.count(SubjectChoice.id).label('subject_count'),
-        func.sum(SubjectChoice.choice_count).label('total_choices')
-    ).group_by(SubjectChoice.year_group).all()
+    # One page of the user's uploads, newest first (one extra row tells
+    # whether there is an older page, without counting them all)
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = current_app.config['DASHBOARD_RECENT_UPLOADS']
+    uploads = DataUpload.query.filter_by(user_id=current_user.id, deleted_at=None)\
+        .order_by(DataUpload.upload_date.desc(), DataUpload.id.desc())\
+        .offset((page - 1) * per_page).limit(per_page + 1).all()
+    if not uploads and page > 1:
+        return redirect(url_for('main.dashboard'))
+    has_older = len(uploads) > per_page
     
     return render_template('dashboard.html',
-                         uploads=uploads,
-                         total_uploads=total_uploads,
-                         processed_uploads=processed_uploads,
+                         uploads=uploads[:per_page],
+                         page=page,
+                         first_index=(page - 1) * per_page + 1,
+                         has_older=has_older,
+                         total_uploads=stats.total_uploads,
+                         processed_uploads=stats.processed_uploads,
                          subject_stats=subject_stats)
@@ -2,13 +2,50 @@
 Database models
 """
 from app import db, login_manager
+from app.utils.cache import TTLCache
+from flask import abort
 from flask_login import UserMixin
+from sqlalchemy.orm import make_transient_to_detached
 from datetime import datetime
 
 
+# StudentChoice columns holding the option-column (A-H) subject choices
+CHOICE_COLUMNS = ['choice_a', 'choice_b', 'choice_c', 'choice_d',
+                  'choice_e', 'choice_f', 'choice_g', 'choice_h']
+
+# StudentChoice columns holding the same choices as read from the file
+RAW_CHOICE_COLUMNS = [f'raw_{name}' for name in CHOICE_COLUMNS]
+
+
+# Column values of recently seen users, keyed by id (configured in create_app)
+user_cache = TTLCache()
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """
+    Load the logged-in user, from the user cache when possible.
+    
+    Cached users are rebuilt from a column snapshot and attached to the
+    session without a query. Each worker process has its own cache, so
+    changes made elsewhere show up once the entry expires (USER_CACHE_TTL).
+    """
+    user_id = int(user_id)
+    snapshot = user_cache.get(user_id)
+    if snapshot is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            user_cache.set(user_id, user.snapshot())
+        return user
+    
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate_cached_user(user_id):
+    """Drop a user from the user cache after their record changes"""
+    user_cache.delete(int(user_id))
 
 
 class SubjectMapping(db.Model):
@@ -43,6 +80,10 @@ class User(UserMixin, db.Model):
     
     uploads = db.relationship('DataUpload', backref='user', lazy=True)
     
+    def snapshot(self):
+        """Return the user's column values for the user cache"""
+        return {column.key: getattr(self, column.key) for column in User.__table__.columns}
+    
     def __repr__(self):
         return f'<User {self.email}>'
 
@@ -57,12 +98,67 @@ class DataUpload(db.Model):
     upload_date = db.Column(db.DateTime, default=datetime.utcnow)
     processed = db.Column(db.Boolean, default=False)
     record_count = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the stored file
+    academic_year = db.Column(db.String(20))  # e.g., "2024-25"; taken from the file name, editable
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Set when the user deletes the upload; its rows are purged in the background
+    deleted_at = db.Column(db.DateTime, index=True)
+    # Statistics profile of the included pupils (app.utils.statistics)
+    statistics = db.Column(db.JSON)
+    # Incremented whenever the upload's analysed data changes; part of every
+    # analytics cache key, so old cached results stop being used
+    data_version = db.Column(db.Integer, default=1, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_data_upload_user_date', 'user_id', 'upload_date'),
+        db.Index('ix_data_upload_user_year', 'user_id', 'year_group', 'academic_year'),
+    )
+    
+    @classmethod
+    def get_active_or_404(cls, upload_id):
+        """Get an upload by id, aborting with 404 if it is missing or deleted"""
+        upload = cls.query.get_or_404(upload_id)
+        if upload.deleted_at is not None:
+            abort(404)
+        return upload
+    
+    def bump_data_version(self):
+        """Record a change to the upload's data (atomic UPDATE on flush; caller commits)"""
+        self.data_version = DataUpload.data_version + 1
+    
+    def set_academic_year(self, academic_year):
+        """File the upload, and its student and total rows, under an academic year (caller commits)"""
+        self.academic_year = academic_year
+        for model in (StudentChoice, SubjectChoice):
+            db.session.execute(db.update(model).where(model.upload_id == self.id)
+                               .values(academic_year=academic_year))
+        self.bump_data_version()
     
     def __repr__(self):
         return f'<DataUpload {self.original_filename}>'
 
 
+class UserStats(db.Model):
+    """Per-user upload counters maintained for the dashboard"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    total_uploads = db.Column(db.Integer, default=0, nullable=False)
+    processed_uploads = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<UserStats {self.user_id}: {self.processed_uploads}/{self.total_uploads}>'
+
+
+class UserYearGroupStats(db.Model):
+    """Per-user, per-year-group subject totals maintained for the dashboard"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    year_group = db.Column(db.String(10), primary_key=True)
+    subject_count = db.Column(db.Integer, default=0, nullable=False)  # SubjectChoice rows
+    total_choices = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<UserYearGroupStats {self.user_id} {self.year_group}: {self.total_choices}>'
+
+
 class SubjectChoice(db.Model):
     """Model for storing analyzed subject choice data"""
     id = db.Column(db.Integer, primary_key=True)
@@ -70,16 +166,35 @@ class SubjectChoice(db.Model):
     subject_name = db.Column(db.String(100), nullable=False)
     choice_count = db.Column(db.Integer, default=0)
     academic_year = db.Column(db.String(20))
-    upload_id = db.Column(db.Integer, db.ForeignKey('data_upload.id'))
+    upload_id = db.Column(db.Integer, db.ForeignKey('data_upload.id'), index=True)
     
     def __repr__(self):
         return f'<SubjectChoice {self.year_group} - {self.subject_name}: {self.choice_count}>'
 
 
+class SubjectCoincidence(db.Model):
+    """Stored subject pair counts (coincidence matrix) for an upload"""
+    id = db.Column(db.Integer, primary_key=True)
+    upload_id = db.Column(db.Integer, db.ForeignKey('data_upload.id'), nullable=False)
+    # Pairs are stored once with subject_a <= subject_b; the diagonal
+    # (subject_a == subject_b) holds the number of students taking the subject
+    subject_a = db.Column(db.String(100), nullable=False)
+    subject_b = db.Column(db.String(100), nullable=False)
+    student_count = db.Column(db.Integer, default=0, nullable=False)
+    
+    # The unique constraint doubles as the (upload_id, ...) lookup index
+    __table_args__ = (
+        db.UniqueConstraint('upload_id', 'subject_a', 'subject_b', name='_upload_subject_pair_uc'),
+    )
+    
+    def __repr__(self):
+        return f'<SubjectCoincidence {self.subject_a} + {self.subject_b}: {self.student_count}>'
+
+
 class StudentChoice(db.Model):
     """Staging table for individual student choices"""
     id = db.Column(db.Integer, primary_key=True)
-    upload_id = db.Column(db.Integer, db.ForeignKey('data_upload.id'), nullable=False)
+    upload_id = db.Column(db.Integer, db.ForeignKey('data_upload.id'), nullable=False, index=True)
     forename = db.Column(db.String(100))
     surname = db.Column(db.String(100))
     reg_class = db.Column(db.String(50))  # Registration class
@@ -96,9 +211,24 @@ class StudentChoice(db.Model):
     choice_g = db.Column(db.String(100))
     choice_h = db.Column(db.String(100))
     
+    # The choices before subject mappings were applied, so re-normalization
+    # can start from the file's values (None for rows imported before these
+    # were kept)
+    raw_choice_a = db.Column(db.String(100))
+    raw_choice_b = db.Column(db.String(100))
+    raw_choice_c = db.Column(db.String(100))
+    raw_choice_d = db.Column(db.String(100))
+    raw_choice_e = db.Column(db.String(100))
+    raw_choice_f = db.Column(db.String(100))
+    raw_choice_g = db.Column(db.String(100))
+    raw_choice_h = db.Column(db.String(100))
+    
     # Flag to include/exclude from analysis
     included_in_analysis = db.Column(db.Boolean, default=True)
     
+    # Hash of the normalized row, for diffing re-uploads (app.utils.reupload)
+    row_hash = db.Column(db.String(32))
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     upload = db.relationship('DataUpload', backref='student_choices')
@@ -109,8 +239,26 @@ class StudentChoice(db.Model):
     def get_choices(self):
         """Return list of non-null choices"""
         choices = []
-        for choice in [self.choice_a, self.choice_b, self.choice_c, self.choice_d,
-                      self.choice_e, self.choice_f, self.choice_g, self.choice_h]:
+        for choice in (getattr(self, column) for column in CHOICE_COLUMNS):
             if choice and choice.strip():
                 choices.append(choice.strip())
         return choices
+
+
+class CohortLink(db.Model):
+    """Match of a student in one upload to the same student in a later upload"""
+    id = db.Column(db.Integer, primary_key=True)
+    from_upload_id = db.Column(db.Integer, db.ForeignKey('data_upload.id'), nullable=False)
+    to_upload_id = db.Column(db.Integer, db.ForeignKey('data_upload.id'), nullable=False)
+    from_student_id = db.Column(db.Integer, db.ForeignKey('student_choice.id'), nullable=False)
+    to_student_id = db.Column(db.Integer, db.ForeignKey('student_choice.id'), nullable=False)
+    match_type = db.Column(db.String(10), nullable=False)  # exact, fuzzy
+    score = db.Column(db.Float, default=1.0, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_cohort_link_uploads', 'from_upload_id', 'to_upload_id'),
+        db.Index('ix_cohort_link_to_upload', 'to_upload_id'),
+    )
+    
+    def __repr__(self):
+        return f'<CohortLink {self.from_student_id} -> {self.to_student_id} ({self.match_type})>'
@@ -0,0 +1,256 @@
+"""
+In-process caches, and the analytics cache with its optional shared backend
+"""
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ``ttl`` seconds
+
+    Least recently used entries are evicted once ``maxsize`` is exceeded.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None):
+        """Change the size limit and/or TTL, dropping existing entries"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._entries.clear()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SizedLRUCache:
+    """
+    Thread-safe LRU cache of byte strings bounded by their total size
+
+    Least recently used entries are evicted once the stored values exceed
+    ``max_bytes``; a value larger than the whole budget is not stored.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, max_bytes=None):
+        """Change the size limit, dropping existing entries"""
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._entries.clear()
+            self.size = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self.size -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class MemoryBackend:
+    """
+    In-process stand-in for a shared cache server
+
+    Implements the same get/set/delete interface as RedisBackend, so tests
+    and single-process deployments can exercise the shared-cache path with
+    ``ANALYTICS_CACHE_URL=memory://``.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisBackend:
+    """Shared cache stored in Redis (requires the optional ``redis`` package)"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('ANALYTICS_CACHE_URL points at Redis; install the "redis" package') from e
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, value, ex=ttl or None)
+
+    def delete(self, key):
+        self._client.delete(key)
+
+
+def shared_backend(url):
+    """Build the shared cache backend for a URL ('' for none, memory:// or redis://)"""
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f'Unsupported analytics cache URL: {url}')
+
+
+class AnalyticsCache:
+    """
+    Cache for computed analytics (matrices, mined combinations, ...)
+
+    Values are pickled into a size-bounded in-process LRU and, when a shared
+    backend is configured, also stored there so other worker processes can
+    reuse them. Every hit unpickles a fresh copy the caller may modify.
+
+    Keys are tuples that include the data version of each upload involved,
+    so changing an upload makes its old entries unreachable; they are never
+    deleted explicitly and age out of the LRU (or the backend's TTL).
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, backend=None, ttl=3600):
+        self.local = SizedLRUCache(max_bytes)
+        self.backend = backend
+        self.ttl = ttl
+
+    def configure(self, max_bytes=None, backend=None, ttl=None):
+        """Change the local size limit, shared backend and/or backend TTL"""
+        self.local.configure(max_bytes)
+        self.backend = backend
+        if ttl is not None:
+            self.ttl = ttl
+
+    @staticmethod
+    def _key(parts):
+        return 'analytics:' + ':'.join(str(part) for part in parts)
+
+    def get(self, parts, default=None):
+        key = self._key(parts)
+        data = self.local.get(key)
+        if data is None and self.backend is not None:
+            try:
+                data = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f'Shared analytics cache unavailable: {e}')
+            if data is not None:
+                self.local.set(key, data)
+        return default if data is None else pickle.loads(data)
+
+    def set(self, parts, value):
+        key = self._key(parts)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.local.set(key, data)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, data, self.ttl)
+            except Exception as e:
+                logger.warning(f'Shared analytics cache unavailable: {e}')
+
+    def get_or_set(self, parts, compute):
+        """Return the cached value for ``parts``, computing and storing it on a miss"""
+        value = self.get(parts, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(parts, value)
+        return value
+
+    def clear(self):
+        """Drop the local entries (shared entries expire on their own)"""
+        self.local.clear()
+
+
+_MISSING = object()
+
+analytics_cache = AnalyticsCache()
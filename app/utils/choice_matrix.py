@@ -0,0 +1,273 @@
+"""
+Students x subjects choice matrices for vectorized analysis
+
+Each processed upload's full matrix can also be stored as ``.npy`` files
+under ``<MATRIX_FOLDER>/<upload id>/v<data version>/`` and opened with
+``numpy.load(mmap_mode='r')``. Analyses then read the arrays without
+copying, and every worker process shares the same pages through the OS
+page cache. A version directory is written once and never changed;
+stale versions are rebuilt from the database on first read.
+"""
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from sqlalchemy import select
+from app import db
+from app.models import StudentChoice, CHOICE_COLUMNS
+
+# Bump when the artifact layout changes; older artifacts are rebuilt
+ARTIFACT_FORMAT = 1
+
+# Arrays stored per artifact, as <name>.npy; the subject index is in meta.json
+ARTIFACT_ARRAYS = ('matrix', 'slots', 'student_ids', 'included')
+
+
+class ChoiceMatrix:
+    """
+    Dense representation of an upload's choices
+
+    Attributes:
+        subjects: Sorted list of subject names (the column index)
+        matrix: uint8 array (students x subjects), 1 where the student takes the subject
+        slots: int8 array (students x subjects), option column (0=A .. 7=H) the
+            subject was chosen in, or -1
+        student_ids: int64 array of StudentChoice ids, one per matrix row
+        included: bool array, True where the student is included in
+            analysis (None if the matrix holds included students only)
+    """
+
+    def __init__(self, subjects, matrix, slots, student_ids, included=None):
+        self.subjects = subjects
+        self.matrix = matrix
+        self.slots = slots
+        self.student_ids = student_ids
+        self.included = included
+
+    @property
+    def student_count(self):
+        return self.matrix.shape[0]
+
+    def subject_index(self):
+        """Return {subject_name: column position}"""
+        return {subject: i for i, subject in enumerate(self.subjects)}
+
+    def included_students(self):
+        """
+        The matrix of the students included in analysis
+
+        Subjects nobody included takes are dropped, as ``load_choice_matrix``
+        would. Returns this matrix itself (no copy) when everyone is included.
+        """
+        if self.included is None or self.included.all():
+            return self
+        rows = np.flatnonzero(self.included)
+        matrix = self.matrix[rows]
+        keep = matrix.any(axis=0)
+        return ChoiceMatrix([subject for subject, kept in zip(self.subjects, keep) if kept],
+                            matrix[:, keep], self.slots[rows][:, keep], self.student_ids[rows])
+
+
+def build_choice_matrix(choice_rows, student_ids=None):
+    """
+    Build a ChoiceMatrix from rows of choice values
+
+    Args:
+        choice_rows: Sequence of per-student sequences of choice values in
+            option-column order (choice_a .. choice_h)
+        student_ids: Optional sequence of StudentChoice ids aligned with rows
+
+    Returns:
+        ChoiceMatrix
+    """
+    cleaned = [[(value.strip() if value else '') for value in row] for row in choice_rows]
+    subjects = sorted({value for row in cleaned for value in row if value})
+    index = {subject: i for i, subject in enumerate(subjects)}
+
+    matrix = np.zeros((len(cleaned), len(subjects)), dtype=np.uint8)
+    slots = np.full((len(cleaned), len(subjects)), -1, dtype=np.int8)
+    for row_number, row in enumerate(cleaned):
+        for slot, value in enumerate(row):
+            if value:
+                column = index[value]
+                if not matrix[row_number, column]:
+                    slots[row_number, column] = slot
+                matrix[row_number, column] = 1
+
+    if student_ids is None:
+        student_ids = np.arange(len(cleaned), dtype=np.int64)
+    return ChoiceMatrix(subjects, matrix, slots, np.asarray(student_ids, dtype=np.int64))
+
+
+def load_choice_matrix(upload_id, included_only=True):
+    """
+    Build the ChoiceMatrix of an upload from its stored student rows
+
+    Args:
+        upload_id: DataUpload id
+        included_only: Only include students flagged for analysis;
+            otherwise all students, with the ``included`` mask set
+
+    Returns:
+        ChoiceMatrix
+    """
+    columns = [getattr(StudentChoice, name) for name in CHOICE_COLUMNS]
+    stmt = select(StudentChoice.id, StudentChoice.included_in_analysis, *columns)\
+        .where(StudentChoice.upload_id == upload_id)\
+        .order_by(StudentChoice.id)
+    if included_only:
+        stmt = stmt.where(StudentChoice.included_in_analysis.is_(True))
+    rows = db.session.execute(stmt).all()
+    choice_matrix = build_choice_matrix([row[2:] for row in rows], [row[0] for row in rows])
+    if not included_only:
+        choice_matrix.included = np.array([bool(row[1]) for row in rows], dtype=bool)
+    return choice_matrix
+
+
+def artifact_dir(root, upload_id):
+    """Directory holding the stored matrix versions of an upload"""
+    return os.path.join(root, str(upload_id))
+
+
+def _version_dir(root, upload):
+    return os.path.join(artifact_dir(root, upload.id), f'v{upload.data_version}')
+
+
+def _publish(root, upload, write_files):
+    """
+    Write a new artifact version through a staging directory
+
+    The staging directory is renamed into place in one step, so readers
+    see either no version or a complete one. Older versions are removed
+    (newer ones published meanwhile by another request are kept);
+    processes that still have them mapped keep their pages until they
+    close them (where the OS allows removing open files).
+    """
+    directory = artifact_dir(root, upload.id)
+    target = _version_dir(root, upload)
+    os.makedirs(directory, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=directory, prefix='.tmp-')
+    try:
+        write_files(staging)
+        os.rename(staging, target)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        # Another process published the same version first
+        if not os.path.isdir(target):
+            raise
+
+    for name in os.listdir(directory):
+        if name.startswith('v') and name[1:].isdigit() and int(name[1:]) < upload.data_version:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return target
+
+
+def _write_meta(directory, subjects):
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump({'format': ARTIFACT_FORMAT, 'subjects': subjects}, f)
+
+
+def write_choice_artifact(root, upload):
+    """
+    Store an upload's full choice matrix (all students and the inclusion
+    mask) for its current data version
+
+    Returns:
+        str: The version directory
+    """
+    choice_matrix = load_choice_matrix(upload.id, included_only=False)
+
+    def write_files(directory):
+        for name in ARTIFACT_ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(choice_matrix, name))
+        _write_meta(directory, choice_matrix.subjects)
+
+    return _publish(root, upload, write_files)
+
+
+def write_inclusion_artifact(root, upload):
+    """
+    Store a new artifact version after only students' inclusion changed
+
+    The matrix, slot and id arrays of the immediately preceding version
+    (``data_version - 1``) are hard-linked (copied where links are
+    unsupported) and only the inclusion mask is written. Falls back to a
+    full write if that version is missing or its students differ: other
+    changes (re-normalization, ...) bump the version without writing an
+    artifact, so an older stored version may no longer match the rows.
+
+    Returns:
+        str: The version directory
+    """
+    previous = os.path.join(artifact_dir(root, upload.id), f'v{upload.data_version - 1}')
+    rows = db.session.execute(
+        select(StudentChoice.id, StudentChoice.included_in_analysis)
+        .where(StudentChoice.upload_id == upload.id)
+        .order_by(StudentChoice.id)
+    ).all()
+    student_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    try:
+        stored = read_choice_artifact(previous)
+    except (OSError, ValueError):
+        stored = None
+    if not stored or not np.array_equal(stored.student_ids, student_ids):
+        return write_choice_artifact(root, upload)
+
+    def write_files(directory):
+        for name in ('matrix', 'slots', 'student_ids', 'meta'):
+            filename = 'meta.json' if name == 'meta' else f'{name}.npy'
+            try:
+                os.link(os.path.join(previous, filename), os.path.join(directory, filename))
+            except OSError:
+                shutil.copyfile(os.path.join(previous, filename), os.path.join(directory, filename))
+        np.save(os.path.join(directory, 'included.npy'),
+                np.array([bool(row[1]) for row in rows], dtype=bool))
+
+    return _publish(root, upload, write_files)
+
+
+def read_choice_artifact(directory):
+    """
+    Open a stored artifact with its arrays memory-mapped read-only
+
+    Returns:
+        ChoiceMatrix or None: None if the artifact has an older format
+
+    Raises:
+        OSError, ValueError: If the files are missing or damaged
+    """
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta.get('format') != ARTIFACT_FORMAT:
+        return None
+    arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+              for name in ARTIFACT_ARRAYS}
+    return ChoiceMatrix(meta['subjects'], **arrays)
+
+
+def upload_choice_matrix(root, upload, included_only=True):
+    """
+    The ChoiceMatrix of an upload from its stored artifact
+
+    The artifact for the upload's current data version is written first if
+    it is missing or unreadable.
+
+    Args:
+        root: MATRIX_FOLDER
+        upload: DataUpload
+        included_only: Restrict to students included in analysis
+
+    Returns:
+        ChoiceMatrix: Memory-mapped arrays (copied rows when some students
+        are excluded)
+    """
+    directory = _version_dir(root, upload)
+    try:
+        choice_matrix = read_choice_artifact(directory)
+    except (OSError, ValueError):
+        choice_matrix = None
+    if choice_matrix is None:
+        shutil.rmtree(directory, ignore_errors=True)
+        choice_matrix = read_choice_artifact(write_choice_artifact(root, upload))
+    return choice_matrix.included_students() if included_only else choice_matrix
@@ -0,0 +1,322 @@
+"""
+Cohort tracking: linking students across uploads and subject transitions
+
+Students are matched between two uploads (e.g. S4 in 2024-25 and S5-6 in
+2025-26) with a hash join on normalized name keys. Students left over can
+be paired with a fuzzy match on the key, compared only within blocks of the
+same surname initial. Links are stored in CohortLink; transition matrices
+(earlier subject x later subject) are then a single matrix product of the
+two uploads' aligned choice matrices.
+"""
+import difflib
+import re
+import unicodedata
+from collections import defaultdict
+import numpy as np
+from sqlalchemy import delete, insert, select
+from app import db
+from app.models import CohortLink, DataUpload, StudentChoice
+from .choice_matrix import load_choice_matrix, upload_choice_matrix
+from .data_processor import academic_year_start
+
+# Minimum SequenceMatcher ratio for a fuzzy name match
+FUZZY_CUTOFF = 0.88
+
+
+def name_key(forename, surname):
+    """
+    Build the matching key for a student name
+
+    Accents, case, spaces and punctuation are ignored, so "Siobhán O'Neil"
+    and "siobhan oneil" share a key.
+    """
+    def clean(value):
+        value = unicodedata.normalize('NFKD', value or '')
+        value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+        return re.sub(r'[^0-9a-z]', '', value.casefold())
+    return f'{clean(surname)}|{clean(forename)}'
+
+
+def _student_keys(upload_id):
+    """Return {name key: [StudentChoice ids]} for an upload"""
+    rows = db.session.execute(
+        select(StudentChoice.id, StudentChoice.forename, StudentChoice.surname)
+        .where(StudentChoice.upload_id == upload_id)
+    ).all()
+    keys = defaultdict(list)
+    for student_id, forename, surname in rows:
+        key = name_key(forename, surname)
+        if key != '|':
+            keys[key].append(student_id)
+    return keys
+
+
+def match_students(from_keys, to_keys, fuzzy=True, cutoff=FUZZY_CUTOFF):
+    """
+    Match students between two uploads by name key
+
+    Keys shared by more than one student on either side are ambiguous and
+    left unmatched.
+
+    Args:
+        from_keys, to_keys: {name key: [student ids]} for each upload
+        fuzzy: Pair leftover students by closest key (same surname initial)
+        cutoff: Minimum similarity ratio for a fuzzy match
+
+    Returns:
+        list: (from_student_id, to_student_id, match_type, score) tuples
+    """
+    matches = []
+    # Hash join on the exact key
+    for key, from_ids in from_keys.items():
+        to_ids = to_keys.get(key)
+        if to_ids and len(from_ids) == 1 and len(to_ids) == 1:
+            matches.append((from_ids[0], to_ids[0], 'exact', 1.0))
+
+    if not fuzzy:
+        return matches
+
+    # Fuzzy fallback for unique keys that found no exact partner, blocked
+    # by surname initial to avoid comparing every pair
+    unmatched_to = defaultdict(list)
+    for key, to_ids in to_keys.items():
+        if len(to_ids) == 1 and key not in from_keys:
+            unmatched_to[key[:1]].append(key)
+
+    candidates = []
+    for key, from_ids in from_keys.items():
+        if len(from_ids) != 1 or key in to_keys:
+            continue
+        block = unmatched_to.get(key[:1])
+        if not block:
+            continue
+        matcher = difflib.SequenceMatcher(b=key, autojunk=False)
+        for other in block:
+            matcher.set_seq1(other)
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                score = matcher.ratio()
+                if score >= cutoff:
+                    candidates.append((score, key, other))
+
+    # Best-scoring pairs first, each student used once
+    used_from, used_to = set(), set()
+    for score, key, other in sorted(candidates, reverse=True):
+        if key in used_from or other in used_to:
+            continue
+        used_from.add(key)
+        used_to.add(other)
+        matches.append((from_keys[key][0], to_keys[other][0], 'fuzzy', round(score, 3)))
+    return matches
+
+
+def link_uploads(from_upload_id, to_upload_id, fuzzy=True):
+    """
+    Link the students of two uploads, replacing any stored links
+
+    Does not commit; the caller owns the transaction.
+
+    Returns:
+        dict: Match counts ('exact', 'fuzzy', 'from_students', 'to_students')
+    """
+    from_keys = _student_keys(from_upload_id)
+    to_keys = _student_keys(to_upload_id)
+    matches = match_students(from_keys, to_keys, fuzzy=fuzzy)
+
+    delete_links(from_upload_id, to_upload_id)
+    if matches:
+        db.session.execute(insert(CohortLink), [
+            {
+                'from_upload_id': from_upload_id,
+                'to_upload_id': to_upload_id,
+                'from_student_id': from_id,
+                'to_student_id': to_id,
+                'match_type': match_type,
+                'score': score,
+            }
+            for from_id, to_id, match_type, score in matches
+        ])
+
+    return {
+        'exact': sum(1 for match in matches if match[2] == 'exact'),
+        'fuzzy': sum(1 for match in matches if match[2] == 'fuzzy'),
+        'from_students': sum(len(ids) for ids in from_keys.values()),
+        'to_students': sum(len(ids) for ids in to_keys.values()),
+    }
+
+
+def delete_links(from_upload_id, to_upload_id):
+    """Remove the stored links between two uploads (caller commits)"""
+    db.session.execute(
+        delete(CohortLink)
+        .where(CohortLink.from_upload_id == from_upload_id,
+               CohortLink.to_upload_id == to_upload_id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def has_links(from_upload_id, to_upload_id):
+    """Whether links have been stored for a pair of uploads"""
+    return db.session.execute(
+        select(CohortLink.id)
+        .where(CohortLink.from_upload_id == from_upload_id,
+               CohortLink.to_upload_id == to_upload_id)
+        .limit(1)
+    ).first() is not None
+
+
+def link_summary(from_upload_id, to_upload_id):
+    """Return {match_type: count} for the stored links between two uploads"""
+    rows = db.session.execute(
+        select(CohortLink.match_type, db.func.count())
+        .where(CohortLink.from_upload_id == from_upload_id,
+               CohortLink.to_upload_id == to_upload_id)
+        .group_by(CohortLink.match_type)
+    ).all()
+    return {match_type: count for match_type, count in rows}
+
+
+def _matrix_rows(student_ids, linked_ids):
+    """Positions of linked_ids in the sorted student_ids, and which were found"""
+    positions = np.searchsorted(student_ids, linked_ids)
+    positions = np.minimum(positions, max(len(student_ids) - 1, 0))
+    found = student_ids[positions] == linked_ids if len(student_ids) else \
+        np.zeros(len(linked_ids), dtype=bool)
+    return positions, found
+
+
+def transition_matrix(from_upload_id, to_upload_id, included_only=True, matrix_folder=None):
+    """
+    Count subject transitions between two linked uploads
+
+    Only students included in analysis in both uploads are counted. With
+    ``matrix_folder`` the uploads' stored choice matrices are read instead
+    of their student rows.
+
+    Returns:
+        dict: 'from_subjects', 'to_subjects', 'matrix' (int array,
+        from x to: students taking both), 'from_totals' (linked students per
+        earlier subject) and 'linked' (students counted)
+    """
+    links = np.array(db.session.execute(
+        select(CohortLink.from_student_id, CohortLink.to_student_id)
+        .where(CohortLink.from_upload_id == from_upload_id,
+               CohortLink.to_upload_id == to_upload_id)
+    ).all(), dtype=np.int64).reshape(-1, 2)
+
+    if matrix_folder:
+        earlier = upload_choice_matrix(matrix_folder, db.session.get(DataUpload, from_upload_id),
+                                       included_only)
+        later = upload_choice_matrix(matrix_folder, db.session.get(DataUpload, to_upload_id),
+                                     included_only)
+    else:
+        earlier = load_choice_matrix(from_upload_id, included_only)
+        later = load_choice_matrix(to_upload_id, included_only)
+    from_rows, from_found = _matrix_rows(earlier.student_ids, links[:, 0])
+    to_rows, to_found = _matrix_rows(later.student_ids, links[:, 1])
+    both = from_found & to_found
+
+    a = earlier.matrix[from_rows[both]].astype(np.int32)
+    b = later.matrix[to_rows[both]].astype(np.int32)
+    return {
+        'from_subjects': earlier.subjects,
+        'to_subjects': later.subjects,
+        'matrix': a.T @ b,
+        'from_totals': a.sum(axis=0),
+        'linked': int(both.sum()),
+    }
+
+
+def cohort_upload_pairs(user_id, from_year_group, to_year_group):
+    """
+    Pair each processed upload of one year group with the next year's upload
+    of another (e.g. S4 2024 with S5-6 2025)
+
+    Returns:
+        list: (from DataUpload, to DataUpload) pairs, oldest first
+    """
+    def by_year(year_group):
+        uploads = DataUpload.query.filter_by(user_id=user_id, year_group=year_group,
+                                             processed=True, deleted_at=None)\
+            .order_by(DataUpload.upload_date.desc()).all()
+        years = {}
+        for upload in uploads:
+            # The most recent upload for a year wins
+            years.setdefault(academic_year_start(upload.academic_year), upload)
+        years.pop(None, None)
+        return years
+
+    earlier = by_year(from_year_group)
+    later = by_year(to_year_group)
+    return [(earlier[year], later[year + 1]) for year in sorted(earlier) if year + 1 in later]
+
+
+def year_group_transitions(pairs, matrix_folder=None):
+    """
+    Sum the transition matrices of several linked upload pairs
+
+    Read-only: pairs without stored links are left out and listed under
+    'unlinked' (link them with ``link_uploads``). ``matrix_folder`` is
+    passed on to ``transition_matrix``.
+
+    Returns:
+        dict: As transition_matrix, over the union of subjects, plus
+        'unlinked' (the pairs left out)
+    """
+    results = []
+    unlinked = []
+    for earlier, later in pairs:
+        if not has_links(earlier.id, later.id):
+            unlinked.append((earlier, later))
+            continue
+        results.append(transition_matrix(earlier.id, later.id, matrix_folder=matrix_folder))
+
+    from_subjects = sorted({s for result in results for s in result['from_subjects']})
+    to_subjects = sorted({s for result in results for s in result['to_subjects']})
+    from_index = {subject: i for i, subject in enumerate(from_subjects)}
+    to_index = {subject: i for i, subject in enumerate(to_subjects)}
+
+    total = np.zeros((len(from_subjects), len(to_subjects)), dtype=np.int64)
+    from_totals = np.zeros(len(from_subjects), dtype=np.int64)
+    for result in results:
+        rows = [from_index[s] for s in result['from_subjects']]
+        columns = [to_index[s] for s in result['to_subjects']]
+        total[np.ix_(rows, columns)] += result['matrix']
+        from_totals[rows] += result['from_totals']
+    return {
+        'from_subjects': from_subjects,
+        'to_subjects': to_subjects,
+        'matrix': total,
+        'from_totals': from_totals,
+        'linked': sum(result['linked'] for result in results),
+        'unlinked': unlinked,
+    }
+
+
+def describe_transitions(transitions, limit=5):
+    """
+    Summarize a transition matrix per earlier subject
+
+    Returns:
+        list: {'subject', 'students', 'destinations': [{'subject', 'count',
+        'percentage'}]} sorted by students, destinations by count
+    """
+    matrix = transitions['matrix']
+    to_subjects = transitions['to_subjects']
+    summary = []
+    for i, subject in enumerate(transitions['from_subjects']):
+        row = matrix[i]
+        students = int(transitions['from_totals'][i])
+        order = np.argsort(-row, kind='stable')[:limit]
+        summary.append({
+            'subject': subject,
+            'students': students,
+            'destinations': [
+                {'subject': to_subjects[j], 'count': int(row[j]),
+                 'percentage': round(row[j] / students * 100, 1) if students else 0}
+                for j in order if row[j] > 0
+            ],
+        })
+    summary = [item for item in summary if item['students']]
+    summary.sort(key=lambda item: item['students'], reverse=True)
+    return summary
+
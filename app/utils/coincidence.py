@@ -0,0 +1,176 @@
+"""
+Persisted subject coincidence (pair count) matrices for uploads
+"""
+from collections import Counter
+from itertools import combinations
+from sqlalchemy import insert, select
+from app import db
+from app.models import StudentChoice, SubjectCoincidence, CHOICE_COLUMNS
+
+
+def subject_set(choices):
+    """Return the sorted distinct subjects of a list of choice values"""
+    return sorted({choice.strip() for choice in choices if choice and choice.strip()})
+
+
+def subject_pairs(subjects):
+    """
+    Yield the (subject_a, subject_b) pairs for one student's sorted subjects.
+
+    Includes the diagonal (subject, subject) so totals per subject are kept
+    alongside the k*(k-1)/2 off-diagonal pairs.
+    """
+    for subject in subjects:
+        yield subject, subject
+    yield from combinations(subjects, 2)
+
+
+def count_subject_pairs(choice_rows):
+    """
+    Count subject pairs over an iterable of choice rows
+
+    Args:
+        choice_rows: Iterable of sequences of choice values (one per student)
+
+    Returns:
+        Counter: {(subject_a, subject_b): students taking both}
+    """
+    counts = Counter()
+    for row in choice_rows:
+        counts.update(subject_pairs(subject_set(row)))
+    return counts
+
+
+def _included_choice_rows(upload_id):
+    """Read only the choice columns of the included students of an upload"""
+    columns = [getattr(StudentChoice, name) for name in CHOICE_COLUMNS]
+    return db.session.execute(
+        select(*columns).where(StudentChoice.upload_id == upload_id,
+                               StudentChoice.included_in_analysis.is_(True))
+    ).all()
+
+
+def store_coincidence(upload_id):
+    """
+    Compute and store the pair counts of an upload from its included students.
+
+    Does not commit; the caller owns the transaction.
+    """
+    counts = count_subject_pairs(_included_choice_rows(upload_id))
+    SubjectCoincidence.query.filter_by(upload_id=upload_id)\
+        .delete(synchronize_session=False)
+    if counts:
+        db.session.execute(insert(SubjectCoincidence), [
+            {'upload_id': upload_id, 'subject_a': a, 'subject_b': b, 'student_count': count}
+            for (a, b), count in counts.items()
+        ])
+    return counts
+
+
+def adjust_coincidence(upload_id, choices, delta):
+    """
+    Apply one student's inclusion change to the stored pair counts.
+
+    Only the student's own k*(k-1)/2 pairs (plus k diagonal cells) are
+    touched. Does not commit; the caller owns the transaction.
+
+    Args:
+        upload_id: DataUpload id
+        choices: The student's choice values
+        delta: +1 when the student is included, -1 when excluded
+    """
+    subjects = subject_set(choices)
+    if not subjects:
+        return
+
+    wanted = set(subject_pairs(subjects))
+    rows = SubjectCoincidence.query.filter(
+        SubjectCoincidence.upload_id == upload_id,
+        SubjectCoincidence.subject_a.in_(subjects),
+        SubjectCoincidence.subject_b.in_(subjects)
+    ).all()
+
+    for row in rows:
+        pair = (row.subject_a, row.subject_b)
+        if pair not in wanted:
+            continue
+        wanted.discard(pair)
+        row.student_count += delta
+        if row.student_count <= 0:
+            db.session.delete(row)
+
+    if delta > 0:
+        for subject_a, subject_b in wanted:
+            db.session.add(SubjectCoincidence(upload_id=upload_id, subject_a=subject_a,
+                                              subject_b=subject_b, student_count=delta))
+
+
+def delete_coincidence(upload_id):
+    """Remove the stored pair counts of an upload (caller commits)"""
+    SubjectCoincidence.query.filter_by(upload_id=upload_id)\
+        .delete(synchronize_session=False)
+
+
+def _coincidence_rows(upload_id):
+    """
+    Read the stored (subject_a, subject_b, count) rows of an upload.
+
+    Pair counts are only written when an upload is processed, updated or
+    has a student toggled (and by ``flask init-db`` for older uploads). An
+    upload with no stored rows, e.g. because every student is excluded, is
+    counted in memory, so reads never write.
+    """
+    rows = db.session.execute(
+        select(SubjectCoincidence.subject_a, SubjectCoincidence.subject_b,
+               SubjectCoincidence.student_count)
+        .where(SubjectCoincidence.upload_id == upload_id)
+    ).all()
+
+    if not rows:
+        counts = count_subject_pairs(_included_choice_rows(upload_id))
+        rows = [(a, b, count) for (a, b), count in counts.items()]
+    return rows
+
+
+def load_coincidence(upload_id):
+    """
+    Load the stored coincidence matrix of an upload with one indexed read.
+
+    Returns:
+        tuple: (all_subjects, coincidence_matrix, subject_totals) where the
+        matrix is a symmetric dict of dicts including zero cells
+    """
+    rows = _coincidence_rows(upload_id)
+
+    subject_totals = {a: count for a, b, count in rows if a == b}
+    all_subjects = sorted(subject_totals)
+
+    coincidence_matrix = {subject: dict.fromkeys(all_subjects, 0) for subject in all_subjects}
+    for subject_a, subject_b, count in rows:
+        coincidence_matrix[subject_a][subject_b] = count
+        coincidence_matrix[subject_b][subject_a] = count
+
+    return all_subjects, coincidence_matrix, subject_totals
+
+
+def load_coincidence_counts(upload_id):
+    """
+    Load the coincidence matrix of an upload as a flat row-major list.
+
+    Cell (i, j) of the symmetric matrix is ``counts[i * len(subjects) + j]``;
+    the diagonal holds the students per subject.
+
+    Returns:
+        tuple: (all_subjects, counts)
+    """
+    rows = _coincidence_rows(upload_id)
+    all_subjects = sorted({a for a, b, count in rows if a == b})
+    index = {subject: i for i, subject in enumerate(all_subjects)}
+    size = len(all_subjects)
+
+    counts = [0] * (size * size)
+    for subject_a, subject_b, count in rows:
+        i, j = index[subject_a], index[subject_b]
+        counts[i * size + j] = count
+        counts[j * size + i] = count
+    return all_subjects, counts
@@ -0,0 +1,130 @@
+"""
+Frequent subject-combination mining over student choice matrices
+
+Each subject is held as a bitset over students (one bit per pupil, packed
+into bytes). A combination's support is the popcount of the AND of its
+subjects' bitsets. Combinations are grown level by level by extending each
+frequent combination with a higher-indexed frequent subject, so only
+frequent prefixes are ever extended (downward closure). Every level is
+evaluated as whole-array NumPy operations.
+"""
+import numpy as np
+
+# Number of set bits for every byte value
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint16)
+
+# Upper bound on candidates evaluated per NumPy batch (bounds peak memory)
+CANDIDATE_BATCH_SIZE = 50000
+
+
+class TooManyCombinationsError(ValueError):
+    """Raised when a support threshold would produce an unbounded result"""
+
+
+def subject_bitsets(matrix):
+    """
+    Pack a students x subjects 0/1 matrix into per-subject bitsets
+
+    Returns:
+        uint8 array (subjects x ceil(students / 8))
+    """
+    return np.packbits(np.asarray(matrix, dtype=bool), axis=0).T.copy()
+
+
+def popcount(bitsets):
+    """Count set bits along the last axis of a uint8 bitset array"""
+    return _POPCOUNT[bitsets].sum(axis=-1, dtype=np.int64)
+
+
+def _extend_level(prefix_items, prefix_bits, item_bits, min_support):
+    """
+    Extend every frequent combination by one higher-indexed subject
+
+    Args:
+        prefix_items: int array (F x k) of frequent k-combinations (sorted rows)
+        prefix_bits: uint8 array (F x nbytes) bitsets of those combinations
+        item_bits: uint8 array (S x nbytes) bitsets of frequent single subjects
+        min_support: Minimum number of students
+
+    Returns:
+        tuple: (items F' x k+1, bits F' x nbytes, support F')
+    """
+    item_count = item_bits.shape[0]
+    last = prefix_items[:, -1]
+    # All (prefix, item) pairs where item sorts after the prefix's last item
+    prefix_idx, item_idx = np.nonzero(np.arange(item_count)[None, :] > last[:, None])
+
+    kept_items, kept_bits, kept_support = [], [], []
+    for start in range(0, len(prefix_idx), CANDIDATE_BATCH_SIZE):
+        p = prefix_idx[start:start + CANDIDATE_BATCH_SIZE]
+        i = item_idx[start:start + CANDIDATE_BATCH_SIZE]
+        bits = prefix_bits[p] & item_bits[i]
+        support = popcount(bits)
+        frequent = support >= min_support
+        if frequent.any():
+            kept_items.append(np.column_stack([prefix_items[p[frequent]], i[frequent]]))
+            kept_bits.append(bits[frequent])
+            kept_support.append(support[frequent])
+
+    width = prefix_items.shape[1] + 1
+    if not kept_items:
+        return (np.empty((0, width), dtype=np.int64),
+                np.empty((0, prefix_bits.shape[1]), dtype=np.uint8),
+                np.empty(0, dtype=np.int64))
+    return np.concatenate(kept_items), np.concatenate(kept_bits), np.concatenate(kept_support)
+
+
+def mine_frequent_combinations(matrix, subjects, min_support=5, min_size=3, max_size=5,
+                               max_combinations=200000):
+    """
+    Find every subject combination taken by at least ``min_support`` students
+
+    Args:
+        matrix: students x subjects 0/1 array
+        subjects: Subject names aligned with the matrix columns
+        min_support: Minimum number of students taking all subjects in a combination
+        min_size: Smallest combination size to report
+        max_size: Largest combination size to mine
+        max_combinations: Abort if any level exceeds this many frequent combinations
+
+    Returns:
+        list of dicts {'subjects': [...], 'size': k, 'count': n}, largest
+        counts first within each size
+    """
+    min_support = max(1, int(min_support))
+    matrix = np.asarray(matrix, dtype=np.uint8)
+    if matrix.size == 0:
+        return []
+
+    # Level 1: frequent single subjects
+    support = matrix.sum(axis=0, dtype=np.int64)
+    frequent = np.flatnonzero(support >= min_support)
+    item_bits = subject_bitsets(matrix[:, frequent])
+
+    items = np.arange(len(frequent), dtype=np.int64)[:, None]
+    bits = item_bits
+    levels = [(items, support[frequent])]
+
+    for _ in range(2, max_size + 1):
+        if len(items) == 0:
+            break
+        items, bits, level_support = _extend_level(items, bits, item_bits, min_support)
+        if len(items) > max_combinations:
+            raise TooManyCombinationsError(
+                f'More than {max_combinations} combinations of {items.shape[1]} subjects '
+                f'are taken by {min_support}+ students; raise the minimum support')
+        levels.append((items, level_support))
+
+    results = []
+    for level_items, level_support in levels:
+        size = level_items.shape[1]
+        if size < min_size:
+            continue
+        order = np.argsort(-level_support, kind='stable')
+        for row in order:
+            results.append({
+                'subjects': [subjects[frequent[i]] for i in level_items[row]],
+                'size': size,
+                'count': int(level_support[row]),
+            })
+    return results
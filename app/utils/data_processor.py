@@ -1,36 +1,59 @@
 """
 Data processing utilities for analyzing subject choice data
+
+pandas and numpy are imported inside the functions that need them so that
+importing the app (e.g. in each web worker) does not pay for them.
 """
-import pandas as pd
 from collections import Counter
 import os
 from .subject_mappings import normalize_subject_name
+from .upload_files import (COMPRESSED_EXTENSIONS, MAX_DECOMPRESSED_LENGTH,
+                           file_extension, open_compressed_csv)
 
 
 def allowed_file(filename, allowed_extensions):
-    """Check if file extension is allowed"""
+    """Check if file extension is allowed (``.csv.gz`` counts as one extension)"""
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in allowed_extensions
+           file_extension(filename) in allowed_extensions
+
+
+# Standardized choice columns (option columns A-H)
+CHOICE_FIELDS = [f'choice_{letter}' for letter in ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']]
+
+
+def format_academic_year(start_year):
+    """The academic year starting in a calendar year, e.g. 2024 -> "2024-25" """
+    return f'{start_year}-{(start_year + 1) % 100:02d}'
+
+
+def academic_year_start(academic_year):
+    """First calendar year of a stored academic year such as "2024-25", or None"""
+    return int(academic_year[:4]) if academic_year and academic_year[:4].isdigit() else None
 
 
 def extract_academic_year_from_filename(filename):
     """
-    Extract academic year from filename
-    e.g., "S3_2024-25.xlsx" -> "2024-25"
+    Extract academic year from filename, normalised to "YYYY-YY"
+
+    e.g. "S3_2024-25.xlsx", "S3 2024-2025.xlsx" and "S3 202425.xlsx" -> "2024-25".
+    A single year is taken as the start of the academic year (option
+    choices are made in spring for the following session), so
+    "S4 Timetable Data 2024.xlsx" -> "2024-25".
     """
-    # Try to find a pattern like 2024-25 or 202425
     import re
-    match = re.search(r'20\d{2}[-_]?\d{2}', filename)
+    # A range: 2024-25, 2024_2025, 2024/25 or 202425, with consecutive years
+    for match in re.finditer(r'(?<!\d)(20\d{2})\s*[-_/]?\s*(20\d{2}|\d{2})(?!\d)', filename):
+        start, end = int(match.group(1)), int(match.group(2))
+        if end % 100 == (start + 1) % 100:
+            return format_academic_year(start)
+    # A single year
+    match = re.search(r'(?<!\d)20\d{2}(?!\d)', filename)
     if match:
-        year_str = match.group()
-        if '-' not in year_str and '_' not in year_str:
-            # Convert 202425 to 2024-25
-            return f"{year_str[:4]}-{year_str[4:]}"
-        return year_str.replace('_', '-')
+        return format_academic_year(int(match.group()))
     return None
 
 
-def read_subject_choices_file(filepath, year_group):
+def read_subject_choices_file(filepath, year_group, max_decompressed_length=MAX_DECOMPRESSED_LENGTH):
     """
     Read subject choices file and return structured data
     
@@ -41,14 +64,23 @@ def read_subject_choices_file(filepath, year_group):
     - Columns A-H (S3), A-G (S4), A-F (S5-6)
     
     Args:
-        filepath: Path to the file
+        filepath: Path to the file (.csv, .xlsx, .xls, or a .csv.gz/.zip
+            compressed CSV, which is read without inflating it to disk)
         year_group: S3, S4, or S5-6
+        max_decompressed_length: Maximum decompressed size of a compressed CSV
         
     Returns:
-        pandas.DataFrame with standardized columns
+        pandas.DataFrame with standardized columns; ``reg_class`` and the
+        choice columns are Categoricals (the choice columns share one set of
+        stripped categories, empty cells are missing)
     """
+    import pandas as pd
+    
     # Read file
-    if filepath.endswith('.csv'):
+    if file_extension(filepath) in COMPRESSED_EXTENSIONS:
+        with open_compressed_csv(filepath, max_decompressed_length) as f:
+            df = pd.read_csv(f)
+    elif filepath.endswith('.csv'):
         df = pd.read_csv(filepath)
     else:  # Excel
         df = pd.read_excel(filepath)
@@ -87,14 +119,14 @@ def read_subject_choices_file(filepath, year_group):
     result = pd.DataFrame()
     result['forename'] = df[forename_col]
     result['surname'] = df[surname_col]
-    result['reg_class'] = df[reg_col] if reg_col else ''
+    empty = pd.Series(None, index=df.index, dtype=object)
+    result['reg_class'] = shared_categoricals([df[reg_col] if reg_col else empty])[0]
     
-    # Add choice columns
-    for letter in ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']:
-        if letter in choice_columns:
-            result[f'choice_{letter}'] = df[choice_columns[letter]].fillna('')
-        else:
-            result[f'choice_{letter}'] = ''
+    # Add choice columns, encoded against one shared subject index
+    choices = shared_categoricals([df[choice_columns[letter]] if letter in choice_columns else empty
+                                   for letter in ['a', 'b', 'c', 'd', 'e', 'f', 'g', 'h']])
+    for field, column in zip(CHOICE_FIELDS, choices):
+        result[field] = column
     
     # Remove completely empty rows
     result = result[result['forename'].notna() & (result['forename'] != '')]
@@ -102,6 +134,93 @@ def read_subject_choices_file(filepath, year_group):
     return result
 
 
+def shared_categoricals(columns):
+    """
+    Encode columns as Categoricals sharing one sorted category index
+    
+    Values are stripped of whitespace; empty cells become missing (code -1).
+    Cleaning runs once per distinct value rather than once per cell.
+    
+    Args:
+        columns: List of pandas Series with a common index
+        
+    Returns:
+        list: Categorical Series, in the same order
+    """
+    import numpy as np
+    import pandas as pd
+    
+    codes, uniques = pd.factorize(pd.concat(columns, ignore_index=True))
+    cleaned = [str(value).strip() for value in uniques]
+    categories = sorted(set(value for value in cleaned if value))
+    position = {value: i for i, value in enumerate(categories)}
+    # The trailing -1 keeps missing cells (code -1) missing
+    lookup = np.array([position.get(value, -1) for value in cleaned] + [-1], dtype=np.int32)
+    codes = lookup[codes]
+    
+    encoded = []
+    start = 0
+    for column in columns:
+        stop = start + len(column)
+        encoded.append(pd.Series(pd.Categorical.from_codes(codes[start:stop], categories),
+                                 index=column.index, name=column.name))
+        start = stop
+    return encoded
+
+
+def normalize_choice_categories(df, year_group):
+    """
+    Apply subject name normalization to a standardized frame
+    
+    Each distinct subject is normalized once; names that normalize to the
+    same friendly name are merged into one category.
+    
+    Returns:
+        pandas.DataFrame: Copy of ``df`` with normalized choice columns
+    """
+    import numpy as np
+    import pandas as pd
+    
+    categories = df[CHOICE_FIELDS[0]].cat.categories
+    normalized = [normalize_subject_name(subject, year_group) for subject in categories]
+    new_categories = sorted(set(name for name in normalized if name))
+    position = {name: i for i, name in enumerate(new_categories)}
+    lookup = np.array([position[name] if name else -1 for name in normalized] + [-1], dtype=np.int32)
+    
+    return df.assign(**{
+        field: pd.Categorical.from_codes(lookup[df[field].cat.codes.to_numpy()], new_categories)
+        for field in CHOICE_FIELDS
+    })
+
+
+def choice_categories(df):
+    """Return the distinct subjects used in a standardized frame's choice columns"""
+    import numpy as np
+    
+    categories = df[CHOICE_FIELDS[0]].cat.categories
+    used = np.unique(np.concatenate([df[field].cat.codes.to_numpy() for field in CHOICE_FIELDS]))
+    return [categories[code] for code in used if code >= 0]
+
+
+def iter_student_rows(df):
+    """
+    Yield one dict of plain values per row of a standardized frame
+    
+    Missing choices are None and a missing registration class is ''.
+    """
+    encoded = {}
+    for field in ['reg_class'] + CHOICE_FIELDS:
+        column = df[field].cat
+        encoded[field] = (column.codes.to_numpy(), list(column.categories) + [None])
+    
+    for i, (forename, surname) in enumerate(zip(df['forename'], df['surname'])):
+        row = {'forename': forename, 'surname': surname}
+        for field, (codes, values) in encoded.items():
+            row[field] = values[codes[i]]
+        row['reg_class'] = row['reg_class'] or ''
+        yield row
+
+
 def calculate_subject_totals(student_choices, include_excluded=False, year_group=None):
     """
     Calculate subject totals from student choice records
@@ -158,39 +277,3 @@ def process_data_file(filepath, year_group):
     
     return dict(subject_counts)
 
-
-def generate_summary_statistics(subject_choices):
-    """
-    Generate summary statistics from subject choice data
-    
-    Args:
-        subject_choices: List of SubjectChoice objects
-    
-    Returns:
-        dict: Summary statistics
-    """
-    if not subject_choices:
-        return {
-            'total_choices': 0,
-            'unique_subjects': 0,
-            'most_popular': None,
-            'least_popular': None,
-            'average_choices': 0
-        }
-    
-    total_choices = sum(sc.choice_count for sc in subject_choices)
-    unique_subjects = len(subject_choices)
-    
-    sorted_choices = sorted(subject_choices, key=lambda x: x.choice_count, reverse=True)
-    most_popular = sorted_choices[0] if sorted_choices else None
-    least_popular = sorted_choices[-1] if sorted_choices else None
-    
-    average_choices = total_choices / unique_subjects if unique_subjects > 0 else 0
-    
-    return {
-        'total_choices': total_choices,
-        'unique_subjects': unique_subjects,
-        'most_popular': most_popular,
-        'least_popular': least_popular,
-        'average_choices': round(average_choices, 2)
-    }
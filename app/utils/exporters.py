@@ -0,0 +1,123 @@
+"""
+Streaming CSV and write-only XLSX export of analysis results
+"""
+import csv
+import io
+import tempfile
+from sqlalchemy import func, select
+from app import db
+from app.models import StudentChoice, SubjectChoice, CHOICE_COLUMNS
+from .coincidence import load_coincidence
+
+# Flush the CSV buffer to the client once it holds this many characters
+CSV_CHUNK_SIZE = 16 * 1024
+
+# Keep XLSX output in memory up to this size before spilling to disk
+XLSX_SPOOL_SIZE = 8 * 1024 * 1024
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+STUDENT_HEADER = ['Forename', 'Surname', 'Reg Class', 'Included',
+                  'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
+
+SUBJECT_TOTAL_HEADER = ['Rank', 'Subject', 'Number of Choices', 'Percentage']
+
+
+def iter_csv(header, rows):
+    """
+    Yield CSV text in chunks as rows are produced
+
+    Only one chunk is buffered at a time, so memory use is constant however
+    many rows are exported.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def write_xlsx(header, rows, sheet_title='Export'):
+    """
+    Write rows to an XLSX workbook using openpyxl's write-only mode
+
+    Rows are streamed into the worksheet rather than held as cell objects.
+    The finished workbook is returned in a spooled temporary file that
+    stays in memory while small and spills to disk when large.
+
+    Returns:
+        File object positioned at the start of the workbook
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title=sheet_title[:31])
+    worksheet.append(header)
+    for row in rows:
+        worksheet.append(list(row))
+
+    output = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_SIZE)
+    workbook.save(output)
+    output.seek(0)
+    return output
+
+
+def student_rows(upload_id, batch_size=1000):
+    """Yield one row per student of an upload, fetched in batches"""
+    columns = [getattr(StudentChoice, name) for name in CHOICE_COLUMNS]
+    result = db.session.execute(
+        select(StudentChoice.forename, StudentChoice.surname, StudentChoice.reg_class,
+               StudentChoice.included_in_analysis, *columns)
+        .where(StudentChoice.upload_id == upload_id)
+        .order_by(StudentChoice.surname, StudentChoice.forename)
+        .execution_options(yield_per=batch_size)
+    )
+    for forename, surname, reg_class, included, *choices in result:
+        yield [forename, surname, reg_class, 'Yes' if included else 'No',
+               *[choice or '' for choice in choices]]
+
+
+def subject_total_rows(upload):
+    """
+    Yield ranked subject totals of an upload with percentages of the
+    students included in analysis (as on the results page and year summary)
+    """
+    included = db.session.execute(
+        select(func.count()).select_from(StudentChoice)
+        .where(StudentChoice.upload_id == upload.id,
+               StudentChoice.included_in_analysis.is_(True))
+    ).scalar()
+    result = db.session.execute(
+        select(SubjectChoice.subject_name, SubjectChoice.choice_count)
+        .where(SubjectChoice.upload_id == upload.id)
+        .order_by(SubjectChoice.choice_count.desc())
+    )
+    for rank, (subject, count) in enumerate(result, start=1):
+        percentage = round(count / included * 100, 1) if included else 0
+        yield [rank, subject, count, percentage]
+
+
+def coincidence_export(upload_id):
+    """
+    Return the header and a row generator for an upload's coincidence matrix
+
+    The diagonal holds the number of students taking each subject.
+    """
+    all_subjects, coincidence_matrix, subject_totals = load_coincidence(upload_id)
+    header = ['Subject', *all_subjects, 'Total']
+
+    def rows():
+        for subject in all_subjects:
+            cells = coincidence_matrix[subject]
+            yield [subject, *[cells[other] for other in all_subjects], subject_totals[subject]]
+
+    return header, rows()
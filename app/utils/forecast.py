@@ -0,0 +1,170 @@
+"""
+Next-year subject demand forecasts from a year group's history
+
+The stored subject totals of a user's year group are arranged as a
+subject x academic-year count matrix (the latest upload of each year
+counts). A least-squares linear trend and Holt's linear exponential
+smoothing are then fitted to every subject at once with NumPy array
+operations, and both are projected one academic year ahead.
+"""
+from sqlalchemy import select
+from app import db
+from app.models import DataUpload, SubjectChoice
+from .data_processor import academic_year_start, format_academic_year
+
+# Holt smoothing factors for the level and the trend
+SMOOTHING_LEVEL = 0.5
+SMOOTHING_TREND = 0.3
+
+
+def forecast_uploads(user_id, year_group):
+    """
+    The upload used for each academic year of a year group
+
+    Read through the (user_id, year_group, academic_year) index. Years come
+    from the stored academic year (as for cohort pairing); uploads without
+    one are left out and the most recent upload of a year wins.
+
+    Returns:
+        list: DataUpload objects, oldest academic year first
+    """
+    uploads = DataUpload.query.filter(
+        DataUpload.user_id == user_id,
+        DataUpload.year_group == year_group,
+        DataUpload.academic_year.is_not(None),
+        DataUpload.processed.is_(True),
+        DataUpload.deleted_at.is_(None)
+    ).order_by(DataUpload.upload_date.desc()).all()
+
+    by_year = {}
+    for upload in uploads:
+        by_year.setdefault(academic_year_start(upload.academic_year), upload)
+    by_year.pop(None, None)
+    return [by_year[year] for year in sorted(by_year)]
+
+
+def next_academic_year(academic_year):
+    """The academic year after e.g. "2024-25" ("2025-26")"""
+    return format_academic_year(academic_year_start(academic_year) + 1)
+
+
+def demand_matrix(uploads):
+    """
+    Build the subject x academic-year matrix of stored choice counts
+
+    Args:
+        uploads: One DataUpload per academic year, oldest first
+
+    Returns:
+        tuple: (subjects, counts) where counts is an int64 array of shape
+        (subjects, uploads); subjects missing in a year count 0
+    """
+    import numpy as np
+
+    column = {upload.id: i for i, upload in enumerate(uploads)}
+    rows = db.session.execute(
+        select(SubjectChoice.upload_id, SubjectChoice.subject_name, SubjectChoice.choice_count)
+        .where(SubjectChoice.upload_id.in_(list(column)))
+    ).all()
+
+    subjects = sorted({name for _, name, _ in rows})
+    index = {subject: i for i, subject in enumerate(subjects)}
+    counts = np.zeros((len(subjects), len(uploads)), dtype=np.int64)
+    if rows:
+        upload_ids, names, values = zip(*rows)
+        counts[[index[name] for name in names], [column[upload_id] for upload_id in upload_ids]] = values
+    return subjects, counts
+
+
+def linear_trend(counts, years):
+    """
+    Least-squares line through each row of ``counts``
+
+    Args:
+        counts: Array (subjects x years)
+        years: Start year of each column (gaps between years are allowed)
+
+    Returns:
+        tuple: (slope, intercept) arrays, one value per subject
+    """
+    import numpy as np
+
+    x = np.asarray(years, dtype=np.float64)
+    y = np.asarray(counts, dtype=np.float64)
+    dx = x - x.mean()
+    spread = float(dx @ dx)
+    slope = (y - y.mean(axis=1, keepdims=True)) @ dx / spread if spread else np.zeros(len(y))
+    intercept = y.mean(axis=1) - slope * x.mean()
+    return slope, intercept
+
+
+def holt_smoothing(counts, alpha=SMOOTHING_LEVEL, beta=SMOOTHING_TREND):
+    """
+    Holt's linear exponential smoothing of each row of ``counts``
+
+    Columns are taken as consecutive years; the loop runs over years while
+    every step updates all subjects together.
+
+    Returns:
+        tuple: (level, trend) arrays after the last year
+    """
+    import numpy as np
+
+    y = np.asarray(counts, dtype=np.float64)
+    level = y[:, 0].copy()
+    trend = y[:, 1] - y[:, 0] if y.shape[1] > 1 else np.zeros(len(y))
+    for t in range(1, y.shape[1]):
+        previous = level
+        level = alpha * y[:, t] + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous) + (1 - beta) * trend
+    return level, trend
+
+
+def forecast_demand(uploads, year_group):
+    """
+    Project next year's demand for every subject of a year group
+
+    Args:
+        uploads: One DataUpload per academic year, oldest first (as
+            returned by ``forecast_uploads``)
+        year_group: The uploads' year group
+
+    Returns:
+        dict: JSON-serializable forecast with 'years', the upload used per
+        year, 'next_year' and per-subject 'history', 'linear' and
+        'smoothed' projections (rounded, never negative), or a 'message'
+        when fewer than two academic years are known
+    """
+    import numpy as np
+
+    years = [upload.academic_year for upload in uploads]
+    result = {
+        'year_group': year_group,
+        'years': years,
+        'uploads': [{'id': upload.id, 'filename': upload.original_filename,
+                     'academic_year': upload.academic_year} for upload in uploads],
+        'next_year': next_academic_year(years[-1]) if years else None,
+        'subjects': [],
+    }
+    if len(uploads) < 2:
+        result['message'] = 'At least two academic years of uploads are needed for a forecast'
+        return result
+
+    subjects, counts = demand_matrix(uploads)
+    start_years = [academic_year_start(year) for year in years]
+    slope, intercept = linear_trend(counts, start_years)
+    linear = slope * (start_years[-1] + 1) + intercept
+    level, trend = holt_smoothing(counts)
+    smoothed = level + trend
+
+    linear = np.clip(np.rint(linear), 0, None).astype(np.int64)
+    smoothed = np.clip(np.rint(smoothed), 0, None).astype(np.int64)
+    for i in np.argsort(-counts[:, -1], kind='stable'):
+        result['subjects'].append({
+            'subject': subjects[i],
+            'history': counts[i].tolist(),
+            'linear': int(linear[i]),
+            'smoothed': int(smoothed[i]),
+            'trend_per_year': round(float(slope[i]), 1),
+        })
+    return result
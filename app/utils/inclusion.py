@@ -0,0 +1,154 @@
+"""
+Including and excluding students from an upload's analysis
+
+Changes arrive in batches with the upload's ``data_version`` the editor
+last saw. The version is checked and incremented with one conditional
+UPDATE at the start of the transaction, so concurrent editors cannot
+overwrite each other's view of the upload unnoticed: the loser gets a
+VersionConflict carrying the current state.
+
+Recomputing totals and the statistics profile is serialized per upload
+within one worker process (other processes recalculate independently;
+the version check above is what keeps them consistent). A request that
+finds a recalculation already running for its upload leaves it to that
+one, which repeats once more, so a burst of edits costs one or two
+recomputes rather than one each.
+"""
+import threading
+from sqlalchemy import update
+from app import db
+from app.models import DataUpload, StudentChoice
+from .coincidence import adjust_coincidence
+from .statistics import refresh_statistics
+from .totals import recompute_subject_totals
+
+_recalculations = {}
+_recalculations_lock = threading.Lock()
+
+
+class VersionConflict(Exception):
+    """Raised when an upload changed since the editor loaded it"""
+
+    def __init__(self, version, students):
+        super().__init__('This upload was changed by someone else')
+        self.version = version
+        self.students = students
+
+
+def _inclusion_states(upload_id, student_ids):
+    """Return {student id: included} for students of an upload"""
+    return {
+        student_id: bool(included)
+        for student_id, included in db.session.query(StudentChoice.id,
+                                                     StudentChoice.included_in_analysis)
+        .filter(StudentChoice.upload_id == upload_id, StudentChoice.id.in_(student_ids))
+    }
+
+
+def apply_inclusion_changes(upload, changes, expected_version=None):
+    """
+    Set the inclusion of several students of an upload and commit.
+
+    Stored pair counts are adjusted per changed student; totals are left to
+    ``recalculate_upload``.
+
+    Args:
+        upload: DataUpload
+        changes: {student id: included} desired states
+        expected_version: The data_version the editor saw, or None to skip
+            the check
+
+    Returns:
+        tuple: (new data_version, {student id: included} after the change)
+
+    Raises:
+        VersionConflict: If expected_version is no longer current
+        KeyError: If a student does not belong to the upload
+    """
+    condition = [DataUpload.id == upload.id]
+    if expected_version is not None:
+        condition.append(DataUpload.data_version == expected_version)
+    # Taking the write lock first makes concurrent batches queue here
+    result = db.session.execute(
+        update(DataUpload).where(*condition)
+        .values(data_version=DataUpload.data_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.rollback()
+        db.session.refresh(upload)
+        raise VersionConflict(upload.data_version, _inclusion_states(upload.id, list(changes)))
+
+    students = StudentChoice.query.filter(StudentChoice.upload_id == upload.id,
+                                          StudentChoice.id.in_(list(changes))).all()
+    missing = set(changes) - {student.id for student in students}
+    if missing:
+        db.session.rollback()
+        raise KeyError(f'Students not in this upload: {sorted(missing)}')
+
+    for student in students:
+        included = bool(changes[student.id])
+        if bool(student.included_in_analysis) == included:
+            continue
+        student.included_in_analysis = included
+        adjust_coincidence(upload.id, student.get_choices(), 1 if included else -1)
+
+    db.session.commit()
+    db.session.refresh(upload)
+    return upload.data_version, {student.id: bool(student.included_in_analysis) for student in students}
+
+
+def _recalculation_state(upload_id):
+    """Register a pending recalculation of an upload and return its shared state"""
+    with _recalculations_lock:
+        state = _recalculations.setdefault(upload_id, {'lock': threading.Lock(), 'pending': False})
+        state['pending'] = True
+        return state
+
+
+def _finish_recalculation(upload_id, state):
+    """
+    Release the upload's lock; forget the upload unless a request is pending
+
+    Returns:
+        bool: Whether another recalculation was requested meanwhile
+    """
+    with _recalculations_lock:
+        state['lock'].release()
+        if state['pending']:
+            return True
+        if _recalculations.get(upload_id) is state:
+            del _recalculations[upload_id]
+        return False
+
+
+def recalculate_upload(upload_id):
+    """
+    Recompute an upload's subject totals and statistics profile and commit.
+
+    Returns without waiting if another thread of this process is already
+    recalculating the upload; that thread runs again to include this
+    request's changes. Only threads of the same process are coordinated.
+
+    Returns:
+        bool: Whether this call did the recalculation
+    """
+    state = _recalculation_state(upload_id)
+    recalculated = False
+    while True:
+        if not state['lock'].acquire(blocking=False):
+            return recalculated
+        try:
+            while state['pending']:
+                state['pending'] = False
+                upload = db.session.get(DataUpload, upload_id)
+                recompute_subject_totals(upload)
+                refresh_statistics(upload)
+                db.session.commit()
+                recalculated = True
+        except Exception:
+            db.session.rollback()
+            _finish_recalculation(upload_id, state)
+            raise
+        if not _finish_recalculation(upload_id, state):
+            return recalculated
@@ -0,0 +1,159 @@
+"""
+Upload ingest pipeline shared by the web upload flow and ``flask ingest``
+
+Parsing (``parse_upload_file``) needs no app context, so bulk loads can run
+it in worker processes; importing the parsed frame (``import_upload``)
+writes to the database and runs in the app process.
+"""
+import glob
+import hashlib
+import os
+import re
+import secrets
+from datetime import datetime
+from sqlalchemy import insert
+from app import db
+from app.models import DataUpload, StudentChoice, CHOICE_COLUMNS, RAW_CHOICE_COLUMNS
+from .coincidence import store_coincidence
+from .statistics import frame_profile
+from .data_processor import (allowed_file, extract_academic_year_from_filename,
+                             iter_student_rows, normalize_choice_categories,
+                             read_subject_choices_file)
+from .totals import count_subject_choices, replace_subject_totals
+from .upload_files import file_extension, save_upload
+from .user_stats import adjust_user_stats
+
+YEAR_GROUP_PATTERN = re.compile(r'(?<![A-Za-z0-9])(S5-6|S3|S4)(?![0-9])', re.IGNORECASE)
+
+
+def parse_upload_file(filepath, year_group, max_decompressed_length):
+    """Read a data file into the standardized frame (safe to run in a worker process)"""
+    return read_subject_choices_file(filepath, year_group, max_decompressed_length)
+
+
+def student_row_hash(row):
+    """Hash a student row's name, registration class and choices (missing values hash as empty)"""
+    values = [row['forename'], row['surname'], row['reg_class']] + [row[name] for name in CHOICE_COLUMNS]
+    return hashlib.blake2b('\x1f'.join(value or '' for value in values).encode('utf-8'),
+                           digest_size=16).hexdigest()
+
+
+def student_rows(raw_df, df):
+    """
+    Yield the rows of a normalized frame with the file's choices added
+
+    Args:
+        raw_df: Standardized frame as read from the file
+        df: The same frame after ``normalize_choice_categories``
+
+    Yields:
+        dict: ``iter_student_rows`` values plus the raw_choice_* columns
+    """
+    for raw, row in zip(iter_student_rows(raw_df), iter_student_rows(df)):
+        row.update(zip(RAW_CHOICE_COLUMNS, (raw[name] for name in CHOICE_COLUMNS)))
+        yield row
+
+
+def import_upload(upload, df):
+    """
+    Import a parsed data file into an upload and mark it processed.
+
+    Applies the existing subject mappings, stores the student rows, subject
+    totals, pair counts and statistics profile, and updates the owner's stats. Does not commit;
+    the caller owns the transaction.
+
+    Returns:
+        int: Number of student records imported
+    """
+    academic_year = upload.academic_year
+
+    # Normalize each distinct subject name once
+    raw_df, df = df, normalize_choice_categories(df, upload.year_group)
+
+    # Import into StudentChoice staging table
+    rows = [
+        dict(row, upload_id=upload.id, year_group=upload.year_group,
+             academic_year=academic_year, included_in_analysis=True,
+             row_hash=student_row_hash(row))
+        for row in student_rows(raw_df, df)
+    ]
+    if rows:
+        db.session.execute(insert(StudentChoice), rows)
+
+    # Store aggregated results and subject pair counts
+    replace_subject_totals(upload, count_subject_choices(upload.id), academic_year)
+    store_coincidence(upload.id)
+    upload.statistics = frame_profile(df)
+
+    upload.processed = True
+    upload.record_count = len(rows)
+    upload.bump_data_version()
+    adjust_user_stats(upload.user_id, processed=1)
+    return len(rows)
+
+
+def stored_filename(filename):
+    """Unique name for an upload in the upload folder"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f'{timestamp}_{secrets.token_hex(3)}_{filename}'
+
+
+def store_local_file(path, user_id, year_group, upload_folder, max_decompressed_length):
+    """
+    Copy a local data file into the upload folder and create its upload record.
+
+    Does not commit; the caller owns the transaction.
+
+    Returns:
+        DataUpload
+    """
+    from werkzeug.utils import secure_filename
+
+    original_filename = secure_filename(os.path.basename(path))
+    filename = stored_filename(original_filename)
+    with open(path, 'rb') as source:
+        content_hash, _ = save_upload(source, os.path.join(upload_folder, filename),
+                                      max_decompressed_length)
+
+    upload = DataUpload(
+        filename=filename,
+        original_filename=original_filename,
+        file_type=file_extension(original_filename),
+        year_group=year_group,
+        academic_year=extract_academic_year_from_filename(original_filename),
+        content_hash=content_hash,
+        user_id=user_id
+    )
+    db.session.add(upload)
+    db.session.flush()
+    adjust_user_stats(user_id, uploads=1)
+    return upload
+
+
+def find_data_files(patterns, allowed_extensions):
+    """
+    Expand files, directories (searched recursively) and glob patterns
+
+    Returns:
+        list: Sorted, de-duplicated paths of files with allowed extensions
+    """
+    found = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths = glob.glob(os.path.join(pattern, '**', '*'), recursive=True)
+        else:
+            paths = glob.glob(pattern, recursive=True) or [pattern]
+        for path in paths:
+            if os.path.isfile(path) and allowed_file(os.path.basename(path), allowed_extensions) \
+                    and not os.path.basename(path).startswith('~$'):
+                found.add(os.path.abspath(path))
+    return sorted(found)
+
+
+def infer_year_group(path):
+    """Guess a file's year group from its directory or file name (e.g. sample-data/S4/...)"""
+    for part in reversed(os.path.normpath(path).split(os.sep)):
+        match = YEAR_GROUP_PATTERN.search(part)
+        if match:
+            return match.group(1).upper()
+    return None
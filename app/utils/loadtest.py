@@ -0,0 +1,178 @@
+"""
+Load-test harness for the web routes (``flask bench load``)
+
+Virtual users log in through the local stub OAuth provider, get generated
+uploads imported through the normal ingest pipeline, and then repeat
+scripted journeys (browsing, toggling students, analysis pages) against
+the app's test client from a thread pool. Every request is timed and
+recorded under its route's endpoint name.
+"""
+import csv
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from app import db
+from app.models import StudentChoice
+
+# Subjects drawn for generated pupils, roughly in order of popularity
+GENERATED_SUBJECTS = [
+    'English', 'Mathematics', 'Physics', 'Chemistry', 'Biology', 'History',
+    'Geography', 'Modern Studies', 'French', 'Spanish', 'Computing Science',
+    'Art & Design', 'Music', 'Drama', 'Physical Education', 'Business Management',
+    'Administration & IT', 'Graphic Communication', 'Design & Manufacture',
+    'Practical Woodworking', 'Health & Food Technology', 'Religious Studies',
+]
+
+OPTION_LETTERS = 'ABCDEFGH'
+
+# Relative popularity of each generated subject
+_WEIGHTS = [1 / (rank + 2) for rank in range(len(GENERATED_SUBJECTS))]
+
+
+def generate_choices_csv(path, pupils, columns=6, seed=0):
+    """
+    Write a data file of randomly generated pupils and their option choices
+
+    Args:
+        path: CSV file to write
+        pupils: Number of pupils
+        columns: Option columns filled per pupil (A onwards)
+        seed: Random seed, so repeated runs produce the same file
+
+    Returns:
+        str: ``path``
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Forename', 'Surname', 'Reg Class', *OPTION_LETTERS[:columns]])
+        for pupil in range(pupils):
+            choices = []
+            while len(choices) < columns:
+                subject = rng.choices(GENERATED_SUBJECTS, _WEIGHTS)[0]
+                if subject not in choices:
+                    choices.append(subject)
+            # Some pupils leave their last column empty
+            if rng.random() < 0.05:
+                choices[-1] = ''
+            writer.writerow([f'Pupil{pupil}', f'Load{seed}', f'{rng.randint(1, 6)}{rng.choice("ABC")}',
+                             *choices])
+    return path
+
+
+def seed_uploads(user_id, year_group, uploads, pupils, workdir, upload_folder,
+                 max_decompressed_length, seed=0):
+    """
+    Generate and import uploads for a user, one per academic year
+
+    Files go through ``store_local_file``, ``parse_upload_file`` and
+    ``import_upload`` like ``flask ingest``. Commits after each upload.
+
+    Returns:
+        list: The imported DataUpload objects
+    """
+    from .ingest import import_upload, parse_upload_file, store_local_file
+
+    created = []
+    for index in range(uploads):
+        start = 2024 - index
+        path = os.path.join(workdir, f'{year_group} Load Test {user_id} {start}-{(start + 1) % 100:02d}.csv')
+        generate_choices_csv(path, pupils, seed=seed * 1000 + index)
+        upload = store_local_file(path, user_id, year_group, upload_folder, max_decompressed_length)
+        df = parse_upload_file(os.path.join(upload_folder, upload.filename), year_group,
+                               max_decompressed_length)
+        import_upload(upload, df)
+        db.session.commit()
+        created.append(upload)
+    return created
+
+
+class VirtualUser:
+    """A logged-in test client with the uploads and students its journeys use"""
+
+    def __init__(self, client, user_id, year_group, uploads):
+        self.client = client
+        self.user_id = user_id
+        self.year_group = year_group
+        self.upload_ids = [upload.id for upload in uploads]
+        self.student_ids = {
+            upload_id: [student_id for (student_id,) in db.session.query(StudentChoice.id)
+                        .filter(StudentChoice.upload_id == upload_id).limit(200)]
+            for upload_id in self.upload_ids
+        }
+        self.rng = random.Random(user_id)
+
+
+def _browse(user):
+    upload_id = user.rng.choice(user.upload_ids)
+    return [
+        ('main.dashboard', 'GET', '/dashboard'),
+        ('analysis.view_data', 'GET', f'/analysis/view/{upload_id}'),
+        ('analysis.results', 'GET', f'/analysis/results/{upload_id}'),
+        ('analysis.year_summary', 'GET', f'/analysis/summary/{user.year_group}'),
+    ]
+
+
+def _edit(user):
+    upload_id = user.rng.choice(user.upload_ids)
+    steps = [('analysis.view_data', 'GET', f'/analysis/view/{upload_id}')]
+    # Toggle a few students off and back on again
+    for student_id in user.rng.sample(user.student_ids[upload_id],
+                                      min(3, len(user.student_ids[upload_id]))):
+        steps += [('analysis.toggle_student', 'POST', f'/analysis/toggle_student/{student_id}')] * 2
+    steps.append(('analysis.year_summary', 'GET', f'/analysis/summary/{user.year_group}'))
+    return steps
+
+
+def _analyse(user):
+    upload_id = user.rng.choice(user.upload_ids)
+    return [
+        ('analysis.subject_coincidence', 'GET', f'/analysis/subject-coincidence/{upload_id}'),
+        ('analysis.subject_coincidence_data', 'GET', f'/analysis/subject-coincidence/{upload_id}/data'),
+        ('analysis.subject_combinations', 'GET', f'/analysis/subject-combinations/{upload_id}'),
+        ('analysis.option_columns', 'GET', f'/analysis/option-columns/{upload_id}'),
+    ]
+
+
+# Scripted journeys: each returns the (endpoint, method, path) steps of one pass
+JOURNEYS = {
+    'browse': _browse,
+    'edit': _edit,
+    'analyse': _analyse,
+}
+
+
+class LoadResults:
+    """Latencies and failures per endpoint (filled from several threads)"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.failures[endpoint] += 1
+
+    @property
+    def requests(self):
+        return sum(len(samples) for samples in self.latencies.values())
+
+
+def run_journeys(user, journeys, iterations, results):
+    """Run ``iterations`` passes of randomly chosen journeys for one virtual user"""
+    for _ in range(iterations):
+        for endpoint, method, path in JOURNEYS[user.rng.choice(journeys)](user):
+            started = time.perf_counter()
+            try:
+                response = user.client.open(path, method=method)
+                # Redirects count as failures: every scripted step renders or returns JSON
+                ok = 200 <= response.status_code < 300
+                response.close()
+            except Exception:
+                ok = False
+            results.record(endpoint, time.perf_counter() - started, ok)
@@ -0,0 +1,248 @@
+"""
+Option-column (A-H) clash evaluation and arrangement search
+
+An arrangement offers every subject in one or more option columns (a
+subject with several classes can run in several columns). A pupil is left
+with a clash when their subjects cannot each be taken in a different
+column, i.e. when there is no matching of their subjects to distinct
+columns. Arrangements are scored by the number of pupils with a clash.
+
+By Hall's theorem a pupil's subjects can be matched to distinct columns
+unless, for some set of columns, more of their subjects are offered only
+within that set than it has columns. With at most eight columns every set
+can be checked at once, so scoring is a few small matrix products.
+
+This module only depends on NumPy so search workers start quickly.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+COLUMN_LETTERS = 'ABCDEFGH'
+
+
+def current_arrangement(matrix, slots, column_count):
+    """
+    Derive the arrangement implied by an upload's data
+
+    Each subject is offered in every option column pupils chose it in;
+    subjects nobody chose in a known column are placed in column A.
+
+    Args:
+        matrix: students x subjects 0/1 array
+        slots: students x subjects array of chosen column (0-7) or -1
+        column_count: Number of option columns
+
+    Returns:
+        bool array (subjects x columns) of the columns each subject is offered in
+    """
+    slots = np.asarray(slots)
+    arrangement = np.zeros((matrix.shape[1], column_count), dtype=bool)
+    for column in range(column_count):
+        arrangement[:, column] = (slots == column).any(axis=0)
+    arrangement[~arrangement.any(axis=1), 0] = True
+    return arrangement
+
+
+def column_count_for(slots):
+    """Number of option columns used in the data (at least one)"""
+    return int(slots.max()) + 1 if slots.size and slots.max() >= 0 else 1
+
+
+def columns_from_letters(letters, column_count):
+    """
+    Parse the columns of a proposed placement
+
+    Args:
+        letters: Column letters as a string ("A", "AC", "A, C") or a list
+        column_count: Number of option columns
+
+    Returns:
+        bool array (columns,)
+
+    Raises:
+        ValueError: If no columns or an unknown column is given
+    """
+    if isinstance(letters, str):
+        letters = [letter for letter in letters if letter not in ', ']
+    offered = np.zeros(column_count, dtype=bool)
+    for letter in letters:
+        letter = str(letter).strip().upper()
+        if letter not in COLUMN_LETTERS[:column_count]:
+            raise ValueError(f'Unknown option column: {letter}')
+        offered[COLUMN_LETTERS.index(letter)] = True
+    if not offered.any():
+        raise ValueError('No option columns given')
+    return offered
+
+
+def column_letters(offered):
+    """Comma-separated letters of the columns in a bool array (columns,)"""
+    return ', '.join(COLUMN_LETTERS[column] for column in np.flatnonzero(offered))
+
+
+class ClashScorer:
+    """
+    Scores arrangements against a fixed set of pupil choices
+
+    Pupils with identical subject sets are collapsed into one weighted row.
+    For every set of columns, the number of each row's subjects offered
+    only within it is one matrix product; a row clashes when any count
+    exceeds the size of its set. Scoring an arrangement takes well under
+    a millisecond.
+    """
+
+    def __init__(self, rows, weights, column_count):
+        self.rows = np.asarray(rows, dtype=np.float32)
+        self.weights = np.asarray(weights, dtype=np.int64)
+        self.column_count = column_count
+        column_sets = np.arange(2 ** column_count)
+        self._column_sets = column_sets
+        self._set_sizes = np.array([bin(columns).count('1') for columns in column_sets],
+                                   dtype=np.float32)
+        self._bits = 1 << np.arange(column_count)
+
+    @classmethod
+    def from_matrix(cls, matrix, column_count):
+        """Build a scorer from a students x subjects 0/1 matrix"""
+        matrix = np.asarray(matrix, dtype=np.uint8)
+        # Every subject is offered somewhere, so only pupils with 2+ subjects can clash
+        matrix = matrix[matrix.sum(axis=1) > 1]
+        if len(matrix):
+            rows, weights = np.unique(matrix, axis=0, return_counts=True)
+        else:
+            rows, weights = matrix, np.zeros(0, dtype=np.int64)
+        return cls(rows, weights, column_count)
+
+    def within_counts(self, arrangement):
+        """Per-pupil-group number of subjects offered only within each column set (groups x sets)"""
+        masks = np.asarray(arrangement, dtype=bool) @ self._bits
+        within = (masks[:, None] & ~self._column_sets[None, :]) == 0
+        return self.rows @ within.astype(np.float32)
+
+    def clashing_groups(self, arrangement):
+        """Boolean mask of pupil groups left with a clash"""
+        return (self.within_counts(arrangement) > self._set_sizes).any(axis=1)
+
+    def score(self, arrangement):
+        """Number of pupils left with at least one clash"""
+        return int(self.weights[self.clashing_groups(arrangement)].sum())
+
+
+def _neighbour(current, rng):
+    """
+    A copy of ``current`` with one class moved, or two classes swapped, between columns
+
+    Moves keep the number of classes of each subject; swaps also keep the
+    number of classes in each column.
+    """
+    candidate = current.copy()
+    subject_count, column_count = current.shape
+    if subject_count > 1 and rng.random() < 0.5:
+        a, b = rng.choice(subject_count, size=2, replace=False)
+        only_a = np.flatnonzero(current[a] & ~current[b])
+        only_b = np.flatnonzero(current[b] & ~current[a])
+        if len(only_a) and len(only_b):
+            x, y = rng.choice(only_a), rng.choice(only_b)
+            candidate[a, x], candidate[a, y] = False, True
+            candidate[b, y], candidate[b, x] = False, True
+            return candidate
+
+    subject = rng.integers(subject_count)
+    offered = np.flatnonzero(current[subject])
+    free = np.flatnonzero(~current[subject])
+    if len(free):
+        candidate[subject, rng.choice(offered)] = False
+        candidate[subject, rng.choice(free)] = True
+    return candidate
+
+
+def _local_search(rows, weights, column_count, start, iterations, seed, time_limit=None):
+    """
+    Hill-climb from ``start`` by moving or swapping classes between columns
+
+    Sideways moves (equal score) are accepted so the search can cross
+    plateaus. Stops after ``iterations`` candidates or ``time_limit``
+    seconds. Module level so it can run in worker processes.
+    """
+    scorer = ClashScorer(rows, weights, column_count)
+    rng = np.random.default_rng(seed)
+    current = np.array(start, dtype=bool)
+    current_score = scorer.score(current)
+    best, best_score = current.copy(), current_score
+    if len(current) == 0 or column_count < 2:
+        return best, best_score, 0
+
+    deadline = time.perf_counter() + time_limit if time_limit else None
+    evaluated = 0
+    while evaluated < iterations and best_score > 0:
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        evaluated += 1
+        candidate = _neighbour(current, rng)
+        candidate_score = scorer.score(candidate)
+        if candidate_score <= current_score:
+            current, current_score = candidate, candidate_score
+            if current_score < best_score:
+                best, best_score = current.copy(), current_score
+    return best, best_score, evaluated
+
+
+def optimize_arrangement(matrix, column_count, start, iterations=5000, searches=None,
+                         workers=None, seed=None, time_limit=None):
+    """
+    Search for an arrangement that leaves fewer pupils with clashes
+
+    Independent local searches (different random seeds, all starting from
+    ``start``) run in parallel worker processes; the best result wins.
+
+    Args:
+        matrix: students x subjects 0/1 array
+        column_count: Number of option columns
+        start: Starting arrangement (subjects x columns)
+        iterations: Candidate arrangements tried per search
+        searches: Number of independent searches (defaults to workers)
+        workers: Worker processes; 1 runs in-process
+        seed: Base random seed for reproducible results
+        time_limit: Optional seconds after which each search stops
+
+    Returns:
+        dict with 'arrangement', 'clashes', 'start_clashes', 'evaluated', 'seconds'
+    """
+    started = time.perf_counter()
+    scorer = ClashScorer.from_matrix(matrix, column_count)
+    start = np.asarray(start, dtype=bool)
+    workers = max(1, workers or os.cpu_count() or 1)
+    searches = max(1, searches or workers)
+    base_seed = seed if seed is not None else int(np.random.SeedSequence().entropy % (2 ** 32))
+    jobs = [(scorer.rows, scorer.weights, column_count, start, iterations, base_seed + i, time_limit)
+            for i in range(searches)]
+
+    if workers == 1 or searches == 1:
+        results = [_local_search(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, searches)) as executor:
+            results = list(executor.map(_local_search, *zip(*jobs)))
+
+    best, best_score, _ = min(results, key=lambda result: result[1])
+    return {
+        'arrangement': best,
+        'clashes': best_score,
+        'start_clashes': scorer.score(start),
+        'evaluated': sum(result[2] for result in results),
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def describe_arrangement(arrangement, subjects, column_count):
+    """Return {column letter: [subjects offered in it]} for display"""
+    return {COLUMN_LETTERS[column]: [subject for subject, offered in zip(subjects, arrangement)
+                                     if offered[column]]
+            for column in range(column_count)}
+
+
+def arrangement_moves(start, arrangement, subjects):
+    """The subjects whose columns differ between two arrangements, with both column lists"""
+    return [{'subject': subject, 'from': column_letters(start[i]), 'to': column_letters(arrangement[i])}
+            for i, subject in enumerate(subjects) if (start[i] != arrangement[i]).any()]
@@ -0,0 +1,181 @@
+"""
+Parsing uploaded data files in isolated, resource-limited processes
+
+openpyxl can spend minutes and gigabytes on malformed or bloated workbooks
+(e.g. formatting applied to a million empty rows). Web requests therefore
+parse each file in a short-lived child process with CPU-time and
+address-space rlimits and a wall-clock timeout, so a pathological file
+fails with a ParseLimitError instead of stalling or killing a web worker.
+At most ``workers`` files are parsed at once.
+
+Children are forked from a forkserver that has pandas and openpyxl
+preloaded, so starting one is cheap; where there is no forkserver they are
+spawned. Only the public ``multiprocessing`` API is used, so as with any
+spawned process each child imports the entry script: code in it that is
+not guarded by ``if __name__ == '__main__':`` runs again in the child
+(``create_app()`` under ``python app.py``; the ``flask`` and gunicorn
+entry points are guarded). Each child
+sets its CPU-time and address-space rlimits before it parses. rlimits need
+the POSIX ``resource`` module; where it is missing (Windows) only the
+timeout applies.
+"""
+import multiprocessing
+import os
+import signal
+import threading
+from .data_processor import read_subject_choices_file
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_slots = None
+_slots_lock = threading.Lock()
+
+
+class ParseLimitError(ValueError):
+    """Raised when parsing a file exceeds its time or memory limits"""
+
+
+def _context():
+    """Start processes from a preloaded forkserver where available, otherwise spawn them"""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    # Not '__main__': the forkserver would import the entry script, which
+    # may run create_app() at import time
+    context.set_forkserver_preload(['pandas', 'openpyxl', __name__])
+    return context
+
+
+def _address_space():
+    """Current virtual memory size of this process in bytes, if known"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmSize:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _apply_limits(cpu_seconds, memory_bytes):
+    """Limit this process's CPU time and its address space growth"""
+    if resource is None:
+        return
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = int(usage.ru_utime + usage.ru_stime + cpu_seconds) + 1
+        # SIGXCPU at the soft limit, SIGKILL a second later if it is ignored
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 1))
+    if memory_bytes:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = _address_space() + memory_bytes
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _parse_job(connection, filepath, year_group, max_decompressed_length, cpu_seconds, memory_bytes):
+    """Child process: limit itself, parse one file and send back the frame or the error"""
+    try:
+        # Before anything is parsed, so the limits cover all of it
+        _apply_limits(cpu_seconds, memory_bytes)
+        result = ('ok', read_subject_choices_file(filepath, year_group, max_decompressed_length))
+    except MemoryError:
+        result = ('memory', None)
+    except Exception as e:
+        result = ('error', e)
+    try:
+        connection.send(result)
+    except MemoryError:
+        connection.send(('memory', None))
+    except Exception as e:
+        # The exception itself could not be pickled
+        connection.send(('error', ValueError(str(e))))
+    finally:
+        connection.close()
+
+
+def _job_slot(workers, timeout):
+    """Wait up to ``timeout`` seconds for one of the ``workers`` parse slots"""
+    global _slots
+    with _slots_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(workers)
+    if not _slots.acquire(timeout=timeout):
+        raise ParseLimitError('The server is busy parsing other files; please try again shortly')
+    return _slots
+
+
+def _crash_error(exitcode, cpu_seconds, memory_mb):
+    """Describe why a parse process died without sending a result"""
+    if exitcode == -getattr(signal, 'SIGXCPU', 0) or exitcode == -getattr(signal, 'SIGKILL', 0):
+        return ParseLimitError(f'Parsing stopped: the file needs more than {cpu_seconds:g}s of CPU '
+                               f'time or {memory_mb:g}MB of memory')
+    return ParseLimitError(f'Parsing failed unexpectedly (exit code {exitcode})')
+
+
+def parse_isolated(filepath, year_group, max_decompressed_length, timeout=60,
+                   cpu_seconds=30, memory_mb=1024, workers=2):
+    """
+    Parse a data file in a child process under resource limits
+
+    Args:
+        filepath, year_group, max_decompressed_length: As for
+            ``read_subject_choices_file``
+        timeout: Wall-clock seconds to wait for the result (and for a free slot)
+        cpu_seconds: CPU-time limit of the child
+        memory_mb: Address space the child may grow by
+        workers: Maximum number of files parsed at once by this process
+
+    Returns:
+        pandas.DataFrame: The standardized frame
+
+    Raises:
+        ParseLimitError: If a limit is exceeded or the child dies
+        Exception: Errors raised by the parser itself (e.g. ValueError)
+    """
+    slots = _job_slot(workers, timeout)
+    try:
+        context = _context()
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_parse_job, name='upload-parse', daemon=True,
+            args=(sender, os.path.abspath(filepath), year_group, max_decompressed_length,
+                  cpu_seconds, int(memory_mb * 1024 * 1024)))
+        process.start()
+        sender.close()
+        try:
+            if not receiver.poll(timeout):
+                raise ParseLimitError(f'Parsing took longer than {timeout:g} seconds')
+            status, value = receiver.recv()
+        except EOFError:
+            process.join(5)
+            raise _crash_error(process.exitcode, cpu_seconds, memory_mb) from None
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+    finally:
+        slots.release()
+
+    if status == 'memory':
+        raise ParseLimitError(f'Parsing stopped: the file needs more than {memory_mb:g}MB of memory')
+    if status == 'error':
+        raise value
+    return value
+
+
+def parse_upload(filepath, year_group, config):
+    """Parse an upload with the app's isolation settings (``PARSE_*`` config)"""
+    if not config['PARSE_ISOLATED']:
+        return read_subject_choices_file(filepath, year_group, config['MAX_DECOMPRESSED_LENGTH'])
+    return parse_isolated(filepath, year_group, config['MAX_DECOMPRESSED_LENGTH'],
+                          timeout=config['PARSE_TIMEOUT'],
+                          cpu_seconds=config['PARSE_CPU_SECONDS'],
+                          memory_mb=config['PARSE_MEMORY_MB'],
+                          workers=config['PARSE_WORKERS'])
@@ -0,0 +1,209 @@
+"""
+Deferred deletion of uploads
+
+Deleting an upload only marks it (``DataUpload.deleted_at``) so the request
+returns immediately and the upload disappears from every view. The rows are
+removed later in bounded batches, each in its own short transaction, so a
+large upload never holds the SQLite write lock for long. Purging runs in a
+background thread of the web process, started with the app so uploads
+deleted before a restart are purged too, and via ``flask purge-uploads``.
+"""
+import multiprocessing
+import os
+import shutil
+import threading
+from datetime import datetime
+from sqlalchemy import delete, or_, select, text
+from app import db
+from app.models import CohortLink, DataUpload, StudentChoice, SubjectChoice, SubjectCoincidence
+from .user_stats import adjust_user_stats, adjust_year_group_stats, upload_subject_totals
+
+# Tables holding per-upload rows, purged in this order before the upload row
+PURGED_MODELS = [CohortLink, StudentChoice, SubjectCoincidence, SubjectChoice]
+
+_worker_lock = threading.Lock()
+
+
+def mark_upload_deleted(upload):
+    """
+    Mark an upload as deleted and remove it from the owner's dashboard stats.
+
+    Does not commit; the caller owns the transaction.
+    """
+    subject_count, total_choices = upload_subject_totals(upload.id)
+    upload.deleted_at = datetime.utcnow()
+    upload.bump_data_version()
+    adjust_year_group_stats(upload.user_id, upload.year_group,
+                            subjects=-subject_count, choices=-total_choices)
+    adjust_user_stats(upload.user_id, uploads=-1, processed=-1 if upload.processed else 0)
+
+
+def _upload_rows(model, upload_id):
+    """Condition selecting the rows of ``model`` that belong to an upload"""
+    if model is CohortLink:
+        return or_(CohortLink.from_upload_id == upload_id, CohortLink.to_upload_id == upload_id)
+    return model.upload_id == upload_id
+
+
+def _delete_in_batches(model, upload_id, batch_size):
+    """Delete an upload's rows from one table, committing after each batch"""
+    deleted = 0
+    while True:
+        batch = select(model.id).where(_upload_rows(model, upload_id)).limit(batch_size)
+        result = db.session.execute(
+            delete(model).where(model.id.in_(batch.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+def purge_upload(upload_id, upload_folder, batch_size=1000, matrix_folder=None):
+    """
+    Remove a deleted upload's rows, stored file, choice matrix and record.
+
+    Safe to repeat: an interrupted purge resumes where it stopped.
+
+    Returns:
+        int: Number of dependent rows deleted
+    """
+    filename = db.session.execute(
+        select(DataUpload.filename).where(DataUpload.id == upload_id)
+    ).scalar()
+
+    deleted = sum(_delete_in_batches(model, upload_id, batch_size) for model in PURGED_MODELS)
+
+    if filename:
+        try:
+            os.remove(os.path.join(upload_folder, filename))
+        except FileNotFoundError:
+            pass
+    if matrix_folder:
+        from .choice_matrix import artifact_dir
+        shutil.rmtree(artifact_dir(matrix_folder, upload_id), ignore_errors=True)
+
+    db.session.execute(
+        delete(DataUpload).where(DataUpload.id == upload_id, DataUpload.deleted_at.is_not(None))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return deleted
+
+
+def purge_deleted_uploads(upload_folder, batch_size=1000, matrix_folder=None):
+    """
+    Purge every upload marked as deleted
+
+    Returns:
+        dict: {'uploads': purged uploads, 'rows': dependent rows deleted}
+    """
+    upload_ids = db.session.execute(
+        select(DataUpload.id).where(DataUpload.deleted_at.is_not(None))
+        .order_by(DataUpload.deleted_at)
+    ).scalars().all()
+    db.session.commit()
+
+    rows = 0
+    for upload_id in upload_ids:
+        rows += purge_upload(upload_id, upload_folder, batch_size, matrix_folder)
+    return {'uploads': len(upload_ids), 'rows': rows}
+
+
+def reclaim_space(min_free_fraction=0.25, incremental_pages=1000):
+    """
+    Return freed SQLite pages to the filesystem.
+
+    Databases created with ``auto_vacuum=INCREMENTAL`` release up to
+    ``incremental_pages`` pages per call. Otherwise a full VACUUM runs once
+    free pages make up ``min_free_fraction`` of the file, which also switches
+    the database to incremental mode for next time.
+
+    Returns:
+        str or None: 'incremental', 'vacuum', or None if nothing was done
+    """
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return None
+
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+        free_pages = connection.execute(text('PRAGMA freelist_count')).scalar()
+        if not free_pages:
+            return None
+
+        if connection.execute(text('PRAGMA auto_vacuum')).scalar() == 2:
+            # executescript steps the pragma to completion; a plain execute
+            # would free a single page
+            connection.connection.driver_connection.executescript(
+                f'PRAGMA incremental_vacuum({int(incremental_pages)});')
+            return 'incremental'
+
+        page_count = connection.execute(text('PRAGMA page_count')).scalar()
+        if free_pages < page_count * min_free_fraction:
+            return None
+        connection.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+        connection.execute(text('VACUUM'))
+        return 'vacuum'
+
+
+def run_purge(app):
+    """Purge deleted uploads and reclaim space in a fresh app context"""
+    with app.app_context():
+        result = purge_deleted_uploads(app.config['UPLOAD_FOLDER'],
+                                       app.config['PURGE_BATCH_SIZE'],
+                                       app.config['MATRIX_FOLDER'])
+        result['vacuum'] = reclaim_space(app.config['PURGE_VACUUM_FREE_FRACTION']) \
+            if result['uploads'] else None
+        db.session.remove()
+        return result
+
+
+class PurgeWorker:
+    """Background thread purging deleted uploads when woken or every ``interval`` seconds"""
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='upload-purge', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                result = run_purge(self.app)
+                if result['uploads']:
+                    self.app.logger.info(
+                        f"Purged {result['uploads']} deleted uploads ({result['rows']} rows)")
+            except Exception as e:
+                self.app.logger.error(f'Error purging deleted uploads: {str(e)}')
+
+
+def request_purge(app):
+    """Wake the app's purge worker, starting it on first use"""
+    if not app.config['PURGE_IN_BACKGROUND']:
+        return
+    with _worker_lock:
+        worker = app.extensions.get('upload_purge')
+        if worker is None:
+            worker = app.extensions['upload_purge'] = PurgeWorker(app, app.config['PURGE_INTERVAL'])
+    worker.wake()
+
+
+def start_purge_worker(app):
+    """
+    Start the app's purge worker at startup; its first pass purges uploads
+    deleted before the process started
+
+    Not in child processes (e.g. parse workers importing the entry script).
+    """
+    if multiprocessing.parent_process() is not None:
+        return
+    request_purge(app)
@@ -0,0 +1,119 @@
+"""
+Bulk re-normalization of processed uploads after subject mapping changes
+
+Each choice is re-derived from the value read from the file (its raw_choice_*
+column), so renaming a mapping's friendly name reaches choices stored under
+the old name. Rows imported before raw values were kept fall back to their
+stored value.
+"""
+from sqlalchemy import case, func, or_, select, union, update
+from app import db
+from app.models import StudentChoice, CHOICE_COLUMNS
+from .subject_mappings import normalize_subject_name
+from .totals import recompute_subject_totals
+from .coincidence import store_coincidence
+from .statistics import refresh_statistics
+
+
+def _source(column_name):
+    """The value a choice column is normalized from: the raw value, else the stored one"""
+    return func.coalesce(getattr(StudentChoice, f'raw_{column_name}'), getattr(StudentChoice, column_name))
+
+
+def distinct_choice_values(upload_ids):
+    """Return the distinct (source value, stored value) pairs of the given uploads' choices"""
+    upload_ids = list(upload_ids)
+    selects = [
+        select(_source(column_name).label('source'), getattr(StudentChoice, column_name).label('subject'))
+        .where(StudentChoice.upload_id.in_(upload_ids),
+               getattr(StudentChoice, column_name).is_not(None))
+        for column_name in CHOICE_COLUMNS
+    ]
+    return {(source, stored) for source, stored in db.session.execute(union(*selects))
+            if source and source.strip()}
+
+
+def build_renormalization_map(upload_ids, year_group):
+    """
+    Work out which choices change under the current mappings.
+
+    Normalization runs once per distinct source value rather than once per cell.
+
+    Returns:
+        dict: {source value: normalized value} for source values stored
+        under a different name than they now normalize to
+    """
+    normalized = {}
+    remap = {}
+    for source, stored in distinct_choice_values(upload_ids):
+        if source not in normalized:
+            normalized[source] = normalize_subject_name(source, year_group)
+        if normalized[source] and normalized[source] != stored:
+            remap[source] = normalized[source]
+    return remap
+
+
+def _rewrite_choice_columns(upload_ids, remap):
+    """Apply a source value remap to every choice column; returns cells rewritten"""
+    rewritten = 0
+    for column_name in CHOICE_COLUMNS:
+        column = getattr(StudentChoice, column_name)
+        source = _source(column_name)
+        normalized = case(remap, value=source)
+        result = db.session.execute(
+            update(StudentChoice)
+            .where(StudentChoice.upload_id.in_(upload_ids),
+                   source.in_(list(remap)),
+                   or_(column.is_(None), column != normalized))
+            # Row hashes are recomputed from the new values when next needed
+            .values({column_name: normalized, 'row_hash': None})
+            .execution_options(synchronize_session=False)
+        )
+        rewritten += result.rowcount or 0
+    return rewritten
+
+
+def renormalize_uploads(uploads):
+    """
+    Rewrite stored choices of processed uploads through the current mappings.
+
+    Each choice column is rewritten with one UPDATE ... CASE statement per
+    year group, then the subject totals, pair counts and statistics profile
+    of every affected upload are recomputed once. Commits on success.
+
+    Args:
+        uploads: List of processed DataUpload objects
+
+    Returns:
+        dict: {'uploads': n, 'values': distinct values remapped, 'cells': cells rewritten}
+    """
+    by_year_group = {}
+    for upload in uploads:
+        by_year_group.setdefault(upload.year_group, []).append(upload)
+
+    remapped_values = 0
+    rewritten_cells = 0
+    try:
+        for year_group, group_uploads in by_year_group.items():
+            upload_ids = [upload.id for upload in group_uploads]
+            remap = build_renormalization_map(upload_ids, year_group)
+            remapped_values += len(remap)
+            if remap:
+                rewritten_cells += _rewrite_choice_columns(upload_ids, remap)
+
+            for upload in group_uploads:
+                recompute_subject_totals(upload)
+                store_coincidence(upload.id)
+                refresh_statistics(upload)
+                upload.bump_data_version()
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        'uploads': len(uploads),
+        'values': remapped_values,
+        'cells': rewritten_cells,
+    }
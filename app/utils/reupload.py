@@ -0,0 +1,189 @@
+"""
+Updating a processed upload from a new export of the same data
+
+Schools re-export a year group several times while options are being
+chosen, each time with a few changed choices. Instead of importing the new
+file as another upload, its normalized rows are hashed and diffed against
+the stored rows: students are paired by name key, unchanged rows are left
+alone, changed rows are updated in place (keeping their inclusion flag and
+cohort links), and only new and missing students are inserted and deleted.
+New students invalidate the upload's cohort links, which are rebuilt the
+next time the pair is linked.
+Subject totals, pair counts and dashboard stats are adjusted by the
+difference instead of being recomputed.
+"""
+from collections import Counter, defaultdict
+from sqlalchemy import delete, insert, or_, select, update
+from app import db
+from app.models import CohortLink, StudentChoice, SubjectChoice, CHOICE_COLUMNS, RAW_CHOICE_COLUMNS
+from .coincidence import adjust_coincidence
+from .data_processor import normalize_choice_categories
+from .ingest import student_row_hash, student_rows
+from .statistics import refresh_statistics
+from .user_stats import adjust_year_group_stats
+
+# Columns written from the new file when a student's row changed
+ROW_COLUMNS = ['forename', 'surname', 'reg_class'] + CHOICE_COLUMNS
+
+
+def _stored_rows(upload_id):
+    """Read the stored students of an upload as dicts with id, inclusion and row hash"""
+    columns = [StudentChoice.id, StudentChoice.included_in_analysis, StudentChoice.row_hash] + \
+        [getattr(StudentChoice, name) for name in ROW_COLUMNS]
+    rows = []
+    for values in db.session.execute(select(*columns).where(StudentChoice.upload_id == upload_id)):
+        row = dict(zip(['id', 'included_in_analysis', 'row_hash'] + ROW_COLUMNS, values))
+        # Rows imported before hashes were stored
+        row['row_hash'] = row['row_hash'] or student_row_hash(row)
+        rows.append(row)
+    return rows
+
+
+def diff_rows(stored, incoming):
+    """
+    Pair stored and incoming student rows by name key and classify them
+
+    Within a name key, rows with identical hashes are paired first and the
+    rest in file order, so duplicated names are handled without guessing.
+
+    Args:
+        stored: Stored rows (dicts with 'id' and 'row_hash')
+        incoming: New rows (dicts with 'row_hash')
+
+    Returns:
+        dict: 'unchanged' (count), 'updated' [(stored, incoming)],
+        'inserted' [incoming] and 'deleted' [stored]
+    """
+    from .cohort import name_key
+
+    by_key = defaultdict(lambda: ([], []))
+    for row in stored:
+        by_key[name_key(row['forename'], row['surname'])][0].append(row)
+    for row in incoming:
+        by_key[name_key(row['forename'], row['surname'])][1].append(row)
+
+    diff = {'unchanged': 0, 'updated': [], 'inserted': [], 'deleted': []}
+    for old_rows, new_rows in by_key.values():
+        new_hashes = Counter(row['row_hash'] for row in new_rows)
+        kept = Counter()
+        leftover_old = []
+        for row in old_rows:
+            if new_hashes[row['row_hash']] > kept[row['row_hash']]:
+                kept[row['row_hash']] += 1
+            else:
+                leftover_old.append(row)
+        leftover_new = []
+        for row in new_rows:
+            if kept[row['row_hash']]:
+                kept[row['row_hash']] -= 1
+                diff['unchanged'] += 1
+            else:
+                leftover_new.append(row)
+
+        diff['updated'].extend(zip(leftover_old, leftover_new))
+        diff['inserted'].extend(leftover_new[len(leftover_old):])
+        diff['deleted'].extend(leftover_old[len(leftover_new):])
+    return diff
+
+
+def _choices(row):
+    """The non-empty choices of a row, as StudentChoice.get_choices returns them"""
+    return [row[name].strip() for name in CHOICE_COLUMNS if row[name] and row[name].strip()]
+
+
+def _adjust_subject_totals(upload, delta, academic_year):
+    """Apply per-subject count changes to an upload's SubjectChoice rows and the owner's stats"""
+    delta = {subject: change for subject, change in delta.items() if change}
+    if not delta:
+        return
+    totals = {row.subject_name: row for row in
+              SubjectChoice.query.filter(SubjectChoice.upload_id == upload.id,
+                                         SubjectChoice.subject_name.in_(list(delta)))}
+    subjects = 0
+    for subject, change in delta.items():
+        row = totals.get(subject)
+        if row is None:
+            db.session.add(SubjectChoice(year_group=upload.year_group, subject_name=subject,
+                                         choice_count=change, academic_year=academic_year,
+                                         upload_id=upload.id))
+            subjects += 1
+        elif row.choice_count + change <= 0:
+            db.session.delete(row)
+            subjects -= 1
+        else:
+            row.choice_count += change
+    adjust_year_group_stats(upload.user_id, upload.year_group,
+                            subjects=subjects, choices=sum(delta.values()))
+
+
+def update_upload(upload, df):
+    """
+    Apply a new export of a processed upload's data as a row-level diff.
+
+    Applies the existing subject mappings, then inserts, updates and
+    deletes only the student rows that differ. Does not commit; the caller
+    owns the transaction.
+
+    Args:
+        upload: The processed DataUpload to update
+        df: Standardized frame of the new file
+
+    Returns:
+        dict: Counts of 'inserted', 'updated', 'deleted' and 'unchanged' students
+    """
+    normalized = normalize_choice_categories(df, upload.year_group)
+    incoming = [dict(row, row_hash=student_row_hash(row)) for row in student_rows(df, normalized)]
+
+    diff = diff_rows(_stored_rows(upload.id), incoming)
+    academic_year = upload.academic_year
+    subject_delta = Counter()
+
+    # Changed students keep their id and inclusion flag
+    if diff['updated']:
+        db.session.execute(update(StudentChoice), [
+            dict({name: new[name] for name in ROW_COLUMNS + RAW_CHOICE_COLUMNS},
+                 id=old['id'], row_hash=new['row_hash'])
+            for old, new in diff['updated']
+        ])
+    for old, new in diff['updated']:
+        if old['included_in_analysis'] and _choices(old) != _choices(new):
+            subject_delta.subtract(_choices(old))
+            subject_delta.update(_choices(new))
+            adjust_coincidence(upload.id, _choices(old), -1)
+            adjust_coincidence(upload.id, _choices(new), 1)
+
+    if diff['deleted']:
+        deleted_ids = [row['id'] for row in diff['deleted']]
+        db.session.execute(delete(CohortLink).where(or_(CohortLink.from_student_id.in_(deleted_ids),
+                                                        CohortLink.to_student_id.in_(deleted_ids))))
+        db.session.execute(delete(StudentChoice).where(StudentChoice.id.in_(deleted_ids)))
+        for row in diff['deleted']:
+            if row['included_in_analysis']:
+                subject_delta.subtract(_choices(row))
+                adjust_coincidence(upload.id, _choices(row), -1)
+
+    if diff['inserted']:
+        # Stored links would leave the new students unmatched; drop them so the pairs are relinked
+        db.session.execute(delete(CohortLink).where(or_(CohortLink.from_upload_id == upload.id,
+                                                        CohortLink.to_upload_id == upload.id)))
+        db.session.execute(insert(StudentChoice), [
+            dict(row, upload_id=upload.id, year_group=upload.year_group,
+                 academic_year=academic_year, included_in_analysis=True)
+            for row in diff['inserted']
+        ])
+        for row in diff['inserted']:
+            subject_delta.update(_choices(row))
+            adjust_coincidence(upload.id, _choices(row), 1)
+
+    counts = {
+        'inserted': len(diff['inserted']),
+        'updated': len(diff['updated']),
+        'deleted': len(diff['deleted']),
+        'unchanged': diff['unchanged'],
+    }
+    if counts['inserted'] or counts['updated'] or counts['deleted']:
+        _adjust_subject_totals(upload, subject_delta, academic_year)
+        refresh_statistics(upload)
+        upload.record_count = len(incoming)
+        upload.bump_data_version()
+    return counts
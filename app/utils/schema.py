@@ -0,0 +1,113 @@
+"""
+Bringing an existing database up to the current models
+
+``db.create_all()`` only creates missing tables, so columns and indexes
+added to existing tables would make an older database fail with "no such
+column". ``upgrade_schema`` also adds those (``ALTER TABLE ... ADD COLUMN``
+and ``CREATE INDEX IF NOT EXISTS``, both supported by SQLite) and fills in
+the data that newly added tables and columns need, and re-detects academic
+years the file-name parser could not read before. Running it again
+changes nothing. Values that are rebuilt on first use anyway (dashboard
+counters, statistics profiles, row hashes) are left to that.
+"""
+from sqlalchemy import inspect, literal
+from app import db
+from app.models import DataUpload
+
+
+def _column_ddl(column, dialect):
+    """``<name> <type> [DEFAULT ...] [NOT NULL]`` for adding a model column"""
+    ddl = f'{dialect.identifier_preparer.format_column(column)} {column.type.compile(dialect=dialect)}'
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        ddl += ' DEFAULT ' + str(literal(default, column.type).compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if not column.nullable:
+        if default is None:
+            raise RuntimeError(f'Cannot add NOT NULL column {column.table.name}.{column.name} '
+                               f'without a scalar default')
+        ddl += ' NOT NULL'
+    return ddl
+
+
+def _backfill(created_tables, added_columns):
+    """Fill in data for tables and columns that were just added (caller commits)"""
+    from .coincidence import store_coincidence
+
+    if 'subject_coincidence' in created_tables:
+        for (upload_id,) in db.session.query(DataUpload.id).filter(DataUpload.processed.is_(True),
+                                                                   DataUpload.deleted_at.is_(None)):
+            store_coincidence(upload_id)
+
+
+def _backfill_academic_years():
+    """
+    Re-detect academic years that are unknown, or stored in an older form
+    (e.g. "2024-20" from "2024-2025"), from upload file names (caller commits)
+
+    Returns:
+        int: Number of uploads changed
+    """
+    from .data_processor import extract_academic_year_from_filename
+
+    changed = 0
+    for upload in DataUpload.query.filter(DataUpload.deleted_at.is_(None)):
+        stored = upload.academic_year
+        if stored is not None and extract_academic_year_from_filename(stored) == stored:
+            continue
+        academic_year = extract_academic_year_from_filename(upload.original_filename)
+        if academic_year is not None and academic_year != stored:
+            upload.set_academic_year(academic_year)
+            changed += 1
+    return changed
+
+
+def upgrade_schema():
+    """
+    Create missing tables, columns and indexes, then backfill new data and
+    academic years. Commits.
+
+    Returns:
+        dict: Names of the 'tables', 'columns' (table.column) and 'indexes'
+        created, and the number of uploads given an 'academic_years' value
+    """
+    metadata = db.metadata
+    with db.engine.begin() as connection:
+        dialect = connection.dialect
+        existing_tables = set(inspect(connection).get_table_names())
+        created_tables = [table.name for table in metadata.sorted_tables
+                          if table.name not in existing_tables]
+        metadata.create_all(connection)
+
+        added_columns = []
+        inspector = inspect(connection)
+        for table in metadata.sorted_tables:
+            if table.name in created_tables:
+                continue
+            present = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in present:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {dialect.identifier_preparer.format_table(table)} '
+                        f'ADD COLUMN {_column_ddl(column, dialect)}')
+                    added_columns.append(f'{table.name}.{column.name}')
+
+        created_indexes = []
+        inspector = inspect(connection)
+        for table in metadata.sorted_tables:
+            if table.name in created_tables:
+                continue
+            present = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in present:
+                    index.create(connection, checkfirst=True)
+                    created_indexes.append(index.name)
+
+    if created_tables or added_columns:
+        _backfill(created_tables, added_columns)
+    academic_years = _backfill_academic_years()
+    if academic_years or created_tables or added_columns:
+        db.session.commit()
+
+    return {'tables': created_tables, 'columns': added_columns, 'indexes': created_indexes,
+            'academic_years': academic_years}
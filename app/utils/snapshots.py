@@ -0,0 +1,308 @@
+"""
+Precomputed analytics snapshots for read-only views
+
+The complete analytics of each user, year group and academic year (per
+upload totals and percentages, the comparison table and the pair counts)
+are written as gzip-compressed JSON to
+``<SNAPSHOT_FOLDER>/<user id>/<year group>/<academic year>.json.gz``
+whenever processing, toggling, re-normalizing or deleting changes them.
+Year summaries are then read from those files without touching the
+database. Each snapshot records the ``data_version`` of its uploads; a
+year group whose snapshots do not match its current uploads and versions
+(e.g. after a failed write), lacks its ``.complete`` marker or was written
+in an older format is rebuilt from the database on first read.
+"""
+import glob
+import gzip
+import json
+import os
+import re
+import tempfile
+from datetime import datetime
+from sqlalchemy import func, select
+from app import db
+from app.models import DataUpload, StudentChoice, SubjectChoice
+from .coincidence import load_coincidence
+
+# Bump when the snapshot layout changes; older files are rebuilt on read
+SNAPSHOT_VERSION = 2
+
+# Written once every academic year of a year group has a snapshot
+COMPLETE_MARKER = '.complete'
+
+UNKNOWN_YEAR = 'unknown'
+
+
+def upload_snapshot_year(upload):
+    """Academic year an upload is filed under (None if it is not known)"""
+    return upload.academic_year
+
+
+def snapshot_dir(root, user_id, year_group):
+    """Directory holding a user's snapshots for one year group"""
+    return os.path.join(root, str(user_id), re.sub(r'[^0-9A-Za-z-]', '_', year_group))
+
+
+def snapshot_path(root, user_id, year_group, academic_year):
+    """Path of the snapshot for one user, year group and academic year"""
+    name = re.sub(r'[^0-9A-Za-z-]', '_', academic_year or UNKNOWN_YEAR)
+    return os.path.join(snapshot_dir(root, user_id, year_group), f'{name}.json.gz')
+
+
+def compare_uploads(upload_data):
+    """
+    Build the subject comparison table for a list of uploads
+
+    Args:
+        upload_data: Upload summaries, most recent first, each with a
+            'subjects' list of {'name', 'count', 'percentage'}
+
+    Returns:
+        list: {'subject', 'uploads': [{'count', 'percentage'}]} per subject,
+        sorted by name, with 'change' (% change from the previous upload to
+        the latest) when there are two or more uploads
+    """
+    by_upload = [{subject['name']: subject for subject in data['subjects']}
+                 for data in upload_data]
+    all_subjects = sorted({name for subjects in by_upload for name in subjects})
+
+    comparison_data = []
+    for subject_name in all_subjects:
+        row = {'subject': subject_name, 'uploads': []}
+        for subjects in by_upload:
+            subject_info = subjects.get(subject_name)
+            row['uploads'].append({
+                'count': subject_info['count'] if subject_info else 0,
+                'percentage': subject_info['percentage'] if subject_info else 0.0
+            })
+
+        if len(row['uploads']) >= 2:
+            latest = row['uploads'][0]['count']
+            previous = row['uploads'][1]['count']
+            if previous > 0:
+                row['change'] = round(((latest - previous) / previous) * 100, 1)
+            else:
+                row['change'] = 100.0 if latest > 0 else 0.0
+
+        comparison_data.append(row)
+    return comparison_data
+
+
+def _compact_coincidence(upload_id):
+    """Pair counts of an upload as a subject list and [i, j, count] cells (i <= j)"""
+    all_subjects, coincidence_matrix, _ = load_coincidence(upload_id)
+    pairs = []
+    for i, subject_a in enumerate(all_subjects):
+        row = coincidence_matrix[subject_a]
+        for j in range(i, len(all_subjects)):
+            count = row[all_subjects[j]]
+            if count:
+                pairs.append([i, j, count])
+    return {'subjects': all_subjects, 'pairs': pairs}
+
+
+def build_snapshot(uploads, user_id, year_group, academic_year):
+    """
+    Compute the snapshot of one academic year from the database
+
+    Args:
+        uploads: The processed, active DataUpload objects of that year,
+            most recent first
+
+    Returns:
+        dict: JSON-serializable snapshot
+    """
+    upload_ids = [upload.id for upload in uploads]
+    included = dict(db.session.execute(
+        select(StudentChoice.upload_id, func.count())
+        .where(StudentChoice.upload_id.in_(upload_ids),
+               StudentChoice.included_in_analysis.is_(True))
+        .group_by(StudentChoice.upload_id)
+    ).all()) if upload_ids else {}
+
+    subjects = {upload_id: [] for upload_id in upload_ids}
+    if upload_ids:
+        for upload_id, name, count in db.session.execute(
+                select(SubjectChoice.upload_id, SubjectChoice.subject_name,
+                       SubjectChoice.choice_count)
+                .where(SubjectChoice.upload_id.in_(upload_ids))
+                .order_by(SubjectChoice.choice_count.desc())):
+            subjects[upload_id].append((name, count))
+
+    upload_data = []
+    for upload in uploads:
+        total_included = included.get(upload.id, 0)
+        upload_data.append({
+            'id': upload.id,
+            'data_version': upload.data_version,
+            'filename': upload.original_filename,
+            'upload_date': upload.upload_date.isoformat(),
+            'academic_year': academic_year,
+            'total_students': upload.record_count,
+            'included_students': total_included,
+            'subjects': [
+                {'name': name, 'count': count,
+                 'percentage': round((count / total_included * 100) if total_included > 0 else 0, 1)}
+                for name, count in subjects[upload.id]
+            ],
+            'coincidence': _compact_coincidence(upload.id),
+        })
+
+    return {
+        'version': SNAPSHOT_VERSION,
+        'user_id': user_id,
+        'year_group': year_group,
+        'academic_year': academic_year,
+        'generated_at': datetime.utcnow().isoformat(),
+        'uploads': upload_data,
+        'comparison': compare_uploads(upload_data),
+    }
+
+
+def _active_uploads(user_id, year_group, **filters):
+    """Processed, non-deleted uploads of a year group, latest academic year and upload first"""
+    return DataUpload.query.filter_by(
+        user_id=user_id,
+        year_group=year_group,
+        processed=True,
+        deleted_at=None,
+        **filters
+    ).order_by(DataUpload.academic_year.desc(), DataUpload.upload_date.desc()).all()
+
+
+def _write_json_gz(path, data):
+    """Write JSON atomically so readers never see a partial file"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+            f.write(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def read_snapshot(path):
+    """Load a snapshot file, or None if it is missing, unreadable or outdated"""
+    try:
+        with gzip.open(path, 'rb') as f:
+            snapshot = json.loads(f.read())
+    except (OSError, EOFError, ValueError):
+        return None
+    return snapshot if snapshot.get('version') == SNAPSHOT_VERSION else None
+
+
+def write_snapshot(root, user_id, year_group, academic_year, uploads=None):
+    """
+    Rebuild and store the snapshot of one academic year
+
+    The file is removed when the year has no processed uploads left.
+
+    Returns:
+        dict or None: The snapshot written
+    """
+    if uploads is None:
+        uploads = _active_uploads(user_id, year_group, academic_year=academic_year)
+    path = snapshot_path(root, user_id, year_group, academic_year)
+    if not uploads:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return None
+    snapshot = build_snapshot(uploads, user_id, year_group, academic_year)
+    _write_json_gz(path, snapshot)
+    return snapshot
+
+
+def rebuild_year_group(root, user_id, year_group):
+    """
+    Rewrite every snapshot of a user's year group and mark it complete
+
+    Returns:
+        list: The snapshots written
+    """
+    directory = snapshot_dir(root, user_id, year_group)
+    for path in glob.glob(os.path.join(directory, '*.json.gz')):
+        os.remove(path)
+
+    by_year = {}
+    for upload in _active_uploads(user_id, year_group):
+        by_year.setdefault(upload_snapshot_year(upload), []).append(upload)
+    snapshots = [write_snapshot(root, user_id, year_group, academic_year, uploads)
+                 for academic_year, uploads in by_year.items()]
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, COMPLETE_MARKER), 'w'):
+        pass
+    return snapshots
+
+
+def refresh_snapshots(root, uploads):
+    """
+    Rewrite the snapshots covering the given uploads (after their changes are committed)
+
+    If a write fails the year group's ``.complete`` marker is removed before
+    the error is raised, so the next read rebuilds it.
+    """
+    keys = {(upload.user_id, upload.year_group, upload_snapshot_year(upload)) for upload in uploads}
+    for user_id, year_group, academic_year in keys:
+        try:
+            write_snapshot(root, user_id, year_group, academic_year)
+        except Exception:
+            try:
+                os.remove(os.path.join(snapshot_dir(root, user_id, year_group), COMPLETE_MARKER))
+            except FileNotFoundError:
+                pass
+            raise
+
+
+def _upload_versions(user_id, year_group):
+    """Sorted (id, data_version) pairs of a year group's processed, active uploads"""
+    return sorted(db.session.execute(
+        select(DataUpload.id, DataUpload.data_version)
+        .where(DataUpload.user_id == user_id, DataUpload.year_group == year_group,
+               DataUpload.processed.is_(True), DataUpload.deleted_at.is_(None))
+    ).all())
+
+
+def load_year_group_snapshots(root, user_id, year_group):
+    """
+    Read every academic year snapshot of a user's year group
+
+    Missing, outdated or unmatched snapshots (an upload added, removed or
+    changed since they were written) are rebuilt from the database first.
+    A year group without uploads is not written to disk.
+
+    Returns:
+        list: Snapshots (dicts as written by ``build_snapshot``)
+    """
+    versions = _upload_versions(user_id, year_group)
+    if not versions:
+        return []
+
+    directory = snapshot_dir(root, user_id, year_group)
+    if os.path.exists(os.path.join(directory, COMPLETE_MARKER)):
+        snapshots = [read_snapshot(path) for path in glob.glob(os.path.join(directory, '*.json.gz'))]
+        if None not in snapshots:
+            stored = sorted((data['id'], data['data_version'])
+                            for snapshot in snapshots for data in snapshot['uploads'])
+            if stored == [tuple(row) for row in versions]:
+                return snapshots
+    return rebuild_year_group(root, user_id, year_group)
+
+
+def year_summary_from_snapshots(snapshots):
+    """
+    Combine academic year snapshots into the year summary view data
+
+    Returns:
+        tuple: (upload_data by academic year then upload date, latest
+        first, comparison_data)
+    """
+    upload_data = [dict(data, upload_date=datetime.fromisoformat(data['upload_date']))
+                   for snapshot in snapshots for data in snapshot['uploads']]
+    upload_data.sort(key=lambda data: (data['academic_year'] or '', data['upload_date']), reverse=True)
+    return upload_data, compare_uploads(upload_data)
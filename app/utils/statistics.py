@@ -0,0 +1,132 @@
+"""
+Per-upload statistics profile
+
+The profile is computed with NumPy from an integer code matrix (pupils x
+option columns, subject position or -1 for an empty cell) when an upload
+is processed, stored on ``DataUpload.statistics`` and recomputed only when
+the included pupils or their subjects change. Views read the stored JSON.
+"""
+from sqlalchemy import select
+from app import db
+from app.models import StudentChoice, CHOICE_COLUMNS
+
+# Subjects listed as most and least popular
+TOP_K = 5
+
+OPTION_LETTERS = 'ABCDEFGH'
+
+
+def _top_k(counts, subjects, positions, k, descending=True):
+    """
+    The k subjects at ``positions`` with the highest (or lowest) counts
+
+    Only candidates up to the k-th count, found by partial selection, are
+    sorted; ties are broken by name so the result is deterministic.
+
+    Returns:
+        list: {'name', 'count'} dicts
+    """
+    import numpy as np
+
+    if not k:
+        return []
+    values = counts[positions] * (-1 if descending else 1)
+    kth = np.partition(values, k - 1)[k - 1]
+    candidates = positions[values <= kth]
+    ranked = sorted(candidates, key=lambda i: (-counts[i] if descending else counts[i], subjects[i]))
+    return [{'name': subjects[i], 'count': int(counts[i])} for i in ranked[:k]]
+
+
+def choice_profile(codes, subjects, top_k=TOP_K):
+    """
+    Summarize an upload's choices
+
+    Args:
+        codes: Integer array (pupils x option columns) of positions in
+            ``subjects``, -1 where the pupil made no choice
+        subjects: Subject names
+        top_k: Number of most and least popular subjects to keep
+
+    Returns:
+        dict: JSON-serializable profile (counts, choices per pupil,
+        incomplete pupils, fill rates per option column, top/bottom
+        subjects and Gini/entropy concentration of choices over subjects)
+    """
+    import numpy as np
+
+    codes = np.asarray(codes, dtype=np.int64)
+    pupils = codes.shape[0]
+    filled = codes >= 0
+    used_columns = np.flatnonzero(filled.any(axis=0))
+    per_pupil = filled.sum(axis=1)
+
+    counts = np.bincount(codes[filled], minlength=len(subjects))
+    chosen = np.flatnonzero(counts)
+    total = int(counts.sum())
+
+    k = min(top_k, len(chosen))
+    chosen_counts = counts[chosen]
+
+    # Concentration of choices over subjects: Gini (0 = even, ~1 = one
+    # subject takes everything) and Shannon entropy in bits
+    gini = entropy = normalized_entropy = 0.0
+    if total and len(chosen) > 1:
+        ordered = np.sort(chosen_counts).astype(np.float64)
+        n = len(ordered)
+        gini = float(2 * np.dot(np.arange(1, n + 1), ordered) / (n * total) - (n + 1) / n)
+        shares = ordered / total
+        entropy = float(-(shares * np.log2(shares)).sum())
+        normalized_entropy = entropy / np.log2(n)
+
+    return {
+        'pupils': pupils,
+        'total_choices': total,
+        'unique_subjects': len(chosen),
+        'option_columns': len(used_columns),
+        'mean_choices': round(float(per_pupil.mean()), 2) if pupils else 0,
+        'median_choices': float(np.median(per_pupil)) if pupils else 0,
+        'incomplete_pupils': int((per_pupil < len(used_columns)).sum()),
+        'empty_pupils': int((per_pupil == 0).sum()),
+        'fill_rates': {
+            OPTION_LETTERS[column]: round(float(filled[:, column].mean()) * 100, 1)
+            for column in used_columns
+        },
+        'average_per_subject': round(total / len(chosen), 2) if len(chosen) else 0,
+        'most_popular': _top_k(counts, subjects, chosen, k),
+        'least_popular': _top_k(counts, subjects, chosen, k, descending=False),
+        'gini': round(gini, 3),
+        'entropy': round(entropy, 3),
+        'normalized_entropy': round(float(normalized_entropy), 3),
+    }
+
+
+def frame_profile(df):
+    """Profile a standardized frame (its choice columns share one category index)"""
+    import numpy as np
+    from .data_processor import CHOICE_FIELDS
+
+    codes = np.column_stack([df[field].cat.codes.to_numpy() for field in CHOICE_FIELDS])
+    return choice_profile(codes, list(df[CHOICE_FIELDS[0]].cat.categories))
+
+
+def stored_profile(upload_id):
+    """Profile the stored choices of an upload's included pupils"""
+    import numpy as np
+
+    columns = [getattr(StudentChoice, name) for name in CHOICE_COLUMNS]
+    rows = db.session.execute(
+        select(*columns).where(StudentChoice.upload_id == upload_id,
+                               StudentChoice.included_in_analysis.is_(True))
+    ).all()
+
+    index = {}
+    codes = [[index.setdefault(value.strip(), len(index)) if value and value.strip() else -1
+              for value in row] for row in rows]
+    codes = np.array(codes, dtype=np.int64).reshape(len(rows), len(CHOICE_COLUMNS))
+    return choice_profile(codes, sorted(index, key=index.get))
+
+
+def refresh_statistics(upload):
+    """Recompute an upload's stored profile (caller commits)"""
+    upload.statistics = stored_profile(upload.id)
+    return upload.statistics
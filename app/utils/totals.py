@@ -0,0 +1,93 @@
+"""
+Set-based subject total calculations for processed uploads
+"""
+from sqlalchemy import func, insert, select, union_all
+from app import db
+from app.models import StudentChoice, SubjectChoice, CHOICE_COLUMNS
+from .user_stats import adjust_year_group_stats, upload_subject_totals
+
+
+def choice_values_query(upload_ids, included_only=True):
+    """
+    Build a query yielding one row per stored (non-empty) choice value.
+
+    The eight choice columns are stacked with UNION ALL so the database can
+    aggregate them in a single pass.
+
+    Args:
+        upload_ids: Iterable of DataUpload ids to read
+        included_only: Only include students flagged for analysis
+
+    Returns:
+        Subquery with ``upload_id`` and ``subject`` columns
+    """
+    upload_ids = list(upload_ids)
+    selects = []
+    for column_name in CHOICE_COLUMNS:
+        column = getattr(StudentChoice, column_name)
+        stmt = select(StudentChoice.upload_id.label('upload_id'),
+                      func.trim(column).label('subject'))\
+            .where(StudentChoice.upload_id.in_(upload_ids),
+                   column.is_not(None),
+                   func.trim(column) != '')
+        if included_only:
+            stmt = stmt.where(StudentChoice.included_in_analysis.is_(True))
+        selects.append(stmt)
+    return union_all(*selects).subquery()
+
+
+def count_subject_choices(upload_id):
+    """
+    Count choices per subject for an upload with a single GROUP BY query
+
+    Args:
+        upload_id: DataUpload id
+
+    Returns:
+        dict: {subject_name: count} for included students
+    """
+    values = choice_values_query([upload_id])
+    rows = db.session.execute(
+        select(values.c.subject, func.count()).group_by(values.c.subject)
+    ).all()
+    return {subject: count for subject, count in rows}
+
+
+def replace_subject_totals(upload, subject_counts, academic_year):
+    """
+    Replace the stored SubjectChoice totals for an upload.
+
+    The owner's dashboard stats are adjusted by the difference. Does not
+    commit; the caller owns the transaction.
+    """
+    old_subjects, old_choices = upload_subject_totals(upload.id)
+    SubjectChoice.query.filter_by(upload_id=upload.id)\
+        .delete(synchronize_session=False)
+    if subject_counts:
+        db.session.execute(insert(SubjectChoice), [
+            {
+                'year_group': upload.year_group,
+                'subject_name': subject,
+                'choice_count': count,
+                'academic_year': academic_year,
+                'upload_id': upload.id,
+            }
+            for subject, count in subject_counts.items()
+        ])
+    adjust_year_group_stats(upload.user_id, upload.year_group,
+                            subjects=len(subject_counts) - old_subjects,
+                            choices=sum(subject_counts.values()) - old_choices)
+
+
+def recompute_subject_totals(upload):
+    """
+    Recompute the SubjectChoice totals for an upload from its stored choices.
+
+    Does not commit; the caller owns the transaction.
+
+    Returns:
+        dict: {subject_name: count}
+    """
+    subject_counts = count_subject_choices(upload.id)
+    replace_subject_totals(upload, subject_counts, upload.academic_year)
+    return subject_counts
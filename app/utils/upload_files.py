@@ -0,0 +1,180 @@
+"""
+Storing and opening uploaded data files
+
+Uploads are streamed to disk in chunks while their SHA-256 is computed.
+Gzip- and zip-wrapped CSV files are stored as uploaded (typically ~10x
+smaller) and parsed straight from the archive; the decompressed size is
+capped both while saving (gzip) and while reading (gzip and zip) so a
+small archive cannot inflate without bound. Zip archives are checked
+against their central directory when saved.
+"""
+import gzip
+import hashlib
+import io
+import os
+import zipfile
+import zlib
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Upload extensions holding a compressed CSV
+COMPRESSED_EXTENSIONS = {'csv.gz', 'zip'}
+
+# Default cap on the decompressed size of a compressed upload
+MAX_DECOMPRESSED_LENGTH = 160 * 1024 * 1024
+
+
+class DecompressedSizeError(ValueError):
+    """Raised when a compressed upload inflates beyond the configured limit"""
+
+    @classmethod
+    def for_limit(cls, limit):
+        return cls(f'File is larger than {limit / (1024 * 1024):g}MB when decompressed')
+
+
+def file_extension(filename):
+    """Return a file's extension, treating ``.csv.gz`` as one extension"""
+    name = filename.lower()
+    if name.endswith('.csv.gz'):
+        return 'csv.gz'
+    return name.rsplit('.', 1)[1] if '.' in name else ''
+
+
+def save_upload(stream, filepath, max_decompressed_length, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Stream an upload to disk, hashing it and checking gzip payload size.
+
+    The partially written file is removed if the upload is rejected.
+
+    Args:
+        stream: Readable binary stream (e.g. ``FileStorage.stream``)
+        filepath: Destination path; ``.csv.gz`` files are inflated in memory
+            chunk by chunk and ``.zip`` directories are checked to enforce
+            ``max_decompressed_length``
+        max_decompressed_length: Maximum inflated size in bytes
+        chunk_size: Bytes read per chunk
+
+    Returns:
+        tuple: (sha256 hex digest, stored size in bytes)
+
+    Raises:
+        DecompressedSizeError: If the compressed CSV exceeds the limit
+        ValueError: If a compressed upload is corrupt
+    """
+    digest = hashlib.sha256()
+    size = 0
+    inflater = _GzipSizeCheck(max_decompressed_length) \
+        if file_extension(filepath) == 'csv.gz' else None
+    try:
+        with open(filepath, 'wb') as f:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                if inflater:
+                    inflater.feed(chunk)
+                f.write(chunk)
+        if inflater:
+            inflater.finish()
+        elif file_extension(filepath) == 'zip':
+            _check_zip(filepath, max_decompressed_length)
+    except Exception:
+        os.remove(filepath)
+        raise
+    return digest.hexdigest(), size
+
+
+class _GzipSizeCheck:
+    """Incrementally inflate a gzip stream, counting (and discarding) its output"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.inflated = 0
+        self._decompressor = zlib.decompressobj(wbits=31)
+
+    def feed(self, data):
+        try:
+            while data:
+                if self._decompressor.eof:
+                    # Concatenated gzip members
+                    self._decompressor = zlib.decompressobj(wbits=31)
+                # Bound each step so a highly compressed chunk cannot balloon in memory
+                output = self._decompressor.decompress(data, UPLOAD_CHUNK_SIZE)
+                self.inflated += len(output)
+                if self.inflated > self.limit:
+                    raise DecompressedSizeError.for_limit(self.limit)
+                data = self._decompressor.unconsumed_tail or self._decompressor.unused_data
+        except zlib.error as e:
+            raise ValueError(f'Invalid gzip file: {e}') from e
+
+    def finish(self):
+        if not self._decompressor.eof:
+            raise ValueError('Invalid gzip file: unexpected end of data')
+
+
+class _LimitedReader(io.RawIOBase):
+    """Readable wrapper raising DecompressedSizeError past ``limit`` bytes"""
+
+    def __init__(self, raw, limit):
+        self._raw = raw
+        self._remaining = limit
+        self._limit = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._raw.read(min(len(buffer), self._remaining + 1))
+        if len(data) > self._remaining:
+            raise DecompressedSizeError.for_limit(self._limit)
+        self._remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+def _zip_member(archive):
+    """Pick the single CSV member of a zip archive"""
+    members = [info for info in archive.infolist()
+               if not info.is_dir() and info.filename.lower().endswith('.csv')
+               and not os.path.basename(info.filename).startswith('._')]
+    if len(members) != 1:
+        raise ValueError('Zip files must contain exactly one CSV file')
+    return members[0]
+
+
+def _check_zip(filepath, limit):
+    """Validate a zip upload's CSV member from the archive directory"""
+    try:
+        with zipfile.ZipFile(filepath) as archive:
+            member = _zip_member(archive)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f'Invalid zip file: {e}') from e
+    if member.file_size > limit:
+        raise DecompressedSizeError.for_limit(limit)
+
+
+def open_compressed_csv(filepath, max_decompressed_length):
+    """
+    Open the CSV inside a ``.csv.gz`` or ``.zip`` upload for streaming reads.
+
+    Returns:
+        Binary file object yielding the decompressed CSV; close it when done
+    """
+    if file_extension(filepath) == 'csv.gz':
+        raw = gzip.open(filepath, 'rb')
+    else:
+        archive = zipfile.ZipFile(filepath)
+        try:
+            raw = archive.open(_zip_member(archive))
+        except Exception:
+            archive.close()
+            raise
+        # ZipExtFile keeps its own handle open; the archive can be closed
+        archive.close()
+    return io.BufferedReader(_LimitedReader(raw, max_decompressed_length), UPLOAD_CHUNK_SIZE)
@@ -0,0 +1,113 @@
+"""
+Maintained per-user dashboard statistics
+
+Counters are adjusted in the same transaction as the change they describe
+(upload, process, toggle, re-normalize, delete), so the dashboard only
+needs point reads. Call the adjust functions after the change has been
+made; if a user has no stats yet they are rebuilt from the current state
+instead, which already includes the change.
+"""
+from sqlalchemy import func, select, update
+from app import db
+from app.models import DataUpload, SubjectChoice, UserStats, UserYearGroupStats
+
+
+def rebuild_user_stats(user_id):
+    """Recompute all of a user's stats from their uploads (caller commits)"""
+    db.session.flush()
+    total_uploads, processed_uploads = db.session.execute(
+        select(func.count(DataUpload.id),
+               func.coalesce(func.sum(db.case((DataUpload.processed.is_(True), 1), else_=0)), 0))
+        .where(DataUpload.user_id == user_id, DataUpload.deleted_at.is_(None))
+    ).one()
+
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        stats = UserStats(user_id=user_id)
+        db.session.add(stats)
+    stats.total_uploads = total_uploads
+    stats.processed_uploads = processed_uploads
+
+    UserYearGroupStats.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    rows = db.session.execute(
+        select(SubjectChoice.year_group,
+               func.count(SubjectChoice.id),
+               func.coalesce(func.sum(SubjectChoice.choice_count), 0))
+        .join(DataUpload, DataUpload.id == SubjectChoice.upload_id)
+        .where(DataUpload.user_id == user_id, DataUpload.deleted_at.is_(None))
+        .group_by(SubjectChoice.year_group)
+    ).all()
+    for year_group, subject_count, total_choices in rows:
+        db.session.add(UserYearGroupStats(user_id=user_id, year_group=year_group,
+                                          subject_count=subject_count,
+                                          total_choices=total_choices))
+    db.session.flush()
+    return stats
+
+
+def get_user_stats(user_id):
+    """
+    Read a user's dashboard stats
+
+    Returns:
+        tuple: (UserStats, [(year_group, subject_count, total_choices), ...])
+    """
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        stats = rebuild_user_stats(user_id)
+        db.session.commit()
+
+    year_group_stats = db.session.execute(
+        select(UserYearGroupStats.year_group,
+               UserYearGroupStats.subject_count,
+               UserYearGroupStats.total_choices)
+        .where(UserYearGroupStats.user_id == user_id,
+               UserYearGroupStats.subject_count > 0)
+        .order_by(UserYearGroupStats.year_group)
+    ).all()
+    return stats, year_group_stats
+
+
+def adjust_user_stats(user_id, uploads=0, processed=0):
+    """Add deltas to a user's upload counters (caller commits)"""
+    db.session.flush()
+    result = db.session.execute(
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .values(total_uploads=UserStats.total_uploads + uploads,
+                processed_uploads=UserStats.processed_uploads + processed)
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        rebuild_user_stats(user_id)
+
+
+def adjust_year_group_stats(user_id, year_group, subjects=0, choices=0):
+    """Add deltas to a user's subject totals for a year group (caller commits)"""
+    if not subjects and not choices:
+        return
+    db.session.flush()
+    result = db.session.execute(
+        update(UserYearGroupStats)
+        .where(UserYearGroupStats.user_id == user_id,
+               UserYearGroupStats.year_group == year_group)
+        .values(subject_count=UserYearGroupStats.subject_count + subjects,
+                total_choices=UserYearGroupStats.total_choices + choices)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        return
+    if db.session.get(UserStats, user_id) is None:
+        rebuild_user_stats(user_id)
+    else:
+        db.session.add(UserYearGroupStats(user_id=user_id, year_group=year_group,
+                                          subject_count=subjects, total_choices=choices))
+
+
+def upload_subject_totals(upload_id):
+    """Return (SubjectChoice rows, summed choices) stored for an upload"""
+    return db.session.execute(
+        select(func.count(SubjectChoice.id),
+               func.coalesce(func.sum(SubjectChoice.choice_count), 0))
+        .where(SubjectChoice.upload_id == upload_id)
+    ).one()
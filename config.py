@@ -20,17 +20,69 @@ class Config:
     OAUTH_AUTHORIZATION_URL = os.environ.get('OAUTH_AUTHORIZATION_URL')
     OAUTH_TOKEN_URL = os.environ.get('OAUTH_TOKEN_URL')
     OAUTH_USERINFO_URL = os.environ.get('OAUTH_USERINFO_URL')
+    # Optional discovery document (.well-known/openid-configuration); fills in any unset URLs above
+    OAUTH_DISCOVERY_URL = os.environ.get('OAUTH_DISCOVERY_URL')
+    OAUTH_DISCOVERY_TTL = int(os.environ.get('OAUTH_DISCOVERY_TTL', 3600))
+    
+    # OAuth provider HTTP client (shared keep-alive connection pool)
+    OAUTH_CONNECT_TIMEOUT = float(os.environ.get('OAUTH_CONNECT_TIMEOUT', 3.05))
+    OAUTH_READ_TIMEOUT = float(os.environ.get('OAUTH_READ_TIMEOUT', 10))
+    OAUTH_MAX_RETRIES = int(os.environ.get('OAUTH_MAX_RETRIES', 2))
+    OAUTH_POOL_CONNECTIONS = int(os.environ.get('OAUTH_POOL_CONNECTIONS', 4))
+    OAUTH_POOL_MAXSIZE = int(os.environ.get('OAUTH_POOL_MAXSIZE', 16))
     
     # File Upload Configuration
     UPLOAD_FOLDER = str(basedir / 'data' / 'uploads')
-    ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
+    ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls', 'csv.gz', 'zip'}
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    # Limit on the inflated size of gzip/zip-compressed CSV uploads
+    MAX_DECOMPRESSED_LENGTH = int(os.environ.get('MAX_DECOMPRESSED_LENGTH', 160 * 1024 * 1024))
+    
+    # Precomputed analytics snapshots (gzip JSON) served to read-only views
+    SNAPSHOT_FOLDER = str(basedir / 'data' / 'processed')
+    # Memory-mapped per-upload choice matrices (.npy) read by the analyses
+    MATRIX_FOLDER = str(basedir / 'data' / 'processed' / 'matrices')
+    
+    # Uploaded files are parsed in child processes with CPU-time, memory and
+    # wall-clock limits (PARSE_ISOLATED=false parses in the web worker)
+    PARSE_ISOLATED = os.environ.get('PARSE_ISOLATED', 'true').lower() in ('1', 'true', 'yes')
+    PARSE_WORKERS = int(os.environ.get('PARSE_WORKERS', 2))  # concurrent parses per web process
+    PARSE_TIMEOUT = float(os.environ.get('PARSE_TIMEOUT', 60))  # seconds
+    PARSE_CPU_SECONDS = float(os.environ.get('PARSE_CPU_SECONDS', 30))
+    PARSE_MEMORY_MB = int(os.environ.get('PARSE_MEMORY_MB', 1024))
+    
+    # Uploads listed per dashboard page
+    DASHBOARD_RECENT_UPLOADS = int(os.environ.get('DASHBOARD_RECENT_UPLOADS', 20))
+    
+    # Option-column arrangement search run by ?optimize=1, in the request
+    # (`flask optimize-columns` runs longer searches in parallel)
+    OPTIMIZER_ITERATIONS = int(os.environ.get('OPTIMIZER_ITERATIONS', 5000))
+    OPTIMIZER_SECONDS = float(os.environ.get('OPTIMIZER_SECONDS', 5))
     
     # Database Configuration (SQLite for development)
     # For Windows, SQLite needs 4 slashes before absolute paths
     db_file = basedir / 'instance' / 'app.db'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or f'sqlite:///{db_file.as_posix()}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Create missing tables when the app starts; otherwise run `flask init-db`
+    AUTO_CREATE_DB = os.environ.get('AUTO_CREATE_DB', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Deleted uploads are purged in bounded batches by a background thread
+    # (set PURGE_IN_BACKGROUND=false to rely on `flask purge-uploads` instead)
+    PURGE_IN_BACKGROUND = os.environ.get('PURGE_IN_BACKGROUND', 'true').lower() in ('1', 'true', 'yes')
+    PURGE_INTERVAL = int(os.environ.get('PURGE_INTERVAL', 300))  # seconds
+    PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 1000))
+    PURGE_VACUUM_FREE_FRACTION = float(os.environ.get('PURGE_VACUUM_FREE_FRACTION', 0.25))
+    
+    # Computed analytics cache: size-bounded LRU per worker process, plus an
+    # optional shared backend (redis://... or memory:// for a local stand-in)
+    ANALYTICS_CACHE_BYTES = int(os.environ.get('ANALYTICS_CACHE_BYTES', 64 * 1024 * 1024))
+    ANALYTICS_CACHE_URL = os.environ.get('ANALYTICS_CACHE_URL', '')
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 3600))  # shared backend only
+    
+    # Logged-in user cache (per worker process)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
     
     # Session Configuration
     SESSION_TYPE = 'filesystem'
@@ -45,10 +97,24 @@ class DevelopmentConfig(Config):
 class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
+    # Keep schema creation out of each worker's boot; run `flask init-db` on deploy
+    AUTO_CREATE_DB = os.environ.get('AUTO_CREATE_DB', 'false').lower() in ('1', 'true', 'yes')
+
+
+class TestingConfig(Config):
+    """Testing configuration (tests point the data folders at temporary directories)"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    AUTO_CREATE_DB = True
+    PURGE_IN_BACKGROUND = False
+    PARSE_ISOLATED = False
+    # Exercise the shared-cache path with the in-process stand-in
+    ANALYTICS_CACHE_URL = 'memory://'
 
 
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
+    'testing': TestingConfig,
     'default': DevelopmentConfig
 }
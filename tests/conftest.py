@@ -0,0 +1,69 @@
+"""
+Shared test fixtures
+"""
+import os
+import pytest
+from config import TestingConfig
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """An app on a fresh in-memory database, with its data folders under tmp_path"""
+    from app import create_app, db
+
+    monkeypatch.setattr(TestingConfig, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(TestingConfig, 'SNAPSHOT_FOLDER', str(tmp_path / 'processed'))
+    monkeypatch.setattr(TestingConfig, 'MATRIX_FOLDER', str(tmp_path / 'processed' / 'matrices'))
+    app = create_app('testing')
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_id(app):
+    """Id of a stored user"""
+    from app import db
+    from app.models import User
+
+    with app.app_context():
+        user = User(email='teacher@example.com', name='Teacher')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def logged_in(client, user_id):
+    """A test client logged in as ``user_id``"""
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+@pytest.fixture
+def upload_file(app, logged_in, tmp_path):
+    """Upload and process a generated data file through the web routes; returns the upload id"""
+    from app.models import DataUpload
+    from app.utils.loadtest import generate_choices_csv
+
+    def upload(name='S4 Options 2024-25.csv', year_group='S4', pupils=60, seed=0):
+        path = generate_choices_csv(str(tmp_path / name), pupils, seed=seed)
+        with open(path, 'rb') as f:
+            response = logged_in.post('/analysis/upload', content_type='multipart/form-data',
+                                      data={'year_group': year_group, 'file': (f, os.path.basename(path))})
+        assert response.status_code == 302
+        with app.app_context():
+            upload_id = DataUpload.query.order_by(DataUpload.id.desc()).first().id
+        response = logged_in.get(f'/analysis/process/{upload_id}?skip_review=1')
+        assert response.status_code == 302
+        return upload_id
+
+    return upload
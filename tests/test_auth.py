@@ -0,0 +1,74 @@
+"""
+OAuth login flow against the local stub identity provider
+"""
+from urllib.parse import parse_qs, urlsplit
+import pytest
+import requests
+from app.auth.http_client import reset_http_session
+from app.auth.stub_provider import StubProviderServer
+from app.cli import stub_login
+from app.models import User
+
+
+@pytest.fixture
+def provider(app):
+    """A running stub provider that the app's OAuth client points at"""
+    with StubProviderServer() as server:
+        app.config.update(server.config())
+        reset_http_session()
+        yield server
+    reset_http_session()
+
+
+@pytest.fixture
+def provider_session():
+    with requests.Session() as session:
+        yield session
+
+
+def test_login_creates_user_and_opens_dashboard(app, provider, provider_session, capsys):
+    client, _ = stub_login(app, provider_session, 'ada.lovelace@example.com')
+
+    with app.app_context():
+        user = User.query.filter_by(email='ada.lovelace@example.com').one()
+        assert user.name == 'Ada Lovelace'
+        assert user.oauth_id == 'stub-ada.lovelace'
+        assert user.last_login is not None
+    assert client.get('/dashboard').status_code == 200
+    # User info is not written to stdout
+    assert 'ada.lovelace' not in capsys.readouterr().out
+
+
+def test_login_again_reuses_user(app, provider, provider_session):
+    stub_login(app, provider_session, 'ada.lovelace@example.com')
+    stub_login(app, provider_session, 'ada.lovelace@example.com')
+
+    with app.app_context():
+        assert User.query.filter_by(email='ada.lovelace@example.com').count() == 1
+
+
+def test_callback_rejects_wrong_state(app, provider, provider_session):
+    client = app.test_client()
+    client.get('/auth/login')
+
+    response = client.get('/auth/callback', query_string={'code': 'x', 'state': 'forged'})
+
+    assert response.status_code == 302
+    assert client.get('/dashboard').status_code == 302  # still logged out
+    with app.app_context():
+        assert User.query.count() == 0
+
+
+def test_callback_rejects_unknown_code(app, provider, provider_session, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the callback writes oauth_error.log to the working directory
+    client = app.test_client()
+    response = client.get('/auth/login')
+    state = parse_qs(urlsplit(response.headers['Location']).query)['state'][0]
+
+    response = client.get('/auth/callback', query_string={'code': 'unknown', 'state': state})
+
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert any('Authentication failed' in message for _, message in session['_flashes'])
+    with app.app_context():
+        assert User.query.count() == 0
@@ -0,0 +1,48 @@
+"""
+Analytics cache through the memory:// shared backend
+"""
+from app.models import StudentChoice
+from app.utils.cache import MemoryBackend, analytics_cache
+
+
+def test_testing_config_uses_memory_backend(app):
+    assert app.config['ANALYTICS_CACHE_URL'] == 'memory://'
+    assert isinstance(analytics_cache.backend, MemoryBackend)
+
+
+def test_shared_entry_is_reused_after_local_entries_are_dropped(app):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'answer': 42}
+
+    assert analytics_cache.get_or_set(('test', 1), compute) == {'answer': 42}
+    # Another worker process starts with an empty local LRU
+    analytics_cache.clear()
+    assert analytics_cache.get_or_set(('test', 1), compute) == {'answer': 42}
+    assert len(calls) == 1
+
+
+def test_hits_are_copies(app):
+    analytics_cache.set(('test', 2), {'subjects': ['Maths']})
+    analytics_cache.get(('test', 2))['subjects'].append('Physics')
+    assert analytics_cache.get(('test', 2)) == {'subjects': ['Maths']}
+
+
+def test_route_results_are_shared_and_follow_the_data_version(app, logged_in, upload_file):
+    upload_id = upload_file()
+    url = f'/analysis/subject-coincidence/{upload_id}/data'
+    first = logged_in.get(url).get_json()
+
+    analytics_cache.clear()
+    assert len(analytics_cache.local) == 0
+    assert logged_in.get(url).get_json() == first
+    assert len(analytics_cache.local) > 0  # copied from the shared backend
+
+    # Excluding a student bumps the data version, so the old entry is not served
+    with app.app_context():
+        student = StudentChoice.query.filter_by(upload_id=upload_id).first()
+        student_id = student.id
+    logged_in.post(f'/analysis/toggle_student/{student_id}')
+    assert logged_in.get(url).get_json() != first
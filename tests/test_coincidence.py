@@ -0,0 +1,53 @@
+"""
+Subject pair counts
+"""
+from sqlalchemy import event
+from app import db
+from app.models import DataUpload, StudentChoice, SubjectCoincidence
+
+
+def _writes_during(app, action):
+    """Run action() and return the INSERT/UPDATE/DELETE statements it executed"""
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        action()
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    return statements
+
+
+def test_reading_an_upload_without_pair_rows_does_not_write(app, logged_in, upload_file):
+    upload_id = upload_file()
+    with app.app_context():
+        db.session.execute(db.update(StudentChoice).where(StudentChoice.upload_id == upload_id)
+                           .values(included_in_analysis=False))
+        SubjectCoincidence.query.filter_by(upload_id=upload_id).delete()
+        db.session.commit()
+
+    url = f'/analysis/subject-coincidence/{upload_id}/data'
+    writes = _writes_during(app, lambda: [logged_in.get(url) for _ in range(2)])
+
+    assert writes == []
+    with app.app_context():
+        assert SubjectCoincidence.query.filter_by(upload_id=upload_id).count() == 0
+
+
+def test_missing_rows_are_counted_in_memory(app, logged_in, upload_file):
+    upload_id = upload_file()
+    url = f'/analysis/subject-coincidence/{upload_id}/data'
+    stored = logged_in.get(url).get_json()
+    with app.app_context():
+        SubjectCoincidence.query.filter_by(upload_id=upload_id).delete()
+        # A new data version, so the cached result is not served
+        db.session.get(DataUpload, upload_id).bump_data_version()
+        db.session.commit()
+
+    assert logged_in.get(url).get_json() == stored
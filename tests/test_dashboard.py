@@ -0,0 +1,38 @@
+"""
+Dashboard upload list
+"""
+from datetime import datetime, timedelta
+from app import db
+from app.models import DataUpload
+
+
+def _add_uploads(app, user_id, count):
+    with app.app_context():
+        start = datetime(2024, 1, 1)
+        for index in range(count):
+            db.session.add(DataUpload(filename=f'u{index}.csv', original_filename=f'Upload {index:02d}.csv',
+                                      file_type='csv', year_group='S4', user_id=user_id,
+                                      upload_date=start + timedelta(days=index)))
+        db.session.commit()
+
+
+def test_uploads_are_paginated(app, logged_in, user_id):
+    app.config['DASHBOARD_RECENT_UPLOADS'] = 2
+    _add_uploads(app, user_id, 5)
+
+    pages = [logged_in.get(f'/dashboard?page={page}').get_data(as_text=True) for page in (1, 2, 3)]
+
+    listed = [[index for index in range(5) if f'Upload {index:02d}.csv' in html] for html in pages]
+    assert listed == [[3, 4], [1, 2], [0]]
+    assert 'page=2' in pages[0] and 'page=0' not in pages[0]
+    assert 'page=1' in pages[1] and 'page=3' in pages[1]
+    assert 'page=4' not in pages[2]
+
+
+def test_page_past_the_end_redirects_to_first_page(app, logged_in, user_id):
+    _add_uploads(app, user_id, 1)
+
+    response = logged_in.get('/dashboard?page=9')
+
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/dashboard')
@@ -0,0 +1,21 @@
+"""
+CSV and XLSX exports
+"""
+import csv
+import io
+from app.models import StudentChoice
+
+
+def test_results_percentages_use_included_students(app, logged_in, upload_file):
+    upload_id = upload_file('S4 Options 2024-25.csv', pupils=40)
+    with app.app_context():
+        student_id = StudentChoice.query.filter_by(upload_id=upload_id).first().id
+    logged_in.post(f'/analysis/toggle_student/{student_id}')
+
+    response = logged_in.get(f'/analysis/export/{upload_id}/results/csv')
+    exported = {row[1]: float(row[3]) for row in list(csv.reader(io.StringIO(response.get_data(as_text=True))))[1:]}
+
+    snapshot = logged_in.get('/analysis/summary/S4/2024-25/data').get_json()
+    upload = next(entry for entry in snapshot['uploads'] if entry['id'] == upload_id)
+    assert upload['included_students'] == 39
+    assert exported == {subject['name']: subject['percentage'] for subject in upload['subjects']}
@@ -0,0 +1,49 @@
+"""
+Purging deleted uploads
+"""
+import os
+import time
+from datetime import datetime
+from app import create_app, db
+from app.models import DataUpload
+from config import TestingConfig
+
+
+def test_uploads_deleted_before_a_restart_are_purged_at_startup(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path}/app.db')
+    monkeypatch.setattr(TestingConfig, 'UPLOAD_FOLDER', str(tmp_path / 'uploads'))
+    monkeypatch.setattr(TestingConfig, 'SNAPSHOT_FOLDER', str(tmp_path / 'processed'))
+    monkeypatch.setattr(TestingConfig, 'MATRIX_FOLDER', str(tmp_path / 'processed' / 'matrices'))
+    monkeypatch.setattr(TestingConfig, 'PURGE_INTERVAL', 3600)
+
+    # An upload deleted by a process that stopped before purging it
+    app = create_app('testing')
+    with app.app_context():
+        from app.models import User
+        user = User(email='teacher@example.com', name='Teacher')
+        db.session.add(user)
+        db.session.commit()
+        upload = DataUpload(filename='old.csv', original_filename='old.csv', file_type='csv',
+                            year_group='S4', user_id=user.id, deleted_at=datetime.utcnow())
+        db.session.add(upload)
+        db.session.commit()
+        upload_id = upload.id
+        db.session.remove()
+    stored_file = tmp_path / 'uploads' / 'old.csv'
+    stored_file.write_text('Forename,Surname\n')
+    assert 'upload_purge' not in app.extensions
+
+    monkeypatch.setattr(TestingConfig, 'PURGE_IN_BACKGROUND', True)
+    restarted = create_app('testing')
+    assert 'upload_purge' in restarted.extensions
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        with restarted.app_context():
+            remaining = db.session.get(DataUpload, upload_id)
+            db.session.remove()
+        if remaining is None:
+            break
+        time.sleep(0.05)
+    assert remaining is None
+    assert not os.path.exists(stored_file)
@@ -0,0 +1,22 @@
+"""
+Startup cost: heavy modules must only load when a request needs them
+"""
+import os
+import subprocess
+import sys
+from app.cli import LAZY_MODULES, STARTUP_SCRIPT
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_create_app_does_not_import_lazy_modules():
+    # A fresh interpreter: other tests load numpy and pandas into this one
+    script = STARTUP_SCRIPT.format(config_name='production', modules=LAZY_MODULES)
+    env = dict(os.environ, DATABASE_URL='sqlite://', AUTO_CREATE_DB='false',
+               PURGE_IN_BACKGROUND='false')
+    result = subprocess.run([sys.executable, '-c', script], cwd=PROJECT_ROOT, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+    loaded = result.stdout.splitlines()[-1].split()
+    assert loaded == [], f'Imported at startup: {loaded}'